@@ -2,14 +2,24 @@
 Endpoints relacionados con órdenes de Bitget.
 """
 
-from fastapi import APIRouter, HTTPException, Query
-from typing import Dict, Any
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, HTTPException, Query
+from typing import Dict, Any, List, Literal, Optional
 from app.services.orders_service import OrdersService, OrderRequest
 
-router = APIRouter(prefix="/orders", tags=["orders"])
-
 orders_service = OrdersService()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """La ingesta en segundo plano vive lo que vive la aplicación que incluye este router."""
+    orders_service.start_background_jobs()
+    try:
+        yield
+    finally:
+        orders_service.stop_background_jobs()
+
+router = APIRouter(prefix="/orders", tags=["orders"], lifespan=lifespan)
+
 @router.post("", response_model=Dict[str, Any])
 def start_orders(req: OrderRequest):
     """Inicia la ejecución orquestada invocando la Lambda coordinadora."""
@@ -25,6 +35,16 @@ def get_orders_status_path(execution_arn: str):
     """Consulta estado por path param. Automáticamente guarda los datos en base de datos."""
     return orders_service.get_execution_status(execution_arn)
 
+@router.post("/{execution_arn}/completed", response_model=Dict[str, Any])
+def notify_execution_completed(execution_arn: str):
+    """Notificación de fin de ejecución: encola su ingesta en segundo plano y responde de inmediato."""
+    return orders_service.notify_execution_completed(execution_arn)
+
+@router.get("/{execution_arn}/ingest", response_model=Dict[str, Any])
+def get_ingest_progress(execution_arn: str):
+    """Progreso de la ingesta en segundo plano (estado del trabajo, órdenes insertadas, shards)."""
+    return orders_service.get_ingest_progress(execution_arn)
+
 
 @router.post("/{execution_arn}/save-from-url", response_model=Dict[str, Any])
 def save_data_from_public_url(
@@ -42,3 +62,27 @@ def get_database_data(
 ):
     """Obtiene los datos guardados en la base de datos para una ejecución específica con paginación de órdenes."""
     return orders_service.get_database_data(execution_arn, skip, limit)
+
+@router.get("/{execution_arn}/stats", response_model=Dict[str, Any])
+def get_execution_stats(
+    execution_arn: str,
+    granularity: Literal["hourly", "daily"] = Query("daily", description="Tamaño del bucket (UTC)"),
+    symbol: Optional[str] = Query(None, description="Filtrar por símbolo"),
+    start_ms: Optional[int] = Query(None, description="Inicio del rango (ms, inicio del bucket)"),
+    end_ms: Optional[int] = Query(None, description="Fin del rango (ms, inicio del bucket)")
+):
+    """Rollups por símbolo y hora/día (conteo, volumen base/quote, fees, compra/venta) sin consultar la tabla de órdenes."""
+    return orders_service.get_execution_stats(execution_arn, granularity, symbol, start_ms, end_ms)
+
+@router.get("/{execution_arn}/query", response_model=Dict[str, Any])
+def query_execution_orders(
+    execution_arn: str,
+    symbol: Optional[List[str]] = Query(None, description="Símbolos a incluir (se puede repetir)"),
+    start_ms: Optional[int] = Query(None, description="Inicio del rango de cTime (ms)"),
+    end_ms: Optional[int] = Query(None, description="Fin del rango de cTime (ms)"),
+    side: Optional[str] = Query(None, description="Lado de la orden (buy, sell, ...)"),
+    skip: int = Query(0, ge=0, description="Número de registros a saltar"),
+    limit: int = Query(100, ge=1, le=1000, description="Número máximo de registros a retornar")
+):
+    """Consulta las órdenes directamente sobre el resultado en S3, sin esperar la ingesta a la base de datos."""
+    return orders_service.query_execution_orders(execution_arn, symbol, start_ms, end_ms, side, skip, limit)
@@ -33,6 +33,22 @@ class Config:
     BITGET_API_SECRET = os.getenv("BITGET_API_SECRET")
     BITGET_PASSPHRASE = os.getenv("BITGET_PASSPHRASE")
 
+    # Ingesta de órdenes: filas por INSERT executemany (y por commit)
+    ORDERS_INGEST_CHUNK_SIZE = int(os.getenv("ORDERS_INGEST_CHUNK_SIZE", "5000"))
+    # Ingesta por shards (un símbolo por shard) de resultados con manifest: conexiones en paralelo
+    INGEST_DB_CONNECTIONS = int(os.getenv("INGEST_DB_CONNECTIONS", "4"))  # 1 = un solo stream
+    INGEST_SHARD_RETRIES = int(os.getenv("INGEST_SHARD_RETRIES", "2"))
+    # Ingesta en segundo plano: el GET de estado responde sin esperar la ingesta
+    INGEST_BACKGROUND = os.getenv("INGEST_BACKGROUND", "true").lower() == "true"
+    INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+    INGEST_JOB_MAX_ATTEMPTS = int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", "5"))  # ingestas fallidas antes de rendirse
+    INGEST_POLL_BASE_SECONDS = float(os.getenv("INGEST_POLL_BASE_SECONDS", "5"))  # backoff sobre ejecuciones RUNNING
+    INGEST_POLL_MAX_SECONDS = float(os.getenv("INGEST_POLL_MAX_SECONDS", "300"))
+    INGEST_JOB_STALE_SECONDS = float(os.getenv("INGEST_JOB_STALE_SECONDS", "3600"))  # "running" más viejo: proceso caído
+
+    # Consultas directas sobre los resultados en S3
+    RESULTS_CACHE_MAX_ORDERS = int(os.getenv("RESULTS_CACHE_MAX_ORDERS", "200000"))
+
     # Logging Configuration
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
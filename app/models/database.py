@@ -2,6 +2,7 @@
 This file is defensive: it works even when SQLAlchemy is not installed (useful for quick local checks).
 When SQLAlchemy is available and DATABASE_URL is configured, models and helpers are functional.
 """
+import time
 from datetime import datetime, timezone, timedelta
 from app.core.config import config
 
@@ -19,7 +20,7 @@ try:
     from sqlalchemy import Column, Integer, String, DateTime, Text, BigInteger, Float, text, UniqueConstraint
     from sqlalchemy.ext.declarative import declarative_base
     from sqlalchemy.orm import sessionmaker
-    from sqlalchemy import create_engine
+    from sqlalchemy import create_engine, func, insert, inspect, select
     _HAS_SQLALCHEMY = True
 except Exception:
     _HAS_SQLALCHEMY = False
@@ -64,6 +65,9 @@ if _HAS_SQLALCHEMY:
         public_url = Column(Text)
         result_data = Column(Text)
         processing_time_seconds = Column(Float)
+        # Estado terminal ya ingerido: las consultas de estado se responden con status_response
+        ingested_at = Column(DateTime)
+        status_response = Column(Text)
         created_at = Column(DateTime, default=get_bogota_now)
         updated_at = Column(DateTime, default=get_bogota_now, onupdate=get_bogota_now)
 
@@ -138,6 +142,43 @@ if _HAS_SQLALCHEMY:
         created_at = Column(DateTime, default=get_bogota_now)
 
 
+    class IngestShard(Base):
+        """Progreso de la ingesta por shard (un símbolo del resultado) para reintentar solo los que fallan"""
+        __tablename__ = "ingest_shards"
+        __table_args__ = (
+            UniqueConstraint("execution_arn", "shard", name="u_execution_shard"),
+        )
+
+        id = Column(Integer, primary_key=True, autoincrement=True)
+        execution_arn = Column(String(255), nullable=False, index=True)
+        shard = Column(String(100), nullable=False)
+        status = Column(String(20), nullable=False, default="pending")  # pending/running/done/failed
+        rows = Column(Integer, default=0)
+        attempts = Column(Integer, default=0)
+        error = Column(Text)
+        seconds = Column(Float)
+        updated_at = Column(DateTime, default=get_bogota_now, onupdate=get_bogota_now)
+
+
+    class IngestJob(Base):
+        """Trabajo de ingesta en segundo plano de una ejecución (ver app.services.ingest_jobs)"""
+        __tablename__ = "ingest_jobs"
+
+        id = Column(Integer, primary_key=True, autoincrement=True)
+        execution_arn = Column(String(255), unique=True, nullable=False, index=True)
+        status = Column(String(20), nullable=False, default="queued")  # queued/waiting/running/done/failed
+        execution_status = Column(String(50))  # último estado visto en Step Functions
+        polls = Column(Integer, default=0)      # consultas con la ejecución todavía RUNNING
+        attempts = Column(Integer, default=0)   # ingestas intentadas
+        orders_saved = Column(Integer)
+        error = Column(Text)
+        next_check_at = Column(DateTime)
+        started_at = Column(DateTime)
+        finished_at = Column(DateTime)
+        created_at = Column(DateTime, default=get_bogota_now)
+        updated_at = Column(DateTime, default=get_bogota_now, onupdate=get_bogota_now)
+
+
     # Configuración de la base de datos
     DATABASE_URL = config.DATABASE_URL
     if not DATABASE_URL:
@@ -147,6 +188,21 @@ if _HAS_SQLALCHEMY:
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+    def _add_missing_columns():
+        """Agrega a las tablas existentes las columnas nullable nuevas del modelo (create_all no lo hace)."""
+        existing_tables = set(inspect(engine).get_table_names())
+        with engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                if table.name not in existing_tables:
+                    continue
+                existing = {c["name"] for c in inspect(connection).get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing and column.nullable:
+                        column_type = column.type.compile(dialect=engine.dialect)
+                        connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                        print(f"Columna agregada: {table.name}.{column.name}")
+
+
     def create_tables():
         """Crear todas las tablas en la base de datos"""
         try:
@@ -154,6 +210,7 @@ if _HAS_SQLALCHEMY:
             print(f"URL: {DATABASE_URL[:50]}..." if DATABASE_URL else "URL no configurada")
 
             Base.metadata.create_all(bind=engine)
+            _add_missing_columns()
             print("Tablas de base de datos creadas/verificadas correctamente")
 
             # Verificar conexión con una consulta simple
@@ -220,8 +277,8 @@ if _HAS_SQLALCHEMY:
         """Bulk insert orders for an execution.
 
         orders is a list of dict-like objects from Bitget. This function will map common fields to the
-        Order model columns. Duplicate (execution_arn, order_id) entries are skipped.
-        Returns number of rows inserted.
+        Order model columns. Duplicate (execution_arn, order_id) entries are skipped (updated on MySQL).
+        Returns number of rows written.
         """
         if not orders:
             return 0
@@ -276,27 +333,103 @@ if _HAS_SQLALCHEMY:
         if not mappings:
             return 0
 
-        inserted = 0
-        try:
-            # Use bulk insert mappings; unique constraint will raise on duplicates in many DBs.
-            session.bulk_insert_mappings(Order, mappings)
-            session.flush()
-            inserted = len(mappings)
-        except Exception:
-            # Fallback: try inserting one-by-one to skip duplicates gracefully
-            session.rollback()
-            inserted = 0
-            for m in mappings:
-                try:
-                    o = Order(**m)
-                    session.add(o)
-                    session.flush()
-                    inserted += 1
-                except Exception:
-                    session.rollback()
-                    continue
+        return ingest_order_rows(session, mappings)["rows"]
+
+
+    # Columnas que no se pisan cuando la orden ya existe (MySQL ON DUPLICATE KEY UPDATE)
+    _ORDER_KEY_COLUMNS = ("id", "execution_arn", "order_id", "created_at")
+
+
+    def order_insert_statement(dialect_name: str):
+        """INSERT de órdenes que tolera duplicados (execution_arn, order_id) según el dialecto.
 
-        return inserted
+        MySQL: ON DUPLICATE KEY UPDATE (la última versión de la orden gana).
+        SQLite / PostgreSQL: ON CONFLICT DO NOTHING. Otros: INSERT simple.
+        """
+        table = Order.__table__
+        if dialect_name in ("mysql", "mariadb"):
+            from sqlalchemy.dialects.mysql import insert as mysql_insert
+            stmt = mysql_insert(table)
+            return stmt.on_duplicate_key_update(
+                {c.name: stmt.inserted[c.name] for c in table.columns if c.name not in _ORDER_KEY_COLUMNS}
+            )
+        if dialect_name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+            return sqlite_insert(table).on_conflict_do_nothing(index_elements=["execution_arn", "order_id"])
+        if dialect_name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as pg_insert
+            return pg_insert(table).on_conflict_do_nothing(index_elements=["execution_arn", "order_id"])
+        return insert(table)
+
+
+    def _count_existing_orders(session, chunk) -> int:
+        """Cuántas claves (execution_arn, order_id) distintas del bloque ya están en `orders`."""
+        order_ids = {}
+        for row in chunk:
+            order_ids.setdefault(row["execution_arn"], set()).add(row["order_id"])
+        table = Order.__table__
+        return sum(
+            session.execute(
+                select(func.count()).select_from(table)
+                .where(table.c.execution_arn == execution_arn, table.c.order_id.in_(ids))
+            ).scalar()
+            for execution_arn, ids in order_ids.items()
+        )
+
+
+    def ingest_order_rows(session, rows, chunk_size: int = None):
+        """Inserta filas de `orders` (dicts con las columnas de Order) con executemany de Core.
+
+        Va por bloques de `chunk_size` filas (config.ORDERS_INGEST_CHUNK_SIZE) con un commit
+        por bloque, sin objetos ORM ni identity map. Las filas sin order_id o symbol se
+        descartan. `rows` cuenta solo las órdenes nuevas: las que el motor descartó o
+        actualizó por duplicadas van en `duplicates`. Retorna {"rows", "duplicates",
+        "skipped", "chunks", "seconds", "rows_per_second"}.
+        """
+        chunk_size = max(1, int(chunk_size or config.ORDERS_INGEST_CHUNK_SIZE))
+        dialect_name = session.get_bind().dialect.name
+        stmt = order_insert_statement(dialect_name)
+        # ON DUPLICATE KEY UPDATE cuenta 2 filas por duplicado actualizado: ahí se cuentan las claves ya existentes
+        count_existing = dialect_name in ("mysql", "mariadb")
+        started = time.perf_counter()
+        written = duplicates = skipped = chunks = 0
+        chunk = []
+
+        def flush():
+            nonlocal written, duplicates, chunks
+            if count_existing:
+                unique = len({(row["execution_arn"], row["order_id"]) for row in chunk})
+                inserted = unique - _count_existing_orders(session, chunk)
+                session.execute(stmt, chunk)
+            else:
+                inserted = session.execute(stmt, chunk).rowcount
+                if inserted is None or inserted < 0:  # el driver no informa filas afectadas
+                    inserted = len(chunk)
+            session.commit()
+            written += inserted
+            duplicates += len(chunk) - inserted
+            chunks += 1
+            chunk.clear()
+
+        for row in rows:
+            if not row.get("order_id") or not row.get("symbol"):
+                skipped += 1
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+
+        seconds = time.perf_counter() - started
+        return {
+            "rows": written,
+            "duplicates": duplicates,
+            "skipped": skipped,
+            "chunks": chunks,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(written / seconds) if seconds > 0 else written,
+        }
 else:
     # SQLAlchemy missing: provide safe no-op implementations and simpler helpers
     def create_tables():
@@ -315,5 +448,9 @@ else:
         print("[db] SQLAlchemy not installed; save_orders_bulk is a no-op")
         return 0
 
+    def ingest_order_rows(*args, **kwargs):
+        print("[db] SQLAlchemy not installed; ingest_order_rows is a no-op")
+        return {"rows": 0, "duplicates": 0, "skipped": 0, "chunks": 0, "seconds": 0.0, "rows_per_second": 0}
+
 
 
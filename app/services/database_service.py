@@ -1,17 +1,101 @@
 import time
+import gzip
 import requests
 import json
 import boto3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, List
+from functools import lru_cache
+from urllib.parse import urlparse
+from typing import Dict, Any, Iterable, Iterator, List, Optional
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
-from app.models.database import ExecutionResult, Order, ProcessingLog, get_db_session, create_tables, get_bogota_now
+from app.models.database import (
+    ExecutionResult, IngestJob, IngestShard, Order, ProcessingLog, get_db_session, create_tables, get_bogota_now,
+    ingest_order_rows,
+)
+from lambda_functions.common.order_stats import rollup_rows
+from lambda_functions.common.result_writer import is_manifest_key
+from app.services.ingest_stream import background, open_orders
+from app.core.config import config
 import logging
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _as_ms(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+def _order_row(execution_arn: str, order_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Fila de la tabla orders a partir de una orden de Bitget."""
+    return {
+        "execution_arn": execution_arn,
+        "symbol": order_data.get("symbol"),
+        "size": order_data.get("size"),
+        "order_id": order_data.get("orderId"),
+        "client_oid": order_data.get("clientOid"),
+        "base_volume": order_data.get("baseVolume"),
+        "fee": order_data.get("fee"),
+        "price": order_data.get("price"),
+        "price_avg": order_data.get("priceAvg"),
+        "status": order_data.get("status"),
+        "side": order_data.get("side"),
+        "force": order_data.get("force"),
+        "total_profits": order_data.get("totalProfits"),
+        "pos_side": order_data.get("posSide"),
+        "margin_coin": order_data.get("marginCoin"),
+        "quote_volume": order_data.get("quoteVolume"),
+        "leverage": order_data.get("leverage"),
+        "margin_mode": order_data.get("marginMode"),
+        "enter_point_source": order_data.get("enterPointSource"),
+        "trade_side": order_data.get("tradeSide"),
+        "pos_mode": order_data.get("posMode"),
+        "order_type": order_data.get("orderType"),
+        "order_source": order_data.get("orderSource"),
+        "preset_stop_surplus_price": order_data.get("presetStopSurplusPrice"),
+        "preset_stop_loss_price": order_data.get("presetStopLossPrice"),
+        "pos_avg": order_data.get("posAvg"),
+        "reduce_only": order_data.get("reduceOnly"),
+        "c_time": _as_ms(order_data.get("cTime")),
+        "u_time": _as_ms(order_data.get("uTime")),
+    }
+
+def _apply_result(execution_result: ExecutionResult, result: Dict[str, Any], total_orders: Optional[int]):
+    """Copia el resumen del aggregator al registro de la ejecución (columnas y result_data)."""
+    execution_result.total_symbols = result.get("total_symbols") or result.get("symbols_processed")
+    execution_result.total_orders = total_orders
+    execution_result.s3_uri = result.get("s3_uri")
+    execution_result.public_url = result.get("public_url")
+    # Agregar información adicional al result_data si está disponible
+    execution_result.result_data = json.dumps({
+        "symbols_processed": result.get("symbols_processed"),
+        "symbols_with_data": result.get("symbols_with_data"),
+        "error_count": result.get("error_count", 0),
+        "processing_timestamp": result.get("processing_timestamp"),
+        "aggregator_duration_seconds": result.get("aggregator_duration_seconds"),
+        "cleanup": result.get("cleanup", {}),
+        "timing": result.get("timing", {}),
+        "aggregation_mode": result.get("aggregation_mode", "merge"),
+        "order_stats": result.get("order_stats") or {},
+        "rollups_s3_uri": result.get("rollups_s3_uri"),
+        "manifest_uri": result.get("manifest_uri")
+    })
+
+def _ingest_job_dict(job: IngestJob) -> Dict[str, Any]:
+    return {"execution_arn": job.execution_arn, "status": job.status, "polls": job.polls, "attempts": job.attempts,
+            "next_check_at": job.next_check_at, "started_at": job.started_at}
+
+@lru_cache(maxsize=32)
+def _load_rollups(s3_uri: str) -> Dict[str, Any]:
+    """El sidecar de rollups de una ejecución no cambia: se cachea por URI."""
+    bucket, key = s3_uri[5:].split("/", 1)
+    body = boto3.client('s3').get_object(Bucket=bucket, Key=key)['Body'].read()
+    return json.loads(gzip.decompress(body))
+
 class DatabaseService:
     """Servicio para manejar operaciones de base de datos"""
 
@@ -28,12 +112,14 @@ class DatabaseService:
             logger.error(f"Error inicializando DatabaseService: {str(e)}")
             self.db_available = False
 
-    def save_execution_data(self, execution_data: Dict[str, Any]) -> Dict[str, Any]:
+    def save_execution_data(self, execution_data: Dict[str, Any], orders: Optional[Iterable[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """
         Guarda los datos de ejecución en la base de datos y mide el tiempo de procesamiento
 
         Args:
             execution_data: Datos de la ejecución que incluyen status, result, executionArn
+            orders: Órdenes ya abiertas en streaming (ver ingest_stream.open_orders); si
+                traen `document` (JSON del aggregator), el resumen se toma de ahí al final
 
         Returns:
             Dict con información del procesamiento incluyendo tiempo transcurrido
@@ -74,9 +160,14 @@ class DatabaseService:
             execution_arn = execution_data.get("executionArn")
             status = execution_data.get("status")
             result = execution_data.get("result", {})
+            # Resumen armado por el aggregator con los sidecars de los workers: no hace falta leer las órdenes
+            order_stats = result.get("order_stats") or {}
+            total_orders = result.get("total_orders")
+            if total_orders is None:
+                total_orders = order_stats.get("count")
 
-            logger.info("Datos recibidos - ARN: %s, Status: %s, Orders en result: %s, Total symbols: %s, Symbols with data: %s",
-                        execution_arn, status, len(result.get('orders', [])), result.get('total_symbols') or result.get('symbols_processed', 'N/A'), result.get('symbols_with_data', 'N/A'))
+            logger.info("Datos recibidos - ARN: %s, Status: %s, Total orders: %s, Total symbols: %s, Symbols with data: %s",
+                        execution_arn, status, total_orders, result.get('total_symbols') or result.get('symbols_processed', 'N/A'), result.get('symbols_with_data', 'N/A'))
 
             # Log del inicio del procesamiento
             processing_log = ProcessingLog(
@@ -88,7 +179,7 @@ class DatabaseService:
                     "status": status,
                     "total_symbols": result.get("total_symbols") or result.get("symbols_processed"),
                     "symbols_with_data": result.get("symbols_with_data"),
-                    "records_to_process": len(result.get("orders", []))
+                    "records_to_process": total_orders if total_orders is not None else len(result.get("orders", []))
                 })
             )
             session.add(processing_log)
@@ -105,11 +196,8 @@ class DatabaseService:
                 # Actualizar registro existente
                 logger.info("Actualizando execution_result existente")
                 execution_result.status = status
-                execution_result.total_symbols = result.get("total_symbols") or result.get("symbols_processed")
-                execution_result.total_orders = result.get("total_orders")
-                execution_result.s3_uri = result.get("s3_uri")
-                execution_result.public_url = result.get("public_url")
                 execution_result.updated_at = get_bogota_now()
+                _apply_result(execution_result, result, total_orders)
 
                 logger.info("Valores actualizados - Symbols: %s, Orders: %s", execution_result.total_symbols, execution_result.total_orders)
             else:
@@ -117,63 +205,71 @@ class DatabaseService:
                 logger.info("Creando nuevo execution_result")
                 total_symbols_value = result.get("total_symbols") or result.get("symbols_processed")
 
-                execution_result = ExecutionResult(
-                    execution_arn=execution_arn,
-                    status=status,
-                    total_symbols=total_symbols_value,
-                    total_orders=result.get("total_orders"),
-                    s3_uri=result.get("s3_uri"),
-                    public_url=result.get("public_url")
-                )
+                execution_result = ExecutionResult(execution_arn=execution_arn, status=status)
+                _apply_result(execution_result, result, total_orders)
                 session.add(execution_result)
 
-                logger.info("Nuevo registro creado - Symbols: %s, Orders: %s", total_symbols_value, result.get('total_orders'))
-
-            # Agregar información adicional al result_data si está disponible
-            result_data = {
-                "symbols_processed": result.get("symbols_processed"),
-                "symbols_with_data": result.get("symbols_with_data"),
-                "error_count": result.get("error_count", 0),
-                "processing_timestamp": result.get("processing_timestamp"),
-                "aggregator_duration_seconds": result.get("aggregator_duration_seconds"),
-                "cleanup": result.get("cleanup", {}),
-                "timing": result.get("timing", {})
-            }
-            execution_result.result_data = json.dumps(result_data)
-            logger.info(f"Result_data guardado con información completa de procesamiento")
+                logger.info("Nuevo registro creado - Symbols: %s, Orders: %s", total_symbols_value, total_orders)
 
             logger.info("Comiteando execution_result...")
             session.commit()
             logger.info("Execution_result guardado correctamente")
 
             orders_saved = 0
+            ingest_stats = None
 
             # Guardar órdenes si están disponibles
             if status == "SUCCEEDED":
                 logger.info(f"Status SUCCEEDED - Iniciando proceso de guardado de órdenes")
-                orders_to_save = []
+                orders_to_save: Optional[Iterable[Dict[str, Any]]] = None
+                shards: Optional[List[Dict[str, Any]]] = None
+
+                if orders is not None:
+                    orders_to_save = orders
+                    logger.info("Usando órdenes abiertas en streaming")
 
                 # Primero intentar obtener órdenes desde la respuesta (para compatibilidad)
-                if "orders" in result and result["orders"]:
+                elif "orders" in result and result["orders"]:
                     orders_to_save = result["orders"]
                     logger.info(f"Usando órdenes de la respuesta: {len(orders_to_save)} órdenes")
 
-                # Si no hay órdenes en la respuesta, intentar obtener desde S3
+                # Si no hay órdenes en la respuesta, leerlas de S3 en streaming mientras se insertan
                 elif "s3_uri" in result and result["s3_uri"]:
-                    logger.info(f"No hay órdenes en respuesta, obteniendo desde S3: {result['s3_uri']}")
-                    orders_to_save = self._get_orders_from_s3(result["s3_uri"])
-                    logger.info(f"Obtenidas {len(orders_to_save)} órdenes desde S3")
+                    # Con manifest (particionado o compuesto) cada símbolo es un shard que se carga por su lado
+                    shards = self._result_shards(result) if config.INGEST_DB_CONNECTIONS > 1 else None
+                    if shards:
+                        logger.info(f"Ingesta por shards desde S3: {len(shards)} shards, "
+                                    f"hasta {config.INGEST_DB_CONNECTIONS} conexiones")
+                    else:
+                        logger.info(f"No hay órdenes en respuesta, ingiriendo en streaming desde S3: {result['s3_uri']}")
+                        orders_to_save = self._iter_orders_from_s3(result["s3_uri"])
+
+                if shards:
+                    ingest_stats = self._save_orders_sharded(session, execution_arn, shards)
+                    orders_saved = ingest_stats["rows"]
+                    logger.info("Guardadas %s órdenes en la base de datos", orders_saved)
 
                 # Si tenemos órdenes, guardarlas
-                if orders_to_save:
-                    logger.info(f"Iniciando guardado de {len(orders_to_save)} órdenes...")
+                elif orders_to_save is not None:
                     try:
-                        orders_saved = self._save_orders(session, execution_arn, orders_to_save)
+                        ingest_stats = self._save_orders(session, execution_arn, orders_to_save)
+                        orders_saved = ingest_stats["rows"]
                         logger.info("Guardadas %s órdenes en la base de datos", orders_saved)
                     except Exception as orders_error:
                         logger.error(f"Error guardando órdenes: {str(orders_error)}")
                         raise orders_error
-                else:
+
+                    # Documento leído en streaming: el resumen del aggregator llega después de las órdenes
+                    document = getattr(orders_to_save, "document", None)
+                    if document:
+                        result = {**document, **result}
+                        order_stats = result.get("order_stats") or {}
+                        total_orders = result.get("total_orders", order_stats.get("count"))
+                    if total_orders is None:
+                        total_orders = orders_saved
+                    _apply_result(execution_result, result, total_orders)
+
+                if not orders_saved:
                     logger.warning("No se encontraron órdenes para guardar (ni en respuesta ni en S3)")
             else:
                 logger.info(f"Status '{status}' - No guardando órdenes (solo para SUCCEEDED)")
@@ -193,6 +289,7 @@ class DatabaseService:
                 details=json.dumps({
                     "action": "data_save_completed",
                     "orders_saved": orders_saved,
+                    "ingest": ingest_stats,
                     "processing_time_seconds": processing_time,
                     "success": True
                 })
@@ -207,11 +304,13 @@ class DatabaseService:
                 "success": True,
                 "execution_arn": execution_arn,
                 "orders_saved": orders_saved,
+                "ingest": ingest_stats,
                 "processing_time_seconds": processing_time,
                 "total_symbols": result.get("total_symbols") or result.get("symbols_processed"),
                 "symbols_processed": result.get("symbols_processed"),
                 "symbols_with_data": result.get("symbols_with_data"),
-                "total_orders": result.get("total_orders"),
+                "total_orders": total_orders,
+                "order_stats": order_stats,
                 "database_record": {
                     "total_symbols_in_db": execution_result.total_symbols,
                     "total_orders_in_db": execution_result.total_orders,
@@ -278,127 +377,193 @@ class DatabaseService:
         finally:
             session.close()
 
-    def _get_orders_from_s3(self, s3_uri: str) -> List[Dict[str, Any]]:
+    def _iter_orders_from_s3(self, s3_uri: str) -> Iterator[Dict[str, Any]]:
+        """
+        Órdenes de un resultado en S3 leídas en streaming, para la ingesta: el body se
+        descarga por delante del parseo y nunca está completo en memoria. Un resultado
+        particionado se recorre partición por partición.
         """
-        Obtiene órdenes desde S3 usando la URI completa
+        if not s3_uri or not s3_uri.startswith("s3://") or "/" not in s3_uri[5:]:
+            raise ValueError(f"URI de S3 inválida: {s3_uri}")
+        bucket, key = s3_uri[5:].split("/", 1)
+        s3_client = boto3.client('s3')
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        if not is_manifest_key(key):
+            yield from open_orders(response['Body'], key)
+            return
+        # La ingesta carga el resultado completo: todas las particiones del manifest
+        partitions = json.loads(response['Body'].read()).get("partitions") or []
+        logger.info(f"Ingiriendo {len(partitions)} particiones desde {bucket}/{key}")
+        for partition in partitions:
+            body = s3_client.get_object(Bucket=bucket, Key=partition["key"])['Body']
+            yield from open_orders(body, partition["key"])
+
+    def get_rollups(self, rollups_s3_uri: str, granularity: str = "daily", symbol: Optional[str] = None,
+                    start_ms: Optional[int] = None, end_ms: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Filas de rollups (por símbolo y hora/día) desde el sidecar que deja el aggregator
 
         Args:
-            s3_uri: URI de S3 en formato s3://bucket/key
+            rollups_s3_uri: URI del sidecar de rollups (s3://bucket/key)
+            granularity: "hourly" o "daily"
+            symbol: filtra por símbolo si se indica
+            start_ms, end_ms: rango sobre el inicio del bucket
 
         Returns:
-            Lista de órdenes o lista vacía si hay error
+            Lista de filas con conteo, volúmenes, reparto compra/venta y fees por moneda
         """
-        try:
-            # Parsear la URI de S3
-            if not s3_uri or not s3_uri.startswith("s3://"):
-                logger.warning(f"URI de S3 inválida: {s3_uri}")
-                return []
-
-            # Extraer bucket y key de la URI
-            parts = s3_uri[5:].split("/", 1)  # Remover "s3://" y dividir en bucket/key
-            if len(parts) != 2:
-                logger.warning(f"Formato de URI de S3 inválido: {s3_uri}")
-                return []
-
-            bucket, key = parts
-
-            # Crear cliente S3
-            s3_client = boto3.client('s3')
+        return rollup_rows(_load_rollups(rollups_s3_uri), granularity, symbol, start_ms, end_ms)
 
-            # Obtener objeto desde S3
-            logger.info(f"Obteniendo órdenes desde S3: {bucket}/{key}")
-            response = s3_client.get_object(Bucket=bucket, Key=key)
-            content = response['Body'].read().decode('utf-8')
-            data = json.loads(content)
-
-            # Las órdenes deberían estar en data["orders"]
-            orders = data.get("orders", [])
-            if not isinstance(orders, list):
-                logger.warning(f"Formato inesperado de órdenes en S3: {type(orders)}")
-                return []
+    def _result_shards(self, result: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Shards de ingesta (uno por símbolo) según el manifest del resultado: particionado
+        (s3_uri apunta al manifest.json; las particiones símbolo-día de un símbolo van
+        juntas) o compuesto (manifest_uri con el rango de bytes de cada símbolo).
+        None si el resultado es un objeto único.
+        """
+        s3_uri = result.get("s3_uri") or ""
+        manifest_uri = s3_uri if is_manifest_key(s3_uri) else result.get("manifest_uri")
+        if not manifest_uri or not manifest_uri.startswith("s3://"):
+            return None
+        bucket, key = manifest_uri[5:].split("/", 1)
+        manifest = json.loads(boto3.client('s3').get_object(Bucket=bucket, Key=key)['Body'].read())
+
+        shards: Dict[str, Dict[str, Any]] = {}
+        def shard_for(symbol: Any) -> Dict[str, Any]:
+            name = str(symbol or "unknown")
+            return shards.setdefault(name, {"shard": name, "bucket": bucket, "parts": []})
+
+        for partition in manifest.get("partitions") or []:
+            shard_for(partition.get("symbol"))["parts"].append({"key": partition["key"]})
+        for entry in manifest.get("entries") or []:
+            shard_for(entry.get("symbol"))["parts"].append(
+                {"key": manifest["s3_key"], "range": (entry["offset"], entry["length"])}
+            )
+        return [shards[name] for name in sorted(shards)] or None
+
+    def _iter_shard_orders(self, s3_client, shard: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        for part in shard["parts"]:
+            args = {}
+            if part.get("range"):
+                # Miembro gzip / frame zstd completo dentro del objeto compuesto
+                offset, length = part["range"]
+                args["Range"] = f"bytes={offset}-{offset + length - 1}"
+            body = s3_client.get_object(Bucket=shard["bucket"], Key=part["key"], **args)['Body']
+            yield from open_orders(body, part["key"])
+
+    def _ingest_shard(self, s3_client, execution_arn: str, shard: Dict[str, Any]) -> Dict[str, Any]:
+        """Carga un shard con su propia sesión (conexión) y registra el progreso en ingest_shards."""
+        session = get_db_session()
+        if session is None:
+            return {"shard": shard["shard"], "status": "failed", "rows": 0, "error": "No se pudo obtener sesión de base de datos"}
+        try:
+            record = session.query(IngestShard).filter_by(execution_arn=execution_arn, shard=shard["shard"]).one()
+            for _ in range(1 + max(0, config.INGEST_SHARD_RETRIES)):
+                record.status = "running"
+                record.attempts = (record.attempts or 0) + 1
+                session.commit()
+                started = time.perf_counter()
+                try:
+                    # Los INSERT toleran duplicados: reintentar un shard a medio cargar es seguro
+                    rows = (_order_row(execution_arn, o) for o in self._iter_shard_orders(s3_client, shard) if isinstance(o, dict))
+                    stats = ingest_order_rows(session, rows)
+                except Exception as e:
+                    session.rollback()
+                    record.status = "failed"
+                    record.error = str(e)[:1000]
+                    session.commit()
+                    logger.warning(f"Shard {shard['shard']} falló (intento {record.attempts}): {str(e)}")
+                    continue
+                record.status = "done"
+                record.rows = stats["rows"]
+                record.error = None
+                record.seconds = round(time.perf_counter() - started, 3)
+                session.commit()
+                return {"shard": shard["shard"], "status": "done", **stats}
+            return {"shard": shard["shard"], "status": "failed", "rows": 0, "error": record.error}
+        finally:
+            session.close()
 
-            logger.info(f"Se obtuvieron {len(orders)} órdenes desde S3")
-            return orders
+    def _save_orders_sharded(self, session: Session, execution_arn: str, shards: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Carga los shards en paralelo, cada uno en su conexión (hasta INGEST_DB_CONNECTIONS).
 
-        except Exception as e:
-            logger.error(f"Error obteniendo órdenes desde S3 ({s3_uri}): {str(e)}")
-            return []
+        El progreso queda en ingest_shards: si una ingesta anterior de la ejecución quedó a
+        medias, solo se cargan los shards que no terminaron; si no hay progreso o ya estaba
+        completa, se empieza de cero (re-procesamiento). Si algún shard agota sus reintentos
+        se lanza RuntimeError y un nuevo guardado retoma solo esos.
 
-    def _save_orders(self, session: Session, execution_arn: str, orders: List[Dict[str, Any]]) -> int:
+        Returns:
+            Estadísticas: rows (total de la ejecución), rows_loaded (filas nuevas), shards, shards_loaded,
+            failed, connections, seconds, rows_per_second
         """
-        Guarda las órdenes en la base de datos
+        progress = {p.shard: p for p in session.query(IngestShard).filter_by(execution_arn=execution_arn)}
+        if not progress or all(p.status == "done" for p in progress.values()):
+            deleted_count = session.query(Order).filter_by(execution_arn=execution_arn).delete()
+            session.query(IngestShard).filter_by(execution_arn=execution_arn).delete()
+            logger.info("Ingesta nueva por shards: eliminadas %s órdenes existentes", deleted_count)
+            progress = {}
+        for shard in shards:
+            if shard["shard"] not in progress:
+                progress[shard["shard"]] = IngestShard(execution_arn=execution_arn, shard=shard["shard"], status="pending", rows=0, attempts=0)
+                session.add(progress[shard["shard"]])
+        session.commit()
+
+        pending = [shard for shard in shards if progress[shard["shard"]].status != "done"]
+        connections = max(1, min(config.INGEST_DB_CONNECTIONS, len(pending) or 1))
+        logger.info("Cargando %s/%s shards con %s conexiones", len(pending), len(shards), connections)
+
+        started = time.perf_counter()
+        s3_client = boto3.client('s3')
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            results = list(pool.map(lambda shard: self._ingest_shard(s3_client, execution_arn, shard), pending))
+        seconds = time.perf_counter() - started
+
+        failed = [r for r in results if r["status"] != "done"]
+        loaded = sum(r["rows"] for r in results)
+        # Total de la ejecución contado en la tabla: incluye lo que dejaron cargado intentos o
+        # ingestas anteriores a medias, que las filas nuevas de cada shard no cuentan
+        stats = {
+            "rows": session.query(Order).filter_by(execution_arn=execution_arn).count(),
+            "rows_loaded": loaded,
+            "shards": len(shards),
+            "shards_loaded": len(results) - len(failed),
+            "failed": [r["shard"] for r in failed],
+            "connections": connections,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(loaded / seconds) if seconds > 0 else loaded,
+        }
+        logger.info("Ingesta por shards: %s filas en %s shards, %.2fs (%s filas/s), %s fallidos",
+                    loaded, stats["shards_loaded"], seconds, stats["rows_per_second"], len(failed))
+        if failed:
+            raise RuntimeError(f"Fallaron {len(failed)} shards de ingesta: "
+                               + ", ".join(f"{r['shard']} ({r.get('error')})" for r in failed[:5]))
+        return stats
+
+    def _save_orders(self, session: Session, execution_arn: str, orders: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Guarda las órdenes en la base de datos con INSERT por bloques (ver ingest_order_rows):
+        un commit por bloque y duplicados (execution_arn, order_id) resueltos por el motor
 
         Args:
             session: Sesión de SQLAlchemy
             execution_arn: ARN de la ejecución
-            orders: Lista de órdenes
+            orders: Órdenes (lista o iterable en streaming)
 
         Returns:
-            Número de órdenes guardadas
+            Estadísticas de la ingesta: rows (órdenes nuevas), duplicates, skipped, chunks, seconds, rows_per_second
         """
         logger.info("Eliminando órdenes existentes para execution: %s", execution_arn)
         # Primero eliminar órdenes existentes para esta ejecución (en caso de re-procesamiento)
         deleted_count = session.query(Order).filter_by(execution_arn=execution_arn).delete()
         logger.info("Eliminadas %s órdenes existentes", deleted_count)
 
-        orders_saved = 0
-
-        for idx, order_data in enumerate(orders):
-            try:
-                # Log detallado de valores problemáticos antes de crear la orden
-                side_value = order_data.get("side")
-                trade_side_value = order_data.get("tradeSide")
-                order_source_value = order_data.get("orderSource")
-
-                logger.info("Procesando orden %s/%s - OrderID: %s, Side: %s (len=%s), TradeSide: %s (len=%s), OrderSource: %s (len=%s)",
-                            idx+1, len(orders), order_data.get('orderId'), side_value, len(str(side_value)) if side_value else 0,
-                            trade_side_value, len(str(trade_side_value)) if trade_side_value else 0, order_source_value, len(str(order_source_value)) if order_source_value else 0)
-
-                order = Order(
-                    execution_arn=execution_arn,
-                    symbol=order_data.get("symbol"),
-                    size=order_data.get("size"),
-                    order_id=order_data.get("orderId"),
-                    client_oid=order_data.get("clientOid"),
-                    base_volume=order_data.get("baseVolume"),
-                    fee=order_data.get("fee"),
-                    price=order_data.get("price"),
-                    price_avg=order_data.get("priceAvg"),
-                    status=order_data.get("status"),
-                    side=side_value,
-                    force=order_data.get("force"),
-                    total_profits=order_data.get("totalProfits"),
-                    pos_side=order_data.get("posSide"),
-                    margin_coin=order_data.get("marginCoin"),
-                    quote_volume=order_data.get("quoteVolume"),
-                    leverage=order_data.get("leverage"),
-                    margin_mode=order_data.get("marginMode"),
-                    enter_point_source=order_data.get("enterPointSource"),
-                    trade_side=trade_side_value,
-                    pos_mode=order_data.get("posMode"),
-                    order_type=order_data.get("orderType"),
-                    order_source=order_source_value,
-                    preset_stop_surplus_price=order_data.get("presetStopSurplusPrice"),
-                    preset_stop_loss_price=order_data.get("presetStopLossPrice"),
-                    pos_avg=order_data.get("posAvg"),
-                    reduce_only=order_data.get("reduceOnly"),
-                    c_time=order_data.get("cTime"),
-                    u_time=order_data.get("uTime")
-                )
-                session.add(order)
-                orders_saved += 1
-
-            except Exception as e:
-                error_msg = str(e)
-                logger.error("Error guardando orden %s: %s", order_data.get('orderId'), error_msg)
-                logger.error("Datos problemáticos de la orden: Side=%s TradeSide=%s OrderSource=%s", side_value, trade_side_value, order_source_value)
-                logger.error("Orden completa: %s", json.dumps(order_data, indent=2))
-
-                # Re-lanzar el error para que se capture en el nivel superior
-                raise e
-
-        logger.info("Procesamiento de órdenes completado: %s/%s guardadas exitosamente", orders_saved, len(orders))
-        return orders_saved
+        # Lectura, parseo y mapeo en un hilo aparte; los INSERT, en este (la sesión no se comparte)
+        rows = background(_order_row(execution_arn, o) for o in orders if isinstance(o, dict))
+        stats = ingest_order_rows(session, rows)
+        logger.info("Ingesta de órdenes completada: %s filas en %s bloques, %.2fs (%s filas/s), %s duplicadas, %s descartadas sin orderId/symbol",
+                    stats["rows"], stats["chunks"], stats["seconds"], stats["rows_per_second"], stats["duplicates"], stats["skipped"])
+        return stats
 
     def get_execution_data(self, execution_arn: str) -> Dict[str, Any]:
         """
@@ -462,13 +627,188 @@ class DatabaseService:
                 "error_count": result_data.get("error_count", 0),
                 "cleanup_info": result_data.get("cleanup", {}),
                 "timing_info": result_data.get("timing", {}),
+                "order_stats": result_data.get("order_stats"),
+                "rollups_s3_uri": result_data.get("rollups_s3_uri"),
+                "manifest_uri": result_data.get("manifest_uri"),
                 "created_at": execution_result.created_at.isoformat() if execution_result.created_at else None,
-                "updated_at": execution_result.updated_at.isoformat() if execution_result.updated_at else None
+                "updated_at": execution_result.updated_at.isoformat() if execution_result.updated_at else None,
+                "ingested_at": execution_result.ingested_at.isoformat() if execution_result.ingested_at else None
             }
 
         finally:
             session.close()
 
+    def get_terminal_status(self, execution_arn: str) -> Optional[Dict[str, Any]]:
+        """
+        Respuesta de estado guardada cuando la ejecución llegó a un estado terminal y se
+        ingirió; None si todavía no (o si la BD no está disponible).
+        """
+        if not self.db_available:
+            return None
+        session = get_db_session()
+        if not session:
+            return None
+        try:
+            row = session.query(ExecutionResult.ingested_at, ExecutionResult.status_response).filter_by(
+                execution_arn=execution_arn
+            ).first()
+            if not row or not row.ingested_at or not row.status_response:
+                return None
+            return json.loads(row.status_response)
+        except Exception as e:
+            logger.warning(f"No se pudo leer el estado guardado de {execution_arn}: {str(e)}")
+            return None
+        finally:
+            session.close()
+
+    def mark_execution_ingested(self, execution_arn: str, status_response: Dict[str, Any]) -> Optional[str]:
+        """
+        Marca la ejecución como ingerida y guarda la respuesta de estado que se servirá
+        desde la BD. Retorna la fecha de ingesta (ISO) o None si no se pudo marcar.
+        """
+        if not self.db_available:
+            return None
+        session = get_db_session()
+        if not session:
+            return None
+        try:
+            ingested_at = get_bogota_now()
+            stored = {**status_response, "ingested_at": ingested_at.isoformat()}
+            updated = session.query(ExecutionResult).filter_by(execution_arn=execution_arn).update({
+                ExecutionResult.ingested_at: ingested_at,
+                ExecutionResult.status_response: json.dumps(stored, default=str),
+            })
+            session.commit()
+            return stored["ingested_at"] if updated else None
+        except Exception as e:
+            session.rollback()
+            logger.error(f"No se pudo marcar {execution_arn} como ingerida: {str(e)}")
+            return None
+        finally:
+            session.close()
+
+    def save_ingest_job(self, execution_arn: str, **fields: Any) -> bool:
+        """Crea o actualiza el trabajo de ingesta en segundo plano de la ejecución con `fields`."""
+        if not self.db_available:
+            return False
+        session = get_db_session()
+        if not session:
+            return False
+        try:
+            job = session.query(IngestJob).filter_by(execution_arn=execution_arn).first()
+            if not job:
+                job = IngestJob(execution_arn=execution_arn, status="queued", polls=0, attempts=0)
+                session.add(job)
+            for name, value in fields.items():
+                setattr(job, name, value)
+            session.commit()
+            return True
+        except Exception as e:
+            session.rollback()
+            logger.error(f"No se pudo guardar el trabajo de ingesta de {execution_arn}: {str(e)}")
+            return False
+        finally:
+            session.close()
+
+    def claim_ingest_job(self, execution_arn: str, stale_before: datetime) -> bool:
+        """
+        Toma el trabajo para procesarlo con un UPDATE condicional (queued/waiting, o running
+        con started_at anterior a `stale_before`, de un proceso que murió) -> running.
+        False si otro proceso lo tomó antes o si ya terminó o falló.
+        """
+        if not self.db_available:
+            return False
+        session = get_db_session()
+        if not session:
+            return False
+        try:
+            claimable = or_(
+                IngestJob.status.in_(("queued", "waiting")),
+                and_(IngestJob.status == "running",
+                     or_(IngestJob.started_at.is_(None), IngestJob.started_at < stale_before)),
+            )
+            updated = session.query(IngestJob).filter(IngestJob.execution_arn == execution_arn, claimable).update(
+                {IngestJob.status: "running", IngestJob.started_at: get_bogota_now(), IngestJob.next_check_at: None},
+                synchronize_session=False,
+            )
+            session.commit()
+            return updated == 1
+        except Exception as e:
+            session.rollback()
+            logger.error(f"No se pudo tomar el trabajo de ingesta de {execution_arn}: {str(e)}")
+            return False
+        finally:
+            session.close()
+
+    def get_ingest_job(self, execution_arn: str) -> Optional[Dict[str, Any]]:
+        """Trabajo de ingesta de la ejecución (como en list_unfinished_ingest_jobs); None si no tiene."""
+        if not self.db_available:
+            return None
+        session = get_db_session()
+        if not session:
+            return None
+        try:
+            job = session.query(IngestJob).filter_by(execution_arn=execution_arn).first()
+            return _ingest_job_dict(job) if job else None
+        except Exception as e:
+            logger.warning(f"No se pudo leer el trabajo de ingesta de {execution_arn}: {str(e)}")
+            return None
+        finally:
+            session.close()
+
+    def list_unfinished_ingest_jobs(self) -> List[Dict[str, Any]]:
+        """Trabajos de ingesta sin terminar (para retomarlos al arrancar): execution_arn, status, polls, attempts, next_check_at y started_at."""
+        if not self.db_available:
+            return []
+        session = get_db_session()
+        if not session:
+            return []
+        try:
+            jobs = session.query(IngestJob).filter(IngestJob.status.in_(("queued", "waiting", "running"))).all()
+            return [_ingest_job_dict(j) for j in jobs]
+        except Exception as e:
+            logger.warning(f"No se pudieron listar los trabajos de ingesta: {str(e)}")
+            return []
+        finally:
+            session.close()
+
+    def get_ingest_progress(self, execution_arn: str) -> Optional[Dict[str, Any]]:
+        """
+        Progreso de la ingesta en segundo plano: estado del trabajo, órdenes ya insertadas
+        (la ingesta confirma por bloques) y shards terminados si el resultado tiene manifest.
+        None si la ejecución no tiene trabajo de ingesta.
+        """
+        if not self.db_available:
+            return None
+        session = get_db_session()
+        if not session:
+            return None
+        try:
+            job = session.query(IngestJob).filter_by(execution_arn=execution_arn).first()
+            if not job:
+                return None
+            shards = session.query(IngestShard.status).filter_by(execution_arn=execution_arn).all()
+            return {
+                "status": job.status,
+                "execution_status": job.execution_status,
+                "polls": job.polls,
+                "attempts": job.attempts,
+                "orders_in_db": session.query(Order).filter_by(execution_arn=execution_arn).count(),
+                "orders_saved": job.orders_saved,
+                "shards_total": len(shards),
+                "shards_done": sum(1 for shard in shards if shard.status == "done"),
+                "error": job.error,
+                "next_check_at": job.next_check_at.isoformat() if job.next_check_at else None,
+                "started_at": job.started_at.isoformat() if job.started_at else None,
+                "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+                "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+            }
+        except Exception as e:
+            logger.warning(f"No se pudo leer el progreso de ingesta de {execution_arn}: {str(e)}")
+            return None
+        finally:
+            session.close()
+
     def get_execution_orders_paginated(self, execution_arn: str, skip: int = 0, limit: int = 10) -> Dict[str, Any]:
         """
         Obtiene las órdenes de una ejecución con paginación
@@ -595,12 +935,18 @@ class DatabaseService:
         start_time = time.time()
 
         try:
-            # Descargar datos del JSON
+            # Descargar en streaming: las órdenes se parsean e insertan mientras llegan
             logger.info(f"Descargando datos de {public_url}")
-            response = requests.get(public_url, timeout=30)
+            response = requests.get(public_url, timeout=30, stream=True)
             response.raise_for_status()
 
-            json_data = response.json()
+            key = urlparse(public_url).path
+            if is_manifest_key(key):
+                json_data, orders = response.json(), None
+            else:
+                # Sin decodificar Content-Encoding: el formato (.ndjson.gz, .json...) lo dice la key
+                response.raw.decode_content = False
+                json_data, orders = {}, open_orders(response.raw, key)
 
             # Crear estructura de datos compatible
             execution_data = {
@@ -610,7 +956,10 @@ class DatabaseService:
             }
 
             # Guardar en base de datos
-            result = self.save_execution_data(execution_data)
+            try:
+                result = self.save_execution_data(execution_data, orders=orders)
+            finally:
+                response.close()
 
             download_time = time.time() - start_time
             result["download_time_seconds"] = download_time
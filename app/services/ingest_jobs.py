@@ -0,0 +1,258 @@
+"""
+Ingesta en segundo plano de las ejecuciones terminadas, fuera del request de estado.
+
+IngestJobRunner mantiene una cola de ejecuciones y `workers` hilos que la consumen
+llamando a `ingest(execution_arn)` (en OrdersService: describe la ejecución y, si
+terminó, la ingiere y la marca como ingerida). Se alimenta de dos formas:
+
+- submit(): notificación de que la ejecución terminó; se procesa de inmediato, también
+  si el trabajo había fallado.
+- watch(): ejecución que un cliente consultó; si sigue RUNNING, un hilo planificador
+  la vuelve a consultar con backoff exponencial (INGEST_POLL_BASE_SECONDS, duplicando
+  hasta INGEST_POLL_MAX_SECONDS) hasta que termine. Un trabajo fallido no se reabre.
+
+El estado de cada trabajo queda en ingest_jobs (DatabaseService.save_ingest_job): los
+endpoints de estado responden con ese progreso sin esperar, y al arrancar se retoman
+los trabajos que no terminaron. Antes de procesar un trabajo se lo toma con un UPDATE
+condicional (DatabaseService.claim_ingest_job), así que con varios procesos de la API
+cada ingesta corre una sola vez. Una ingesta fallida se reintenta con el mismo backoff
+hasta INGEST_JOB_MAX_ATTEMPTS veces.
+
+La aplicación arranca y detiene el runner en su lifespan (ver app.api.routes.orders).
+"""
+
+import heapq
+import logging
+import queue
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from app.core.config import config
+from app.models.database import get_bogota_now
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("SUCCEEDED", "FAILED", "TIMED_OUT", "ABORTED")
+PENDING_JOB_STATUSES = ("queued", "waiting")
+
+
+class IngestJobRunner:
+    """
+    Uso:
+        runner = IngestJobRunner(ingest, db_service).start()
+        runner.watch(execution_arn)     # ejecución consultada: seguirla hasta ingerirla
+        runner.submit(execution_arn)    # notificación de fin: ingerir ya
+        runner.stop()
+
+    `ingest(execution_arn)` retorna la respuesta de estado de la ejecución: el trabajo
+    termina cuando trae `ingested_at` (o viene de la base de datos), sigue esperando si
+    la ejecución no terminó y cuenta un intento fallido en otro caso.
+    """
+
+    def __init__(self, ingest: Callable[[str], Dict[str, Any]], db_service, workers: Optional[int] = None,
+                 max_attempts: Optional[int] = None, base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None, stale_seconds: Optional[float] = None):
+        self.ingest = ingest
+        self.db_service = db_service
+        self.workers = max(1, workers or config.INGEST_JOB_WORKERS)
+        self.max_attempts = max(1, max_attempts or config.INGEST_JOB_MAX_ATTEMPTS)
+        self.base_delay = config.INGEST_POLL_BASE_SECONDS if base_delay is None else base_delay
+        self.max_delay = config.INGEST_POLL_MAX_SECONDS if max_delay is None else max_delay
+        self.stale_seconds = config.INGEST_JOB_STALE_SECONDS if stale_seconds is None else stale_seconds
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}          # planificadas: ARN -> momento (monotonic) de la próxima consulta
+        self._active: Set[str] = set()            # en la cola de trabajo o procesándose
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._threads: List[threading.Thread] = []
+        self._stopped = False
+
+    def start(self) -> "IngestJobRunner":
+        """Arranca los hilos y retoma los trabajos que quedaron sin terminar en la base de datos."""
+        if self._threads:
+            return self
+        with self._cond:
+            self._stopped = False
+        for job in self.db_service.list_unfinished_ingest_jobs():
+            if self._claimable(job):  # un "running" reciente es de otro proceso
+                self._resume(job)
+        self._threads.append(threading.Thread(target=self._scheduler_loop, name="ingest-scheduler", daemon=True))
+        for n in range(self.workers):
+            self._threads.append(threading.Thread(target=self._worker_loop, name=f"ingest-worker-{n}", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Ingesta en segundo plano iniciada: {self.workers} workers, {len(self._due)} trabajos retomados")
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if not self._threads:
+            return
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def submit(self, execution_arn: str) -> bool:
+        """
+        Ingerir ya (la ejecución terminó), también si el trabajo había fallado o agotado
+        sus intentos. False si el trabajo ya se está procesando (aquí o en otro proceso).
+        """
+        with self._cond:
+            if self._stopped or execution_arn in self._active:
+                return False
+        job = self.db_service.get_ingest_job(execution_arn)
+        if job is not None and job["status"] == "running" and not self._claimable(job):
+            return False
+        if job is None or job["status"] not in PENDING_JOB_STATUSES:
+            self._counters[execution_arn] = {"polls": 0, "attempts": 0}
+            self.db_service.save_ingest_job(execution_arn, status="queued", polls=0, attempts=0, error=None,
+                                            next_check_at=None, started_at=None, finished_at=None)
+        else:
+            self._counters.setdefault(execution_arn, {"polls": job.get("polls") or 0, "attempts": job.get("attempts") or 0})
+            self.db_service.save_ingest_job(execution_arn, status="queued", next_check_at=None)
+        return self._schedule(execution_arn, 0.0)
+
+    def watch(self, execution_arn: str, finished: bool = False) -> bool:
+        """
+        Seguir la ejecución hasta ingerirla, si no se está siguiendo ya: de inmediato si
+        `finished`, si no en la primera consulta del backoff. False si ya estaba en curso
+        (no se adelanta un reintento con backoff pendiente), si lo procesa otro proceso o
+        si el trabajo terminó o falló: solo submit() reintenta un trabajo fallido.
+        """
+        with self._cond:
+            if self._stopped or execution_arn in self._active or execution_arn in self._due:
+                return False
+        job = self.db_service.get_ingest_job(execution_arn)
+        if job is not None:
+            # Pendiente en la base de datos (de otro proceso o de antes de reiniciar): se sigue con sus contadores
+            return self._claimable(job) and self._resume(job, now=finished and not job.get("attempts"))
+        delay = 0.0 if finished else self._delay(1)
+        self._counters[execution_arn] = {"polls": 0, "attempts": 0}
+        self.db_service.save_ingest_job(
+            execution_arn, status="queued" if finished else "waiting", polls=0, attempts=0, error=None,
+            next_check_at=None if finished else get_bogota_now() + timedelta(seconds=delay),
+            started_at=None, finished_at=None,
+        )
+        return self._schedule(execution_arn, delay)
+
+    def _delay(self, n: int) -> float:
+        return min(self.max_delay, self.base_delay * 2 ** max(0, n - 1))
+
+    def _claimable(self, job: Dict[str, Any]) -> bool:
+        """Pendiente, o "running" sin avance desde hace stale_seconds (el proceso que lo tomó murió)."""
+        if job["status"] in PENDING_JOB_STATUSES:
+            return True
+        started_at = job.get("started_at")
+        return job["status"] == "running" and (
+            started_at is None or started_at < get_bogota_now() - timedelta(seconds=self.stale_seconds)
+        )
+
+    def _resume(self, job: Dict[str, Any], now: bool = False) -> bool:
+        """Planifica un trabajo leído de la base de datos, respetando su próxima consulta si está esperando."""
+        execution_arn = job["execution_arn"]
+        self._counters[execution_arn] = {"polls": job.get("polls") or 0, "attempts": job.get("attempts") or 0}
+        next_check_at = job.get("next_check_at") if job["status"] == "waiting" and not now else None
+        delay = max(0.0, (next_check_at - get_bogota_now()).total_seconds()) if next_check_at else 0.0
+        return self._schedule(execution_arn, delay)
+
+    def _schedule(self, execution_arn: str, delay: float) -> bool:
+        with self._cond:
+            if self._stopped or execution_arn in self._active:
+                return False
+            due = time.monotonic() + delay
+            current = self._due.get(execution_arn)
+            if current is not None and current <= due:
+                return False
+            self._due[execution_arn] = due
+            heapq.heappush(self._heap, (due, execution_arn))
+            self._cond.notify()
+            return True
+
+    def _scheduler_loop(self):
+        """Pasa a la cola de trabajo las ejecuciones cuya próxima consulta ya venció."""
+        with self._cond:
+            while not self._stopped:
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    due, execution_arn = heapq.heappop(self._heap)
+                    if self._due.get(execution_arn) != due:
+                        continue  # reprogramada a un momento anterior
+                    del self._due[execution_arn]
+                    self._active.add(execution_arn)
+                    self._queue.put(execution_arn)
+                self._cond.wait(self._heap[0][0] - now if self._heap else None)
+
+    def _worker_loop(self):
+        while True:
+            execution_arn = self._queue.get()
+            if execution_arn is None:
+                return
+            try:
+                delay = self._run_job(execution_arn)
+            except Exception as e:
+                logger.error(f"Error en el trabajo de ingesta de {execution_arn}: {str(e)}")
+                delay = None
+            with self._cond:
+                self._active.discard(execution_arn)
+            if delay is not None:
+                self._schedule(execution_arn, delay)
+
+    def _run_job(self, execution_arn: str) -> Optional[float]:
+        """Procesa el trabajo; retorna en cuántos segundos volver a intentarlo o None si terminó."""
+        if not self.db_service.claim_ingest_job(execution_arn, get_bogota_now() - timedelta(seconds=self.stale_seconds)):
+            self._counters.pop(execution_arn, None)
+            logger.info(f"Trabajo de ingesta de {execution_arn} tomado por otro proceso o ya terminado")
+            return None
+        counters = self._counters.setdefault(execution_arn, {"polls": 0, "attempts": 0})
+        try:
+            response = self.ingest(execution_arn) or {}
+            error = None
+        except Exception as e:
+            response = {}
+            error = getattr(e, "detail", None) or str(e)
+        status = response.get("status")
+
+        if response.get("ingested_at") or response.get("served_from") == "database":
+            database_save = (response.get("result") or {}).get("database_save") or {}
+            self.db_service.save_ingest_job(
+                execution_arn, status="done", execution_status=status, orders_saved=database_save.get("orders_saved"),
+                error=None, finished_at=get_bogota_now(),
+            )
+            self._counters.pop(execution_arn, None)
+            logger.info(f"Ingesta en segundo plano completada para {execution_arn}")
+            return None
+
+        if error is None and status not in TERMINAL_STATUSES:
+            counters["polls"] += 1
+            delay = self._delay(counters["polls"])
+            self.db_service.save_ingest_job(
+                execution_arn, status="waiting", execution_status=status, polls=counters["polls"],
+                next_check_at=get_bogota_now() + timedelta(seconds=delay),
+            )
+            return delay
+
+        counters["attempts"] += 1
+        if error is None:
+            database_save = (response.get("result") or {}).get("database_save") or {}
+            error = database_save.get("error") or f"La ingesta de la ejecución {status} no se completó"
+        if counters["attempts"] >= self.max_attempts:
+            self.db_service.save_ingest_job(
+                execution_arn, status="failed", execution_status=status, attempts=counters["attempts"],
+                error=error, finished_at=get_bogota_now(),
+            )
+            self._counters.pop(execution_arn, None)
+            logger.error(f"Ingesta de {execution_arn} abandonada tras {counters['attempts']} intentos: {error}")
+            return None
+        delay = self._delay(counters["attempts"])
+        self.db_service.save_ingest_job(
+            execution_arn, status="waiting", execution_status=status, attempts=counters["attempts"], error=error,
+            next_check_at=get_bogota_now() + timedelta(seconds=delay),
+        )
+        logger.warning(f"Ingesta de {execution_arn} falló (intento {counters['attempts']}), reintento en {delay:.0f}s: {error}")
+        return delay
@@ -0,0 +1,148 @@
+"""
+Ingesta en streaming de un resultado (S3 o URL pública) hacia la base de datos.
+
+Tres etapas solapadas con colas acotadas entre ellas:
+
+    descarga (ReadAhead) -> parseo + mapeo a filas (background) -> INSERT por bloques
+
+La descarga lee el body por bloques en su propio hilo; el parseo (NDJSON o el
+arreglo "orders" del JSON, ver JsonOrdersStream) corre en otro y entrega lotes de
+filas; el hilo que llama inserta con ingest_order_rows (la sesión no sale de ese
+hilo). La memoria queda en lo que cabe en las colas, sea cual sea el tamaño de la
+ejecución.
+"""
+
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List
+from lambda_functions.common.columnar import decode_orders, is_columnar_key
+from lambda_functions.common.result_writer import JsonOrdersStream, iter_orders
+
+READ_AHEAD_CHUNK_SIZE = 1024 * 1024  # bytes por lectura del body
+READ_AHEAD_DEPTH = 4                 # bloques descargados por delante del parseo
+BATCH_SIZE = 2000                    # filas por lote entre el parseo y el INSERT
+BATCH_DEPTH = 4                      # lotes parseados por delante del INSERT
+
+_DONE = object()
+
+
+class _Producer:
+    """Hilo que llena una cola acotada con lo que produce `produce(put)`; los errores pasan al consumidor."""
+
+    def __init__(self, produce: Callable[[Callable[[Any], bool]], None], depth: int, name: str):
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, depth))
+        self._stop = threading.Event()
+        self._produce = produce
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Any) -> bool:
+        """Encola esperando lugar; False si el consumidor ya no quiere más."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            self._produce(self._put)
+            self._put(_DONE)
+        except BaseException as e:  # se relanza en el consumidor
+            self._put(e)
+
+    def get(self) -> Any:
+        item = self._queue.get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def close(self):
+        self._stop.set()
+
+
+class ReadAhead:
+    """
+    Envoltura de solo lectura sobre un body (StreamingBody de boto3, `response.raw` de
+    requests) que descarga en un hilo hasta `depth` bloques por delante de quien lee.
+    """
+
+    def __init__(self, body, chunk_size: int = READ_AHEAD_CHUNK_SIZE, depth: int = READ_AHEAD_DEPTH):
+        def produce(put):
+            while True:
+                chunk = body.read(chunk_size)
+                if not chunk or not put(chunk):
+                    return
+
+        self._producer = _Producer(produce, depth, "ingest-read-ahead")
+        self._pending = b""
+        self._eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._pending and not self._eof:
+            chunk = self._producer.get()
+            if chunk is _DONE:
+                self._eof = True
+            else:
+                self._pending = chunk
+        if size is None or size < 0:
+            parts = [self._pending]
+            while not self._eof:
+                chunk = self._producer.get()
+                if chunk is _DONE:
+                    self._eof = True
+                else:
+                    parts.append(chunk)
+            self._pending = b""
+            return b"".join(parts)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self):
+        self._producer.close()
+
+
+def background(items: Iterable[Any], batch_size: int = BATCH_SIZE, depth: int = BATCH_DEPTH) -> Iterator[Any]:
+    """
+    Consume `items` en un hilo aparte, por lotes, y los entrega en el hilo que itera.
+    Si el consumidor corta antes, el hilo se detiene en el siguiente lote.
+    """
+    def produce(put):
+        batch: List[Any] = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                if not put(batch):
+                    return
+                batch = []
+        if batch:
+            put(batch)
+
+    producer = _Producer(produce, depth, "ingest-parse")
+    try:
+        while True:
+            batch = producer.get()
+            if batch is _DONE:
+                return
+            yield from batch
+    finally:
+        producer.close()
+
+
+def open_orders(body, key: str) -> Iterable[Any]:
+    """
+    Órdenes de un objeto de resultados según su key, leyendo el body con ReadAhead.
+    Para el JSON {"orders": [...], <resumen>} retorna el JsonOrdersStream: tras
+    recorrerlo, `document` trae el resumen.
+    """
+    reader = ReadAhead(body)
+    if is_columnar_key(key):
+        return decode_orders(reader, key)  # formato columnar: se decodifica completo
+    if ".ndjson" in key:
+        return iter_orders(reader, key)
+    return JsonOrdersStream(reader)
@@ -5,12 +5,16 @@ Separa la lógica de los endpoints para mantener el código organizado.
 
 import boto3
 import json
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List
 from fastapi import HTTPException
 from pydantic import BaseModel, Field
 from app.services.database_service import DatabaseService
+from app.services.ingest_jobs import IngestJobRunner, TERMINAL_STATUSES
 from app.services.symbols_service import SymbolsService
+from app.services.results_query_service import ResultsQueryService
 from app.core.config import config
 import logging
 
@@ -31,6 +35,8 @@ class OrderRequest(BaseModel):
     symbols: list[str] | None = Field(None, description="Lista de símbolos específicos. Si no se proporciona, se usarán todos los símbolos activos de Bitget")
     start_ms: int | None = None
     end_ms: int | None = None
+    prefilter: bool | None = Field(None, description="Descartar símbolos sin actividad antes de lanzar los workers. Por defecto activo con muchos símbolos")
+    sync: bool | None = Field(None, description="Traer solo las órdenes nuevas desde el último high-water mark de cada símbolo y fusionarlas con el histórico guardado")
 
 class OrdersService:
     """Servicio para manejar operaciones relacionadas con órdenes"""
@@ -65,9 +71,31 @@ class OrdersService:
         # Inicializar servicio de base de datos y símbolos
         self.db_service = DatabaseService()
         self.symbols_service = SymbolsService()
+        self.results_query_service = ResultsQueryService()
+        
+        # Un lock por ejecución: polls concurrentes del mismo ARN no repiten la ingesta.
+        # Cada entrada es [lock, usuarios] y se borra cuando la suelta el último que la usa
+        self._status_locks: Dict[str, List[Any]] = {}
+        self._status_locks_guard = threading.Lock()
+        
+        # Ingesta en segundo plano: sin ella, el GET de estado ingiere dentro del request.
+        # Los hilos arrancan con la aplicación (start_background_jobs desde el lifespan)
+        self.ingest_jobs = None
+        if config.INGEST_BACKGROUND and self.db_service.db_available:
+            self.ingest_jobs = IngestJobRunner(self._ingest_execution, self.db_service)
         
         logger.info(f"OrdersService inicializado con Lambda: {self.lambda_name}")
     
+    def start_background_jobs(self):
+        """Arranca la ingesta en segundo plano (retoma los trabajos pendientes)."""
+        if self.ingest_jobs is not None:
+            self.ingest_jobs.start()
+    
+    def stop_background_jobs(self):
+        """Detiene los hilos de la ingesta en segundo plano; los trabajos pendientes quedan en la base de datos."""
+        if self.ingest_jobs is not None:
+            self.ingest_jobs.stop()
+    
     def _get_symbols_source(self, order_request: OrderRequest) -> str:
         """
         Determina el origen de los símbolos para incluir en la respuesta.
@@ -173,6 +201,18 @@ class OrdersService:
             # Procesar respuesta de la coordinadora
             if isinstance(data, dict) and "statusCode" in data:
                 body = json.loads(data.get("body") or "{}")
+                if "executionArn" in body and body["executionArn"] is None:
+                    # El pre-filtro no encontró actividad: no se lanzó ninguna ejecución
+                    logger.info("Ningún símbolo con actividad en el rango, no se inició ejecución")
+                    return {
+                        "status": "no_activity",
+                        "executionArn": None,
+                        "symbols": [],
+                        "total_symbols": 0,
+                        "symbols_source": self._get_symbols_source(order_request),
+                        "prefilter": body.get("prefilter"),
+                        "message": f"Ninguno de los {len(symbols)} símbolos tiene órdenes en el rango"
+                    }
                 if "executionArn" in body:
                     execution_arn = body["executionArn"]
                     
@@ -214,6 +254,8 @@ class OrdersService:
                         "symbols_source": self._get_symbols_source(order_request),
                         "message": f"Procesamiento iniciado para {len(symbols)} símbolos"
                     }
+                    if body.get("prefilter"):
+                        response["prefilter"] = body["prefilter"]
                     
                     if database_saved:
                         response["database_saved"] = True
@@ -315,6 +357,12 @@ class OrdersService:
         """
         Consulta el estado de una ejecución de Step Functions.
         
+        Una ejecución que ya llegó a un estado terminal y se ingirió se sirve desde la
+        base de datos, sin llamar a Step Functions ni volver a ingerir sus órdenes.
+        
+        Con la ingesta en segundo plano (INGEST_BACKGROUND) la respuesta no espera la
+        ingesta: la ejecución pasa al IngestJobRunner y `ingest` trae su progreso.
+        
         Args:
             execution_arn: ARN de la ejecución a consultar
             
@@ -324,6 +372,81 @@ class OrdersService:
         Raises:
             HTTPException: Si hay error consultando el estado
         """
+        if self.ingest_jobs is None:
+            return self._ingest_execution(execution_arn)
+        
+        cached = self._get_ingested_status(execution_arn)
+        if cached is not None:
+            return cached
+        response = self._describe_execution_status(execution_arn, ingest=False)
+        self.ingest_jobs.watch(execution_arn, finished=response["status"] in TERMINAL_STATUSES)
+        response["ingest"] = self.db_service.get_ingest_progress(execution_arn)
+        return response
+    
+    def notify_execution_completed(self, execution_arn: str) -> Dict[str, Any]:
+        """
+        Notificación de que la ejecución terminó (p. ej. desde una regla de EventBridge):
+        encola su ingesta de inmediato y responde sin esperarla.
+        """
+        if self.ingest_jobs is None:
+            return self._ingest_execution(execution_arn)
+        
+        cached = self._get_ingested_status(execution_arn)
+        if cached is not None:
+            return {"executionArn": execution_arn, "queued": False, "status": cached.get("status"),
+                    "ingest": self.db_service.get_ingest_progress(execution_arn)}
+        queued = self.ingest_jobs.submit(execution_arn)
+        logger.info(f"Notificación de fin para {execution_arn}: {'encolada' if queued else 'ya en curso'}")
+        return {"executionArn": execution_arn, "queued": queued,
+                "ingest": self.db_service.get_ingest_progress(execution_arn)}
+    
+    def get_ingest_progress(self, execution_arn: str) -> Dict[str, Any]:
+        """Progreso de la ingesta en segundo plano de una ejecución."""
+        progress = self.db_service.get_ingest_progress(execution_arn)
+        if progress is None:
+            raise HTTPException(status_code=404, detail=f"No hay ingesta registrada para {execution_arn}")
+        return {"executionArn": execution_arn, "ingest": progress}
+    
+    def _ingest_execution(self, execution_arn: str) -> Dict[str, Any]:
+        """Estado de la ejecución ingiriéndola si terminó; una sola ingesta a la vez por ejecución."""
+        cached = self._get_ingested_status(execution_arn)
+        if cached is not None:
+            return cached
+        
+        with self._status_lock(execution_arn):
+            # Otro request pudo terminar la ingesta mientras se esperaba el lock
+            cached = self._get_ingested_status(execution_arn)
+            if cached is not None:
+                return cached
+            return self._describe_execution_status(execution_arn)
+    
+    @contextmanager
+    def _status_lock(self, execution_arn: str) -> Iterator[None]:
+        with self._status_locks_guard:
+            entry = self._status_locks.setdefault(execution_arn, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._status_locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._status_locks[execution_arn]
+    
+    def _get_ingested_status(self, execution_arn: str) -> Dict[str, Any] | None:
+        cached = self.db_service.get_terminal_status(execution_arn)
+        if cached is None:
+            return None
+        logger.info(f"Estado de {execution_arn} servido desde base de datos ({cached.get('status')})")
+        cached["served_from"] = "database"
+        return cached
+    
+    def _describe_execution_status(self, execution_arn: str, ingest: bool = True) -> Dict[str, Any]:
+        """
+        Describe la ejecución en Step Functions y, si terminó e `ingest`, la ingiere y la
+        marca como ingerida.
+        """
         try:
             logger.info(f"Consultando estado de ejecución: {execution_arn}")
             
@@ -331,6 +454,7 @@ class OrdersService:
             desc = self.sf_client.describe_execution(executionArn=execution_arn)
             status = desc["status"]  # RUNNING | SUCCEEDED | FAILED | TIMED_OUT | ABORTED
             result = None
+            ingested = False
             
             # Si la ejecución está completa, procesar resultado
             if status == "SUCCEEDED":
@@ -361,28 +485,31 @@ class OrdersService:
                     result["aws_total_duration_seconds"] = round(aws_duration_seconds, 3)
                     result["aws_total_duration_formatted"] = duration_formatted
                 
-                # Guardar datos en base de datos automáticamente
-                database_save_result = self._save_execution_to_database(
-                    execution_arn, status, result
-                )
+                # Guardar datos en base de datos automáticamente (salvo si lo hará el IngestJobRunner)
+                if ingest:
+                    database_save_result = self._save_execution_to_database(
+                        execution_arn, status, result
+                    )
                 
-                # Agregar información del guardado a la respuesta
-                result["database_save"] = database_save_result
+                    # Agregar información del guardado a la respuesta
+                    result["database_save"] = database_save_result
+                    ingested = bool(database_save_result.get("success"))
                 
-                # Agregar información adicional de la base de datos
-                db_data = self.db_service.get_execution_data(execution_arn)
-                if db_data["found"]:
-                    result["database_info"] = {
-                        "orders_in_db": db_data["orders_in_db"],
-                        "processing_time_seconds": db_data["processing_time_seconds"],
-                        "created_at": db_data["created_at"],
-                        "updated_at": db_data["updated_at"]
-                    }
+                    # Agregar información adicional de la base de datos
+                    db_data = self.db_service.get_execution_data(execution_arn)
+                    if db_data["found"]:
+                        result["database_info"] = {
+                            "orders_in_db": db_data["orders_in_db"],
+                            "processing_time_seconds": db_data["processing_time_seconds"],
+                            "created_at": db_data["created_at"],
+                            "updated_at": db_data["updated_at"]
+                        }
             
             elif status in ["FAILED", "TIMED_OUT", "ABORTED"]:
                 # También guardar ejecuciones fallidas para tracking
                 result = {"error": desc.get("error", "Execution failed")}
-                self._save_execution_to_database(execution_arn, status, result)
+                if ingest:
+                    ingested = bool(self._save_execution_to_database(execution_arn, status, result).get("success"))
             
             # Calcular duración de la ejecución si está disponible
             aws_execution_details = {
@@ -414,6 +541,12 @@ class OrdersService:
                 "aws_execution_details": aws_execution_details
             }
             
+            # Solo se marca si la ingesta terminó bien: si falló, el próximo poll la reintenta
+            if ingested:
+                ingested_at = self.db_service.mark_execution_ingested(execution_arn, response)
+                if ingested_at:
+                    response["ingested_at"] = ingested_at
+            
             logger.info(f"Estado consultado: {status} para {execution_arn}")
             return response
             
@@ -540,6 +673,110 @@ class OrdersService:
             logger.error(f"Error consultando BD para {execution_arn}: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
     
+    def _get_result_pointers(self, execution_arn: str, required: str) -> Dict[str, Any]:
+        """
+        Punteros al resultado de una ejecución (s3_uri, rollups_s3_uri, manifest_uri, order_stats).
+        Se toman de la BD; si el registro no trae `required`, de la salida de Step Functions.
+        """
+        db_data = self.db_service.get_execution_data(execution_arn)
+        fields = ("s3_uri", "rollups_s3_uri", "manifest_uri", "order_stats")
+        if db_data.get("found") and db_data.get(required):
+            return {field: db_data.get(field) for field in fields}
+        desc = self.sf_client.describe_execution(executionArn=execution_arn)
+        output = json.loads(desc.get("output") or "{}") if desc["status"] == "SUCCEEDED" else {}
+        return {field: output.get(field) for field in fields}
+    
+    def query_execution_orders(self, execution_arn: str, symbols: list[str] | None = None,
+                               start_ms: int | None = None, end_ms: int | None = None,
+                               side: str | None = None, skip: int = 0, limit: int = 100) -> Dict[str, Any]:
+        """
+        Consulta las órdenes de una ejecución directamente sobre su resultado en S3 (sin ingesta a BD).
+        
+        Args:
+            execution_arn: ARN de la ejecución
+            symbols: Símbolos a incluir
+            start_ms, end_ms: Rango de cTime
+            side: Lado de la orden
+            skip, limit: Paginación
+            
+        Returns:
+            Página de órdenes en orden cTime DESC
+            
+        Raises:
+            HTTPException: Si la ejecución no tiene resultado en S3
+        """
+        try:
+            logger.info(f"Consulta directa en S3 para {execution_arn} (symbols={symbols}, "
+                        f"start_ms={start_ms}, end_ms={end_ms}, side={side})")
+            
+            pointers = self._get_result_pointers(execution_arn, "s3_uri")
+            s3_uri = pointers.get("s3_uri")
+            if not s3_uri:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"No hay resultado en S3 para {execution_arn}"
+                )
+            
+            result = self.results_query_service.query(s3_uri, symbols, start_ms, end_ms, side, skip, limit,
+                                                      manifest_uri=pointers.get("manifest_uri"))
+            return {"execution_arn": execution_arn, "s3_uri": s3_uri, **result}
+            
+        except HTTPException:
+            raise
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error(f"Error consultando resultado en S3 para {execution_arn}: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    def get_execution_stats(self, execution_arn: str, granularity: str = "daily", symbol: str | None = None,
+                            start_ms: int | None = None, end_ms: int | None = None) -> Dict[str, Any]:
+        """
+        Rollups por símbolo y hora/día de una ejecución, leídos del sidecar del aggregator.
+        
+        Args:
+            execution_arn: ARN de la ejecución
+            granularity: "hourly" o "daily"
+            symbol: Símbolo opcional para filtrar
+            start_ms, end_ms: Rango opcional sobre el inicio de cada bucket
+            
+        Returns:
+            Resumen de la ejecución (order_stats) y filas de rollups
+            
+        Raises:
+            HTTPException: Si la ejecución no tiene rollups
+        """
+        try:
+            logger.info(f"Consultando rollups ({granularity}) para {execution_arn}")
+            
+            pointers = self._get_result_pointers(execution_arn, "rollups_s3_uri")
+            rollups_uri = pointers.get("rollups_s3_uri")
+            order_stats = pointers.get("order_stats")
+            if not rollups_uri:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"No hay rollups disponibles para {execution_arn}"
+                )
+            
+            rows = self.db_service.get_rollups(rollups_uri, granularity, symbol, start_ms, end_ms)
+            return {
+                "execution_arn": execution_arn,
+                "granularity": granularity,
+                "timezone": "UTC",
+                "symbol": symbol,
+                "order_stats": order_stats,
+                "total_rows": len(rows),
+                "rows": rows
+            }
+            
+        except HTTPException:
+            raise
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error(f"Error consultando rollups para {execution_arn}: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
+    
     def save_execution_data_manual(self, execution_arn: str, data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Guarda manualmente datos de ejecución en la base de datos.
@@ -0,0 +1,185 @@
+"""
+Consultas por símbolo, rango de cTime y lado directamente sobre los resultados
+guardados en S3, sin pasar por la ingesta a MySQL.
+
+Con un resultado particionado (manifest.json) se descartan las particiones por
+símbolo y min/max cTime del manifest y solo se descargan las elegidas (una
+partición es un símbolo-día, así que se parsea completa y queda en un cache LRU
+del proceso, acotado por cantidad de órdenes). Cada partición viene en cTime
+DESC: se fusionan con un heap y se corta en cuanto se pasa del inicio del rango
+o se completa la página.
+
+Un resultado compuesto (modo compose del aggregator) está ordenado por símbolo y en
+cTime DESC solo dentro de cada uno: con su manifest (manifest_uri) se lee cada
+símbolo por su rango de bytes y se fusionan igual que las particiones. Sin manifest,
+un objeto único se lee en streaming y se recorre completo (no se puede cortar por
+cTime porque no se sabe si está ordenado de punta a punta).
+"""
+
+import heapq
+import boto3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from lambda_functions.common.columnar import decode_orders, is_columnar_key
+from lambda_functions.common.result_writer import (
+    base_symbol, is_manifest_key, iter_orders, order_ctime, order_symbol, select_partitions,
+)
+from app.core.config import config
+import json
+import logging
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PARTITION_FETCH_CONCURRENCY = 8
+
+
+class _PartitionCache:
+    """LRU de particiones decodificadas, acotado por el total de órdenes guardadas."""
+
+    def __init__(self, max_orders: int):
+        self.max_orders = max_orders
+        self._items: "OrderedDict[Tuple[str, str], List[Dict[str, Any]]]" = OrderedDict()
+        self._orders = 0
+        self._lock = Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            orders = self._items.get(key)
+            if orders is not None:
+                self._items.move_to_end(key)
+            return orders
+
+    def put(self, key: Tuple[str, str], orders: List[Dict[str, Any]]):
+        if len(orders) > self.max_orders:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = orders
+            self._orders += len(orders)
+            while self._orders > self.max_orders:
+                _, evicted = self._items.popitem(last=False)
+                self._orders -= len(evicted)
+
+
+class ResultsQueryService:
+    """Servicio de consultas sobre los objetos de resultados en S3"""
+
+    def __init__(self):
+        self.s3_client = boto3.client("s3", region_name=config.get_aws_config()["region"])
+        self.cache = _PartitionCache(config.RESULTS_CACHE_MAX_ORDERS)
+
+    def _load_partition(self, bucket: str, key: str) -> List[Dict[str, Any]]:
+        cached = self.cache.get((bucket, key))
+        if cached is not None:
+            return cached
+        body = self.s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+        orders = list(iter_orders(body, key))
+        self.cache.put((bucket, key), orders)
+        return orders
+
+    def _load_partitions(self, bucket: str, partitions: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Particiones elegidas: las que no están en cache se descargan y parsean en paralelo."""
+        if not partitions:
+            return []
+        with ThreadPoolExecutor(max_workers=min(PARTITION_FETCH_CONCURRENCY, len(partitions))) as pool:
+            return list(pool.map(lambda p: self._load_partition(bucket, p["key"]), partitions))
+
+    def _single_object_orders(self, bucket: str, key: str) -> Iterator[Dict[str, Any]]:
+        cached = self.cache.get((bucket, key))
+        if cached is not None:
+            return iter(cached)
+        body = self.s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+        if is_columnar_key(key):
+            orders = decode_orders(body, key)
+            self.cache.put((bucket, key), orders)
+            return iter(orders)
+        return iter_orders(body, key)
+
+    def _composed_orders(self, bucket: str, key: str, manifest: Dict[str, Any],
+                         entries: List[Dict[str, Any]]) -> List[Iterator[Dict[str, Any]]]:
+        """Corridas de los símbolos elegidos de un resultado compuesto, cada una con un GET por rango."""
+        key = manifest.get("s3_key") or key
+        runs = []
+        for entry in entries:
+            offset, length = entry["offset"], entry["length"]
+            body = self.s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={offset}-{offset + length - 1}")["Body"]
+            runs.append(iter_orders(body, key))
+        return runs
+
+    def query(self, s3_uri: str, symbols: Optional[Sequence[str]] = None, start_ms: Optional[int] = None,
+              end_ms: Optional[int] = None, side: Optional[str] = None, skip: int = 0,
+              limit: int = 100, manifest_uri: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Órdenes que cumplen los filtros, en cTime DESC y paginadas
+
+        Args:
+            s3_uri: URI del resultado (manifest.json de un resultado particionado u objeto único)
+            symbols: Símbolos a incluir (todos si no se indica)
+            start_ms, end_ms: Rango de cTime (inclusive)
+            side: Lado de la orden (buy, sell, open_long, ...)
+            skip, limit: Paginación sobre el resultado filtrado
+            manifest_uri: Manifest de un resultado compuesto (rango de bytes de cada símbolo)
+
+        Returns:
+            Página de órdenes, si hay más, y cuántas particiones se leyeron
+        """
+        if not s3_uri or not s3_uri.startswith("s3://"):
+            raise ValueError(f"URI de S3 inválida: {s3_uri}")
+        bucket, key = s3_uri[5:].split("/", 1)
+        wanted = {base_symbol(symbol) for symbol in symbols} if symbols else None
+        side = side.lower() if side else None
+
+        info: Dict[str, Any] = {"layout": "single"}
+        ordered = True  # la fuente completa viene en cTime DESC: se corta al pasar start_ms
+        if is_manifest_key(key):
+            manifest = json.loads(self.s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+            partitions = select_partitions(manifest, symbols, start_ms, end_ms)
+            info = {
+                "layout": "partitioned",
+                "partitions_total": len(manifest.get("partitions") or []),
+                "partitions_scanned": len(partitions),
+            }
+            logger.info(f"Consulta sobre {len(partitions)}/{info['partitions_total']} particiones de {key}")
+            source = heapq.merge(*self._load_partitions(bucket, partitions), key=order_ctime, reverse=True)
+        elif manifest_uri:
+            manifest_bucket, manifest_key = manifest_uri[5:].split("/", 1)
+            manifest = json.loads(self.s3_client.get_object(Bucket=manifest_bucket, Key=manifest_key)["Body"].read())
+            entries = select_partitions({"partitions": manifest.get("entries") or []}, symbols, start_ms, end_ms)
+            info = {
+                "layout": "composed",
+                "partitions_total": len(manifest.get("entries") or []),
+                "partitions_scanned": len(entries),
+            }
+            source = heapq.merge(*self._composed_orders(bucket, key, manifest, entries), key=order_ctime, reverse=True)
+        else:
+            source = self._single_object_orders(bucket, key)
+            ordered = False
+
+        def matches() -> Iterator[Dict[str, Any]]:
+            for order in source:
+                ctime = order_ctime(order)
+                if end_ms is not None and ctime > end_ms:
+                    continue
+                if start_ms is not None and ctime < start_ms:
+                    if ordered:
+                        break  # cTime DESC: no quedan órdenes dentro del rango
+                    continue
+                if wanted is not None and order_symbol(order) not in wanted:
+                    continue
+                if side is not None and str(order.get("side") or "").lower() != side:
+                    continue
+                yield order
+
+        page = list(islice(matches(), skip, skip + limit + 1))
+        return {
+            "orders": page[:limit],
+            "pagination": {"skip": skip, "limit": limit, "current_count": min(len(page), limit),
+                           "has_more": len(page) > limit},
+            **info,
+        }
@@ -7,11 +7,14 @@ from aws_cdk import (
     aws_stepfunctions_tasks as tasks,
     aws_s3 as s3,
     aws_secretsmanager as secretsmanager,
+    aws_dynamodb as dynamodb,
 )
 from constructs import Construct
 import os
 import json
 
+from scripts.package_lambdas import stage_lambda
+
 
 class BitgetStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
@@ -23,6 +26,23 @@ class BitgetStack(Stack):
             "BitgetResultsBucket",
             block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
             versioned=False,
+            # Los archivos intermedios expiran solos: el aggregator en modo compose no los borra uno a uno
+            lifecycle_rules=[
+                s3.LifecycleRule(prefix="per-symbol/", expiration=Duration.days(2),
+                                 abort_incomplete_multipart_upload_after=Duration.days(1)),
+                s3.LifecycleRule(prefix="partials/", expiration=Duration.days(2),
+                                 abort_incomplete_multipart_upload_after=Duration.days(1)),
+            ],
+        )
+
+        # Shared rate budget: every worker leases Bitget request tokens from this table,
+        # so the aggregate rate stays within the API key limits whatever the Map concurrency
+        rate_budget_table = dynamodb.Table(
+            self,
+            "BitgetRateBudgetTable",
+            partition_key=dynamodb.Attribute(name="budget_key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
         )
 
         # Secrets Manager secret for Bitget credentials (placeholder)
@@ -56,8 +76,15 @@ class BitgetStack(Stack):
         worker_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name("AWSXRayDaemonWriteAccess"))
         # allow PutObject to the results bucket
         results_bucket.grant_put(worker_role)
+        # allow reading per-symbol sync state (incremental mode high-water marks)
+        results_bucket.grant_read(worker_role, "sync-state/*")
+        # allow merging and removing the partial file of a resumed invocation
+        results_bucket.grant_read(worker_role, "per-symbol/*")
+        results_bucket.grant_delete(worker_role, "per-symbol/*")
         # allow reading the secret
         credentials_secret.grant_read(worker_role)
+        # allow leasing tokens from the shared rate budget
+        rate_budget_table.grant_read_write_data(worker_role)
 
         # IAM role for Collector / Aggregator Lambda
         collector_role = iam.Role(
@@ -72,6 +99,11 @@ class BitgetStack(Stack):
         results_bucket.grant_read_write(collector_role)
         credentials_secret.grant_read(collector_role)
 
+        # Lambda code comes from lambda_functions/<name>, staged with the shared modules of
+        # lambda_functions/common and each Lambda's requirements (see scripts/package_lambdas.py)
+        def lambda_code(name: str) -> _lambda.Code:
+            return _lambda.Code.from_asset(stage_lambda(name, install=True))
+
         # Common lambda properties
         lambda_timeout = Duration.seconds(60)
         lambda_runtime = _lambda.Runtime.PYTHON_3_11
@@ -81,8 +113,8 @@ class BitgetStack(Stack):
             self,
             "CoordinatorLambda",
             runtime=lambda_runtime,
-            handler="handler.handler",
-            code=_lambda.Code.from_asset(os.path.join(os.getcwd(), "src/lambdas/coordinator")),
+            handler="app.handler",
+            code=lambda_code("coordinator"),
             timeout=lambda_timeout,
             role=coordinator_role,
             environment={
@@ -98,7 +130,7 @@ class BitgetStack(Stack):
             "WorkerLambda",
             runtime=lambda_runtime,
             handler="app.handler",
-            code=_lambda.Code.from_asset(os.path.join(os.getcwd(), "src/lambdas/worker")),
+            code=lambda_code("worker"),
             timeout=Duration.seconds(120),
             memory_size=512,
             role=worker_role,
@@ -106,16 +138,22 @@ class BitgetStack(Stack):
                 "RESULTS_BUCKET": results_bucket.bucket_name,
                 "CREDENTIALS_SECRET_NAME": credentials_secret.secret_name,
                 "AWS_REGION": self.region,
+                "SHARED_RATE_BACKEND": "dynamodb",
+                "SHARED_RATE_TABLE": rate_budget_table.table_name,
             },
         )
 
+        # Coordinator pre-filter: probe symbol activity through the worker before fanning out
+        coordinator_lambda.add_environment("WORKER_FUNCTION_NAME", worker_lambda.function_name)
+        worker_lambda.grant_invoke(coordinator_role)
+
         # Collector Lambda - aggregates map results and writes final file
         collector_lambda = _lambda.Function(
             self,
             "CollectorLambda",
             runtime=lambda_runtime,
-            handler="handler.handler",
-            code=_lambda.Code.from_asset(os.path.join(os.getcwd(), "src/lambdas/aggregator")),
+            handler="app.handler",
+            code=lambda_code("aggregator"),
             timeout=Duration.seconds(300),
             memory_size=1024,
             role=collector_role,
@@ -123,6 +161,8 @@ class BitgetStack(Stack):
                 "RESULTS_BUCKET": results_bucket.bucket_name,
                 "RESULTS_PREFIX": "bitget-orders/",
                 "AWS_REGION": self.region,
+                # Reducción en árbol: resultados por reducer intermedio
+                "REDUCE_FAN_IN": "50",
             },
         )
 
@@ -235,15 +275,55 @@ class BitgetStack(Stack):
                 items_path="$.symbols",
                 result_path="$.mapResults",
             )
-            map_state.iterator(worker_invoke)
+            # Re-invocar el worker mientras devuelva un continuation token
+            resume_invoke = tasks.LambdaInvoke(
+                self,
+                "ResumeWorker",
+                lambda_function=worker_lambda,
+                input_path="$.continuation",
+                payload_response_only=True,
+            )
+            has_continuation = sfn.Choice(self, "HasContinuation")
+            has_continuation.when(sfn.Condition.is_present("$.continuation"), resume_invoke)
+            has_continuation.otherwise(sfn.Succeed(self, "SymbolDone"))
+            resume_invoke.next(has_continuation)
+            map_state.iterator(worker_invoke.next(has_continuation))
+            # Reducción en árbol (igual que step_functions/init.json): mientras haya más de
+            # REDUCE_FAN_IN resultados, reducers intermedios los fusionan en corridas parciales.
+            # El plan y cada nivel se escriben sobre $.mapResults: los items no se duplican
+            plan_reduce = tasks.LambdaInvoke(
+                self,
+                "PlanReduce",
+                lambda_function=collector_lambda,
+                payload=sfn.TaskInput.from_object({"mode": "plan", "items": sfn.JsonPath.list_at("$.mapResults")}),
+                result_path="$.mapResults",
+                payload_response_only=True,
+            )
+            reduce_level = sfn.Map(
+                self,
+                "ReduceLevel",
+                max_concurrency=10,
+                items_path="$.mapResults.slices",
+                parameters={"mode": "partial", "items.$": "$$.Map.Item.Value"},
+                result_path="$.mapResults",
+            )
+            reduce_level.iterator(tasks.LambdaInvoke(
+                self,
+                "ReduceSlice",
+                lambda_function=collector_lambda,
+                payload_response_only=True,
+            ))
             collector_task = tasks.LambdaInvoke(
                 self,
-                "RunCollector",
+                "Aggregate",
                 lambda_function=collector_lambda,
-                payload=sfn.TaskInput.from_object({"results": sfn.JsonPath.string_at("$.mapResults"), "startTimeMs": sfn.JsonPath.string_at("$.startTimeMs")}),
+                input_path="$.mapResults.items",
                 payload_response_only=True,
             )
-            definition = map_state.next(collector_task)
+            needs_reduce = sfn.Choice(self, "NeedsReduce")
+            needs_reduce.when(sfn.Condition.boolean_equals("$.mapResults.done", False), reduce_level.next(plan_reduce))
+            needs_reduce.otherwise(collector_task)
+            definition = map_state.next(plan_reduce).next(needs_reduce)
             state_machine = sfn.StateMachine(
                 self,
                 "BitgetStateMachineProgrammatic",
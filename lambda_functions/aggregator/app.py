@@ -1,16 +1,56 @@
 import os
+import sys
+import gzip
 import json
+import uuid
 import boto3
-from typing import Any, Dict, List, Optional
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from operator import itemgetter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from datetime import datetime, timezone
 
+# Módulos compartidos: en el paquete de despliegue van junto al handler (scripts/package_lambdas.py); en el repo, en ../common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import FORMAT_SUFFIX, decode_orders, is_columnar_key, put_orders, resolve_format
+from result_writer import (
+    CODEC_ENCODING, CODEC_SUFFIX, INLINE_ORDERS_FIELD, RUN_SORT_CTIME_DESC, RUN_SORT_METADATA, PartitionedWriter,
+    S3NdjsonWriter, encode_chunk, inline_orders, iter_orders, resolve_codec, sidecar_key,
+)
+from order_stats import RollupBuilder, add_order, empty_summary, merge_summaries, summarize_orders
+from kway_merge import KWayMerge, sorted_run
+from s3_compose import S3Composer
+from parallel import PackedRun, ProcessPool, pack_run
+
 # Config
-S3 = boto3.client("s3")
+PREFETCH_CONCURRENCY = max(1, int(os.environ.get("PREFETCH_CONCURRENCY", "16")))  # lecturas S3 en paralelo
+S3_CLIENT_CONFIG = Config(max_pool_connections=max(10, PREFETCH_CONCURRENCY))
+S3 = boto3.client("s3", config=S3_CLIENT_CONFIG)
 RESULTS_BUCKET = os.environ.get("RESULTS_BUCKET")                              # obligatorio para guardar en S3
 RESULTS_PREFIX = os.environ.get("RESULTS_PREFIX", "bitget-results/").lstrip("/")
 RESPONSE_MAX_ORDERS = int(os.environ.get("RESPONSE_MAX_ORDERS", "0"))
 AWS_REGION = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or "us-east-2"
 CLEANUP_PER_SYMBOL_FILES = os.environ.get("CLEANUP_PER_SYMBOL_FILES", "true").lower() == "true"
+RESULTS_FORMAT = os.environ.get("RESULTS_FORMAT", "json").lower()             # json | ndjson | columnar | parquet | bcol
+RESULTS_CODEC = os.environ.get("RESULTS_CODEC", "gzip")                        # solo para RESULTS_FORMAT=ndjson
+RESULTS_PART_SIZE_MB = int(os.environ.get("RESULTS_PART_SIZE_MB", "8"))
+# single: un objeto | partitioned: NDJSON (RESULTS_CODEC) por símbolo y día + manifest.json
+RESULTS_LAYOUT = os.environ.get("RESULTS_LAYOUT", "single").lower()
+MERGE_STREAM_MIN_ORDERS = int(os.environ.get("MERGE_STREAM_MIN_ORDERS", "5000"))  # corridas menores se leen completas
+RESULTS_ROLLUPS = os.environ.get("RESULTS_ROLLUPS", "true").lower() == "true"  # rollups por hora/día junto al resultado
+ROLLUPS_SUFFIX = ".rollups.json.gz"
+
+# Modo multi-proceso (opt-in): >1 decodifica las corridas y comprime la salida en procesos hijos
+AGGREGATE_PROCESSES = int(os.environ.get("AGGREGATE_PROCESSES", "0") or 0)
+ENCODE_CHUNK_MB = max(1, int(os.environ.get("ENCODE_CHUNK_MB", "4")))     # bloque de salida comprimido por hijo
+
+# Reducción en árbol: reducers intermedios fusionan REDUCE_FAN_IN resultados en una corrida parcial
+REDUCE_FAN_IN = max(2, int(os.environ.get("REDUCE_FAN_IN", "50")))
+PARTIALS_PREFIX = os.environ.get("PARTIALS_PREFIX", "partials/").rstrip("/") + "/"
+
+# Composición server-side: "compose" concatena los NDJSON per-symbol con UploadPartCopy (sin orden global)
+AGGREGATE_MODE = os.environ.get("AGGREGATE_MODE", "merge").lower()            # merge | compose
+COMPOSE_DELETE_SOURCES = os.environ.get("COMPOSE_DELETE_SOURCES", "false").lower() == "true"  # si no, expiran por lifecycle
 
 MAX_RESPONSE_SIZE_KB = int(os.environ.get("MAX_RESPONSE_SIZE_KB", "220"))      # Límite en KB para respuestas
 
@@ -20,16 +60,6 @@ def _as_int(x: Any, default: int = 0) -> int:
     except Exception:
         return default
 
-def _order_time_safe(o: Any) -> int:
-    """
-    Extrae timestamp de una orden para ordenamiento.
-    Si no se puede parsear, retorna 0 para que quede al final.
-    """
-    if not isinstance(o, dict):
-        return 0
-    ts = o.get("orderTime") or o.get("timestamp") or o.get("time")
-    return _as_int(ts, 0)
-
 def _categorize_error(error_msg: str) -> Dict[str, str]:
     """
     Categoriza errores para conteo sin incluir listas extensas.
@@ -119,104 +149,113 @@ def _delete_per_symbol_files(per_symbol_keys: List[str]) -> Dict[str, Any]:
     print(f"Cleanup completed: {deleted_count}/{len(per_symbol_keys)} files deleted")
     return cleanup_result
 
-def _results_key(now: datetime, suffix: str = "json") -> str:
-    # key como YYYY/MM/DD/HH-mm-ssZ.json bajo RESULTS_PREFIX
+def _results_key(now: datetime, suffix: Optional[str] = "json") -> str:
+    # key como YYYY/MM/DD/HH-mm-ssZ.json bajo RESULTS_PREFIX (sin suffix: base del layout particionado)
     prefix = RESULTS_PREFIX if RESULTS_PREFIX.endswith("/") else RESULTS_PREFIX + "/"
-    return f"{prefix}{now.strftime('%Y/%m/%d/%H-%M-%SZ')}.{suffix}"
-
-def _get_json_from_s3(bucket: str, key: str) -> Dict[str, Any]:
-    obj = S3.get_object(Bucket=bucket, Key=key)
-    return json.loads(obj["Body"].read())
+    base = f"{prefix}{now.strftime('%Y/%m/%d/%H-%M-%SZ')}"
+    return f"{base}.{suffix}" if suffix else base
 
-def handler(event, context):
+def _open_run(bucket: str, key: str, expected_count: Any = None) -> Iterable[Any]:
     """
-    event: lista con la salida de cada worker (ligero o legacy).
-      Ligero (recomendado):
-        { "symbol":"BTCUSDT", "count":123, "s3_key":"per-symbol/BTCUSDT/....json", "s3_uri":"s3://...", "error":null }
-      Legacy (no recomendado por límite 256KB):
-        { "symbol":"BTCUSDT", "orders":[{...}, ...], "count": 50, "error":null }
+    Abre un archivo per-symbol como corrida para la fusión: NDJSON (.ndjson, .ndjson.gz,
+    .ndjson.zst), columnar (.parquet, .bcol.gz) o el JSON legado {"orders": [...]}.
 
-    Este reducer:
-      - Lee órdenes desde S3 si viene s3_key; si no, usa 'orders' inline.
-      - Ordena DESC (más reciente primero).
-      - Guarda el resultado completo en S3.
-      - Devuelve un resumen + (opcional) un subconjunto de órdenes para inspección rápida.
+    Las corridas NDJSON grandes marcadas como ordenadas se leen en streaming a medida
+    que avanza la fusión; el resto se lee completo (y se ordena si no trae la marca).
     """
-    # Capturar tiempo de inicio del agregador
-    aggregator_start_time = datetime.now(timezone.utc)
-    print(f"Aggregator started at: {aggregator_start_time.isoformat()}")
-
-    items: List[Any] = event if isinstance(event, list) else [event]
-    all_orders: List[Dict[str, Any]] = []
-    errors: List[Dict[str, Optional[str]]] = []
-    total_symbols_processed = 0
-    total_symbols_with_data = 0
-    per_symbol_keys_to_delete: List[str] = []  # Track per-symbol files for cleanup
-
-    for idx, item in enumerate(items):
-        if not isinstance(item, dict):
-            errors.append({"symbol": None, "error": f"Unexpected item at {idx}: {type(item).__name__}={repr(item)[:200]}"})
-            continue
+    obj = S3.get_object(Bucket=bucket, Key=key)
+    body = obj["Body"]
+    is_sorted = (obj.get("Metadata") or {}).get(RUN_SORT_METADATA) == RUN_SORT_CTIME_DESC
+    if is_columnar_key(key):
+        orders = decode_orders(body, key)
+    elif is_sorted and _as_int(expected_count) >= MERGE_STREAM_MIN_ORDERS:
+        return iter_orders(body, key)
+    else:
+        orders = list(iter_orders(body, key))
+    return orders if is_sorted else sorted_run(orders)
 
-        sym = item.get("symbol")
-        total_symbols_processed += 1
+def _get_sidecar(key: str) -> Optional[Dict[str, Any]]:
+    """Resumen que el worker deja junto a su archivo; None en archivos anteriores a los sidecars."""
+    try:
+        return json.loads(S3.get_object(Bucket=RESULTS_BUCKET, Key=sidecar_key(key))["Body"].read())
+    except Exception:
+        return None
 
-        # Error del worker si vino
-        if item.get("error"):
-            error_info = _categorize_error(str(item.get("error")))
-            errors.append({
-                "symbol": sym,
-                "error": error_info.get("original", error_info["message"]),
-                "category": error_info["category"]
-            })
-            # Si hay error pero también datos, continúa procesando
-            if not item.get("orders") and not item.get("s3_key"):
-                continue
+def _open_run_with_sidecar(key: str, expected_count: Any = None) -> Tuple[Iterable[Any], Optional[Dict[str, Any]]]:
+    return _open_run(RESULTS_BUCKET, key, expected_count), _get_sidecar(key)
 
-        # Preferir leer desde S3 si hay puntero
-        orders: Any = None
-        key = item.get("s3_key")
-        if key and RESULTS_BUCKET:
+def _prefetch_runs(requests: List[Tuple[int, str, Any]]) -> Iterator[Tuple[int, Optional[Tuple[Iterable[Any], Optional[Dict[str, Any]]]], Optional[Exception]]]:
+    """
+    Descarga y parsea hasta PREFETCH_CONCURRENCY archivos per-symbol a la vez.
+    requests: (id, s3_key, count esperado). Entrega (id, (corrida, sidecar), error) en orden de finalización.
+    """
+    if not requests:
+        return
+    with ThreadPoolExecutor(max_workers=min(PREFETCH_CONCURRENCY, len(requests))) as pool:
+        futures = {pool.submit(_open_run_with_sidecar, key, count): run_id for run_id, key, count in requests}
+        for future in as_completed(futures):
             try:
-                print(f"Reading orders for {sym} from S3: {key}")
-                data = _get_json_from_s3(RESULTS_BUCKET, key)
-                orders = data.get("orders")
-                if orders:
-                    print(f"Loaded {len(orders)} orders for {sym} from S3")
-                    # Track this S3 key for potential cleanup
-                    per_symbol_keys_to_delete.append(key)
+                yield futures[future], future.result(), None
             except Exception as e:
-                error_info = _categorize_error(f"Failed to read from S3: {str(e)}")
-                errors.append({
-                    "symbol": sym,
-                    "error": error_info.get("original", error_info["message"]),
-                    "category": error_info["category"]
-                })
+                yield futures[future], None, e
 
-        # Fallback a orders inline (legacy)
-        if not orders and item.get("orders"):
-            orders = item.get("orders")
-            print(f"Using inline orders for {sym}: {len(orders) if orders else 0} orders")
+def _init_process():
+    """Inicializador de cada proceso hijo: cliente S3 propio, no el heredado del padre por fork."""
+    global S3
+    S3 = boto3.client("s3", config=S3_CLIENT_CONFIG)
 
-        # Si no hay orders de ninguna forma, skip
-        if not orders:
-            if sym:  # Solo contar símbolos conocidos
-                error_info = _categorize_error("No orders data available")
-                errors.append({
-                    "symbol": sym,
-                    "error": error_info.get("original", error_info["message"]),
-                    "category": error_info["category"]
-                })
-            continue
-
-        # Si llegamos aquí, hay datos válidos
-        orders_count = 0
+def _process_task(task: Tuple[str, Any]) -> Any:
+    """
+    Tareas del modo multi-proceso (se ejecutan en los hijos):
+      ("decode", (id, s3_key, count, symbol, parcial)) -> (PackedRun, sidecar)
+      ("encode", (bloque, codec, órdenes))            -> (bloque comprimido, órdenes, bytes sin comprimir)
+    """
+    kind, payload = task
+    if kind == "decode":
+        _, key, count, sym, partial = payload
+        sidecar = None if partial else _get_sidecar(key)
+        run = _open_run(RESULTS_BUCKET, key, count)
+        # Las parciales traen su resumen en el item; el resto solo si falta el sidecar
+        return pack_run(run, sym, summarize=sidecar is None and not partial), sidecar
+    if kind == "encode":
+        data, codec, count = payload
+        return encode_chunk(data, codec), count, len(data)
+    raise ValueError(f"Unknown process task: {kind}")
+
+def _packed_identity(entry: Tuple[int, int, PackedRun, int]) -> Optional[int]:
+    return entry[1] or None
+
+def _packed_duplicate(entry: Tuple[int, int, PackedRun, int]):
+    entry[2].dropped.add(entry[3])
+
+def _packed_chunks(entries: Iterable[Tuple[int, int, PackedRun, int]]) -> Iterator[Tuple[bytes, int]]:
+    """Agrupa las líneas fusionadas en bloques de ~ENCODE_CHUNK_MB: (bloque, cantidad de órdenes)."""
+    limit = ENCODE_CHUNK_MB * 1024 * 1024
+    chunk, count = bytearray(), 0
+    for _, _, run, i in entries:
+        chunk += run.lines[run.offsets[i]:run.offsets[i + 1]]
+        count += 1
+        if len(chunk) >= limit:
+            yield bytes(chunk), count
+            chunk, count = bytearray(), 0
+    if count:
+        yield bytes(chunk), count
+
+def _run_orders(sym: Optional[str], orders: Iterable[Any], counts: Dict[int, int], run_id: int,
+                errors: List[Dict[str, Optional[str]]], stats: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Valida y etiqueta las órdenes de una corrida mientras se consumen; un error de lectura corta solo esa corrida.
+    `stats` solo se pasa para corridas sin sidecar: su resumen se arma al vuelo.
+    """
+    try:
         for jdx, o in enumerate(orders):
             if isinstance(o, dict):
                 # Agregar metadatos si no existen
                 o.setdefault("_symbol", sym)
-                all_orders.append(o)
-                orders_count += 1
+                counts[run_id] += 1
+                if stats is not None:
+                    add_order(stats, o)
+                yield o
             else:
                 error_info = _categorize_error(f"Invalid order data at index {jdx}: {type(o).__name__}")
                 errors.append({
@@ -224,15 +263,16 @@ def handler(event, context):
                     "error": error_info.get("original", error_info["message"]),
                     "category": error_info["category"]
                 })
-
-        if orders_count > 0:
-            total_symbols_with_data += 1
-
-    # Orden cronológico DESC (más reciente primero)
-    print(f"Sorting {len(all_orders)} total orders by timestamp...")
-    all_orders.sort(key=_order_time_safe, reverse=True)
-
-    # Crear resumen de errores por categoría con detalles
+    except Exception as e:
+        error_info = _categorize_error(f"Failed to read from S3: {str(e)}")
+        errors.append({
+            "symbol": sym,
+            "error": error_info.get("original", error_info["message"]),
+            "category": error_info["category"]
+        })
+
+def _summarize_errors(errors: List[Dict[str, Optional[str]]]):
+    """Resumen de errores por categoría con algunos ejemplos."""
     error_summary = {}
     error_details = {}
 
@@ -251,70 +291,575 @@ def handler(event, context):
                 "symbol": error.get("symbol"),
                 "message": error.get("error", "Unknown error")[:200]  # Truncar mensajes largos
             })
+    return error_summary, error_details
+
+def _error_entry(sym: Optional[str], message: str) -> Dict[str, Optional[str]]:
+    error_info = _categorize_error(message)
+    return {
+        "symbol": sym,
+        "error": error_info.get("original", error_info["message"]),
+        "category": error_info["category"]
+    }
+
+class _RunSet:
+    """
+    Corridas listas para la fusión y la contabilidad de la ejecución (símbolos, errores, archivos a limpiar).
+
+    Los items pueden ser salidas de workers o corridas parciales de un nivel anterior del
+    árbol ({"partial": true, ...}); estas últimas traen sus propios conteos y errores.
+    """
+    def __init__(self):
+        self.runs: List[Iterator[Dict[str, Any]]] = []
+        self.meta: List[Dict[str, Any]] = []  # símbolo, key y si es parcial, por corrida
+        self.counts: Dict[int, int] = {}
+        self.errors: List[Dict[str, Optional[str]]] = []
+        self.symbols_processed = 0
+        self.carried_symbols_with_data = 0
+        self.level = 0
+        self.summaries: List[Dict[str, Any]] = []  # sidecars / resúmenes de parciales / resúmenes al vuelo
+        self.packed: List[PackedRun] = []  # corridas del modo multi-proceso
+
+    def add(self, sym: Optional[str], orders: Iterable[Any], key: Optional[str], partial: bool = False,
+            summary: Optional[Dict[str, Any]] = None):
+        run_id = len(self.runs)
+        self.counts[run_id] = 0
+        self.meta.append({"symbol": sym, "s3_key": key, "partial": partial})
+        if isinstance(orders, PackedRun):
+            # Ya validada y contada en el proceso hijo
+            self.counts[run_id] = orders.count
+            self.errors.extend(_error_entry(sym, message) for message in orders.errors)
+            self.summaries.append(summary if summary is not None else orders.summary)
+            self.packed.append(orders)
+            self.runs.append(orders.entries())
+            return
+        stats = None
+        if summary is None:
+            stats = empty_summary()
+            summary = stats
+        self.summaries.append(summary)
+        self.runs.append(_run_orders(sym, orders, self.counts, run_id, self.errors, stats))
+
+    def order_stats(self) -> Dict[str, Any]:
+        """Resumen de la ejecución combinando los resúmenes por corrida (sin recorrer órdenes con sidecar)."""
+        return merge_summaries(self.summaries)
+
+    def close(self) -> int:
+        """Tras la fusión: registra los símbolos sin datos y retorna cuántos tuvieron órdenes."""
+        with_data = self.carried_symbols_with_data
+        for run_id, meta in enumerate(self.meta):
+            if meta["partial"]:
+                continue
+            if self.counts[run_id] > 0:
+                with_data += 1
+            elif meta["symbol"]:
+                self.errors.append(_error_entry(meta["symbol"], "No orders data available"))
+        return with_data
+
+    def consumed_keys(self) -> List[str]:
+        keys = []
+        for run_id, meta in enumerate(self.meta):
+            if meta["s3_key"] and (meta["partial"] or self.counts[run_id] > 0):
+                keys.append(meta["s3_key"])
+                if not meta["partial"]:
+                    keys.append(sidecar_key(meta["s3_key"]))  # inexistente en archivos viejos: delete no falla
+        return keys
+
+def _collect_runs(items: List[Any], pool: Optional[ProcessPool] = None) -> _RunSet:
+    """
+    Valida los items, lee en paralelo los archivos referenciados y arma una corrida por item.
+    Con `pool`, los archivos se leen y decodifican en los procesos hijos y las corridas son `PackedRun`.
+    """
+    run_set = _RunSet()
+    candidates: List[Tuple[int, Optional[str], Dict[str, Any]]] = []
+    for idx, item in enumerate(items):
+        if not isinstance(item, dict):
+            run_set.errors.append({"symbol": None, "error": f"Unexpected item at {idx}: {type(item).__name__}={repr(item)[:200]}"})
+            continue
+
+        if item.get("partial"):
+            # Corrida parcial de un reducer intermedio: ya trae la contabilidad de sus símbolos
+            run_set.symbols_processed += _as_int(item.get("symbols_processed"))
+            run_set.carried_symbols_with_data += _as_int(item.get("symbols_with_data"))
+            run_set.errors.extend(item.get("errors") or [])
+            run_set.level = max(run_set.level, _as_int(item.get("level")) + 1)
+            if item.get("s3_key"):
+                candidates.append((idx, None, item))
+            continue
+
+        sym = item.get("symbol")
+        run_set.symbols_processed += 1
+
+        # Error del worker si vino
+        if item.get("error"):
+            run_set.errors.append(_error_entry(sym, str(item.get("error"))))
+            # Si hay error pero también datos, continúa procesando
+            if not _has_inline(item) and not item.get("s3_key"):
+                continue
+        candidates.append((idx, sym, item))
+
+    # Preferir leer desde S3 si hay puntero: todas las lecturas en paralelo, procesadas según terminan
+    opened: Dict[int, Any] = {}
+    fetch_requests = [
+        (idx, item["s3_key"], item.get("count")) for idx, _, item in candidates if item.get("s3_key") and RESULTS_BUCKET
+    ]
+    if pool is not None:
+        print(f"Decoding {len(fetch_requests)} per-symbol files in {pool.processes} processes...")
+        tasks = [("decode", (idx, item["s3_key"], item.get("count"), sym, bool(item.get("partial"))))
+                 for idx, sym, item in candidates if item.get("s3_key") and RESULTS_BUCKET]
+        for task, opened_run, error in pool.imap_unordered(tasks):
+            opened[task[1][0]] = RuntimeError(error) if error is not None else opened_run
+    else:
+        print(f"Prefetching {len(fetch_requests)} per-symbol files (concurrency {PREFETCH_CONCURRENCY})...")
+        for idx, opened_run, error in _prefetch_runs(fetch_requests):
+            opened[idx] = error if error is not None else opened_run
+
+    for idx, sym, item in candidates:
+        orders: Any = None
+        sidecar: Optional[Dict[str, Any]] = None
+        key = item.get("s3_key") if idx in opened else None
+        if isinstance(opened.get(idx), Exception):
+            key = None
+            run_set.errors.append(_error_entry(sym, f"Failed to read from S3: {str(opened[idx])}"))
+        elif key:
+            orders, sidecar = opened[idx]
+
+        if item.get("partial"):
+            if orders is not None:
+                run_set.add(None, orders, key, partial=True, summary=item.get("order_stats") or empty_summary())
+            continue
+
+        # Órdenes inline: símbolos chicos que el worker no guardó en S3 (o respuestas legacy)
+        if (orders is None or orders == [] or (isinstance(orders, PackedRun) and not orders.count)) and _has_inline(item):
+            key = None
+            sidecar = None
+            orders = sorted_run(inline_orders(item))
+            print(f"Using inline orders for {sym}: {len(orders)} orders")
+            if pool is not None:
+                orders = pack_run(orders, sym, summarize=True)
+
+        # Si no hay orders de ninguna forma, skip
+        if orders is None:
+            if sym:  # Solo contar símbolos conocidos
+                run_set.errors.append(_error_entry(sym, "No orders data available"))
+            continue
+
+        run_set.add(sym, orders, key, summary=sidecar)
+    return run_set
+
+def _has_inline(item: Dict[str, Any]) -> bool:
+    return bool(item.get("orders") or item.get(INLINE_ORDERS_FIELD))
+
+def _cleanup(keys: List[str]) -> Dict[str, Any]:
+    if not keys:
+        return {"cleaned": False, "reason": "no per-symbol files to clean"}
+    print(f"Starting cleanup of {len(keys)} per-symbol files...")
+    cleanup_result = _delete_per_symbol_files(keys)
+    if cleanup_result.get("cleaned"):
+        print(f"Cleanup successful: {cleanup_result.get('deleted_count', 0)} files deleted")
+    else:
+        print(f"Cleanup failed or skipped: {cleanup_result.get('reason', 'unknown')}")
+    return cleanup_result
+
+def _read_sidecar(key: str) -> Dict[str, Any]:
+    """Sidecar del worker; para archivos sin sidecar, solo el tamaño vía head_object."""
+    sidecar = _get_sidecar(key)
+    if sidecar is None:
+        head = S3.head_object(Bucket=RESULTS_BUCKET, Key=key)
+        return {"bytes": head["ContentLength"]}
+    return sidecar
+
+def compose_results(items: List[Any]) -> Optional[Dict[str, Any]]:
+    """
+    Arma el resultado final concatenando en S3 los NDJSON per-symbol (UploadPartCopy), en
+    el orden del manifest (por símbolo), y resume con los sidecars sin descargar los datos.
 
-    # Timing del agregador
+    Las órdenes inline se comprimen acá y entran como una fuente más.
+
+    Retorna None si algún item no se puede componer (formato columnar, codecs distintos
+    o corridas parciales): el handler cae entonces a la fusión normal.
+    """
+    aggregator_start_time = datetime.now(timezone.utc)
+    errors: List[Dict[str, Optional[str]]] = []
+    symbols_processed = 0
+    sources: List[Dict[str, Any]] = []
+    for idx, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({"symbol": None, "error": f"Unexpected item at {idx}: {type(item).__name__}={repr(item)[:200]}"})
+            continue
+        if item.get("partial"):
+            return None
+        sym = item.get("symbol")
+        symbols_processed += 1
+        if item.get("error"):
+            errors.append(_error_entry(sym, str(item.get("error"))))
+        key = item.get("s3_key")
+        if key:
+            sources.append({"symbol": sym, "key": key, "count": item.get("count")})
+        elif _has_inline(item):
+            orders = sorted_run(inline_orders(item))
+            sources.append({"symbol": sym, "count": len(orders), "orders": orders})
+        elif sym and not item.get("error"):
+            errors.append(_error_entry(sym, "No orders data available"))
+
+    stored = [src for src in sources if "key" in src]
+    suffixes = {next((suffix for suffix in CODEC_SUFFIX.values() if src["key"].endswith("." + suffix)), None)
+                for src in stored}
+    if None in suffixes or len(suffixes) > 1:
+        print(f"Compose mode not applicable (result suffixes {sorted(map(str, suffixes))}); falling back to merge")
+        return None
+    codec = next((c for c, suffix in CODEC_SUFFIX.items() if suffix in suffixes), "gzip")
+
+    # Conteos desde los sidecars (objetos chicos), en paralelo; las inline se resumen y comprimen acá
+    with ThreadPoolExecutor(max_workers=max(1, min(PREFETCH_CONCURRENCY, len(stored) or 1))) as pool:
+        stored_sidecars = iter(list(pool.map(lambda src: _read_sidecar(src["key"]), stored)))
+    sidecars = []
+    for src in sources:
+        if "orders" in src:
+            orders = src.pop("orders")
+            src["data"] = encode_chunk(b"".join(
+                json.dumps(o, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n" for o in orders
+            ), codec)
+            sidecar = {**summarize_orders(orders), "bytes": len(src["data"])}
+        else:
+            sidecar = next(stored_sidecars)
+        sidecars.append(sidecar)
+        src["size"] = _as_int(sidecar.get("bytes"))
+        src["count"] = _as_int(sidecar.get("count", src["count"]))
+        sidecar["count"] = src["count"]
+        for field in ("max_ctime", "min_ctime", "markets"):
+            if field in sidecar:
+                src[field] = sidecar[field]
+    sources.sort(key=lambda src: str(src["symbol"] or ""))
+
+    now = datetime.now(timezone.utc)
+    key = _results_key(now, CODEC_SUFFIX[codec])
+    object_args = {"ContentType": "application/x-ndjson; charset=utf-8", "Metadata": {"compose": "per-symbol"}}
+    if codec in CODEC_ENCODING:
+        object_args["ContentEncoding"] = CODEC_ENCODING[codec]
+    print(f"Composing {len(sources)} per-symbol files into s3://{RESULTS_BUCKET}/{key}")
+    with S3Composer(S3, RESULTS_BUCKET, key, part_size=RESULTS_PART_SIZE_MB * 1024 * 1024,
+                    object_args=object_args) as composer:
+        for src in sources:
+            if src["count"] > 0:
+                composer.add(src)
+            elif src["symbol"]:
+                errors.append(_error_entry(src["symbol"], "No orders data available"))
+    stats = composer.close()
+
+    # Manifest: rango de bytes de cada símbolo dentro del objeto final
+    manifest_key = f"{key}.manifest.json"
+    manifest = {
+        "s3_key": key,
+        "codec": codec,
+        "order": "symbol, then cTime DESC within each symbol",
+        "entries": [
+            {k: entry.get(k) for k in ("symbol", "count", "offset", "length", "max_ctime", "min_ctime", "markets")}
+            for entry in stats["entries"]
+        ],
+    }
+    S3.put_object(Bucket=RESULTS_BUCKET, Key=manifest_key, Body=json.dumps(manifest).encode("utf-8"),
+                  ContentType="application/json")
+
+    error_summary, error_details = _summarize_errors(errors)
     aggregator_end_time = datetime.now(timezone.utc)
     aggregator_duration_seconds = (aggregator_end_time - aggregator_start_time).total_seconds()
-
-    # Crear resumen final (sin órdenes para optimización)
-    final_summary = {
-        "total_orders": len(all_orders),
-        "symbols_processed": total_symbols_processed,
-        "symbols_with_data": total_symbols_with_data,
+    summary = {
+        "total_orders": sum(entry["count"] for entry in stats["entries"]),
+        "symbols_processed": symbols_processed,
+        "symbols_with_data": len(stats["entries"]),
+        "aggregation_mode": "compose",
+        "results_format": "ndjson",
+        "compose": {k: stats[k] for k in ("parts", "bytes", "bytes_copied", "bytes_downloaded")},
+        "order_stats": merge_summaries(sidecars),
         "error_count": len(errors),
         "error_summary": error_summary,
         "error_details": error_details,
         "processing_timestamp": aggregator_end_time.isoformat(),
         "aggregator_duration_seconds": round(aggregator_duration_seconds, 3),
-        "timing": {
-            "aggregator_start": aggregator_start_time.isoformat(),
-            "aggregator_end": aggregator_end_time.isoformat(),
-            "aggregator_duration_seconds": round(aggregator_duration_seconds, 3)
+        "s3_uri": f"s3://{RESULTS_BUCKET}/{key}",
+        "public_url": f"https://{RESULTS_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{key}",
+        "manifest_uri": f"s3://{RESULTS_BUCKET}/{manifest_key}",
+    }
+    if COMPOSE_DELETE_SOURCES:
+        summary["cleanup"] = _cleanup([k for src in stored for k in (src["key"], sidecar_key(src["key"]))])
+    else:
+        summary["cleanup"] = {"cleaned": False, "reason": "sources left to the bucket lifecycle rule"}
+    print(f"Compose completed: {summary['total_orders']} orders, {stats['bytes_copied']} bytes copied in S3, "
+          f"{stats['bytes_downloaded']} bytes downloaded")
+    return summary
+
+def _store_rollups(rollups: RollupBuilder, results_key: str) -> Dict[str, Any]:
+    """Guarda los rollups junto al resultado; un fallo acá no invalida el resultado ya escrito."""
+    key = results_key + ROLLUPS_SUFFIX
+    try:
+        doc = rollups.build()
+        body = gzip.compress(json.dumps(doc, separators=(",", ":")).encode("utf-8"))
+        S3.put_object(Bucket=RESULTS_BUCKET, Key=key, Body=body,
+                      ContentType="application/json", ContentEncoding="gzip")
+        return {
+            "rollups_s3_uri": f"s3://{RESULTS_BUCKET}/{key}",
+            "rollups": {name: len(doc[name]["start"]) for name in ("hourly", "daily")},
         }
+    except Exception as e:
+        print(f"WARNING: rollups not stored: {str(e)}")
+        return {"rollups_error": str(e)}
+
+def plan_reduce(items: List[Any], fan_in: int = REDUCE_FAN_IN) -> Dict[str, Any]:
+    """
+    Siguiente nivel del árbol: si caben en un solo reducer, {"done": true, "items": [...]}
+    (los que toma el reducer final); si no, {"done": false, "slices": [[...], ...]} con hasta
+    `fan_in` items por slice. Step Functions escribe el plan en el mismo ResultPath que los
+    items, así que cada item aparece una sola vez en el estado.
+    """
+    items = items if isinstance(items, list) else [items]
+    if len(items) <= fan_in or AGGREGATE_MODE == "compose":  # componer no necesita niveles
+        return {"done": True, "items": items}
+    return {"done": False, "slices": [items[i:i + fan_in] for i in range(0, len(items), fan_in)]}
+
+def reduce_partial(items: List[Any]) -> Dict[str, Any]:
+    """
+    Reducer intermedio: fusiona un slice en una corrida parcial ordenada (NDJSON gzip en
+    PARTIALS_PREFIX) y retorna un item ligero que el siguiente nivel trata como corrida.
+    """
+    if not RESULTS_BUCKET:
+        raise RuntimeError("RESULTS_BUCKET is required for tree reduction")
+    run_set = _collect_runs(items if isinstance(items, list) else [items])
+    merged = KWayMerge(run_set.runs)
+    key = f"{PARTIALS_PREFIX}{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}-L{run_set.level}-{uuid.uuid4().hex[:12]}.ndjson.gz"
+    with S3NdjsonWriter(S3, RESULTS_BUCKET, key, part_size=RESULTS_PART_SIZE_MB * 1024 * 1024,
+                        metadata={RUN_SORT_METADATA: RUN_SORT_CTIME_DESC}) as writer:
+        writer.write_many(merged)
+    symbols_with_data = run_set.close()
+    cleanup = _cleanup(run_set.consumed_keys())
+    print(f"Partial reduce L{run_set.level}: {writer.count} orders from {len(run_set.runs)} runs -> {key}")
+    return {
+        "partial": True,
+        "level": run_set.level,
+        "s3_key": key,
+        "count": writer.count,
+        "duplicates_dropped": merged.duplicates,
+        "order_stats": run_set.order_stats(),
+        "symbols_processed": run_set.symbols_processed,
+        "symbols_with_data": symbols_with_data,
+        # Mensajes truncados: los errores suben por el árbol dentro del payload de Step Functions
+        "errors": [{**e, "error": (e.get("error") or "")[:200]} for e in run_set.errors],
+        "cleanup": {k: cleanup.get(k) for k in ("cleaned", "deleted_count", "reason") if k in cleanup},
     }
 
+def tree_reduce(items: List[Any], fan_in: int = REDUCE_FAN_IN, max_parallel: int = 8) -> Dict[str, Any]:
+    """
+    Ejecuta localmente el mismo árbol que orquesta Step Functions (plan -> reducers en
+    paralelo -> plan ...) y termina con el reducer final. Útil para tests y scripts.
+    """
+    plan = plan_reduce(items, fan_in)
+    while not plan["done"]:
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as pool:
+            items = list(pool.map(reduce_partial, plan["slices"]))
+        plan = plan_reduce(items, fan_in)
+    return handler(plan["items"], None)
+
+def handler(event, context):
+    """
+    event: lista con la salida de cada worker (ligero o legacy).
+      Ligero (recomendado):
+        { "symbol":"BTCUSDT", "count":123, "s3_key":"per-symbol/BTCUSDT/....ndjson.gz", "s3_uri":"s3://...", "error":null }
+      Inline (símbolos chicos, ver INLINE_RESULTS_MAX_BYTES del worker):
+        { "symbol":"ADAUSDT", "count":3, "orders_gz":"<NDJSON gzip en base64>", "data_location":"inline", "error":null }
+      Legacy (no recomendado por límite 256KB):
+        { "symbol":"BTCUSDT", "orders":[{...}, ...], "count": 50, "error":null }
+      Parcial (de un reducer intermedio):
+        { "partial": true, "level": 0, "s3_key":"partials/....ndjson.gz", "count": 5000, "symbols_processed": 50, ... }
+
+    Modos de reducción en árbol (event como dict con "mode"):
+      { "mode": "plan", "items": [...] }      -> plan_reduce: ¿hace falta otro nivel?
+      { "mode": "partial", "items": [...] }   -> reduce_partial: fusiona un slice en una corrida parcial
+
+    Con AGGREGATE_MODE=compose el resultado se arma en S3 con UploadPartCopy (compose_results).
+
+    Este reducer:
+      - Abre cada archivo per-symbol (corrida ordenada por cTime DESC); si no hay s3_key, usa 'orders' inline.
+      - Fusiona las corridas con un heap (k-way merge), deduplicando por (market, orderId).
+      - Escribe el resultado en streaming a S3 (multipart): la memoria no crece con el total de órdenes.
+      - Devuelve un resumen con el puntero al archivo.
+    """
+    if isinstance(event, dict) and event.get("mode") == "plan":
+        return plan_reduce(event.get("items") or [], _as_int(event.get("fan_in"), REDUCE_FAN_IN))
+    if isinstance(event, dict) and event.get("mode") == "partial":
+        return reduce_partial(event.get("items") or [])
+
+    # Capturar tiempo de inicio del agregador
+    aggregator_start_time = datetime.now(timezone.utc)
+    print(f"Aggregator started at: {aggregator_start_time.isoformat()}")
+
+    items: List[Any] = event if isinstance(event, list) else [event]
+    if AGGREGATE_MODE == "compose" and RESULTS_BUCKET:
+        composed = compose_results(items)
+        if composed is not None:
+            return composed
+
+    # Modo multi-proceso: solo para salidas NDJSON / JSON, que se escriben línea a línea
+    pool: Optional[ProcessPool] = None
+    if AGGREGATE_PROCESSES > 1 and RESULTS_BUCKET and RESULTS_FORMAT in ("json", "ndjson") and RESULTS_LAYOUT == "single":
+        pool = ProcessPool(AGGREGATE_PROCESSES, _process_task, initializer=_init_process)
+    try:
+        run_set = _collect_runs(items, pool)
+    except Exception:
+        if pool is not None:
+            pool.close()
+        raise
+    errors = run_set.errors
+
+    # Orden cronológico DESC (más reciente primero) por fusión de corridas ya ordenadas
+    print(f"Merging {len(run_set.runs)} sorted runs by cTime...")
+    # Los rollups se arman en la misma pasada en que se escriben las órdenes
+    rollups = RollupBuilder() if RESULTS_ROLLUPS and RESULTS_BUCKET else None
+    if pool is not None:
+        # Los rollups se cargan por columnas al terminar (ver _RunSet.packed)
+        merged = KWayMerge(run_set.runs, ctime=itemgetter(0), identity=_packed_identity,
+                           on_duplicate=_packed_duplicate)
+        stream = merged
+    else:
+        merged = KWayMerge(run_set.runs)
+        stream = rollups.feed(merged) if rollups else merged
+    carried_duplicates = sum(_as_int(item.get("duplicates_dropped")) for item in items
+                             if isinstance(item, dict) and item.get("partial"))
+
+    def finalize(total_orders: int) -> Dict[str, Any]:
+        """Resumen final (sin órdenes); se arma cuando la fusión terminó."""
+        total_symbols_with_data = run_set.close()
+        error_summary, error_details = _summarize_errors(errors)
+
+        # Timing del agregador
+        aggregator_end_time = datetime.now(timezone.utc)
+        aggregator_duration_seconds = (aggregator_end_time - aggregator_start_time).total_seconds()
+        return {
+            "total_orders": total_orders,
+            "duplicates_dropped": merged.duplicates + carried_duplicates,
+            "symbols_processed": run_set.symbols_processed,
+            "symbols_with_data": total_symbols_with_data,
+            "reduce_levels": run_set.level + 1,
+            # Desde los sidecars de los workers: conteos por mercado/lado, nocional y fees
+            "order_stats": run_set.order_stats(),
+            "error_count": len(errors),
+            "error_summary": error_summary,
+            "error_details": error_details,
+            "processing_timestamp": aggregator_end_time.isoformat(),
+            "aggregator_duration_seconds": round(aggregator_duration_seconds, 3),
+            "timing": {
+                "aggregator_start": aggregator_start_time.isoformat(),
+                "aggregator_end": aggregator_end_time.isoformat(),
+                "aggregator_duration_seconds": round(aggregator_duration_seconds, 3)
+            }
+        }
+
     # Guardar el resultado completo en S3 (si está configurado)
+    final_summary: Optional[Dict[str, Any]] = None
     if RESULTS_BUCKET:
         now = datetime.now(timezone.utc)
-        key = _results_key(now)
+        columnar_format = None
+        partitioned: Optional[PartitionedWriter] = None
+        codec = "none"
+        if RESULTS_LAYOUT == "partitioned":
+            partitioned = PartitionedWriter(S3, RESULTS_BUCKET, _results_key(now, None), codec=RESULTS_CODEC,
+                                            part_size=RESULTS_PART_SIZE_MB * 1024 * 1024,
+                                            metadata={RUN_SORT_METADATA: RUN_SORT_CTIME_DESC})
+            key = partitioned.manifest_key
+        elif RESULTS_FORMAT == "ndjson":
+            codec = resolve_codec(RESULTS_CODEC)
+            key = _results_key(now, CODEC_SUFFIX[codec])
+        elif RESULTS_FORMAT != "json":
+            columnar_format = resolve_format("auto" if RESULTS_FORMAT == "columnar" else RESULTS_FORMAT)
+            key = _results_key(now, FORMAT_SUFFIX[columnar_format])
+        else:
+            key = _results_key(now)
         try:
-            # payload completo para S3
-            full_payload = {
-                **final_summary,
-                "orders": all_orders
-            }
             print(f"Storing complete results in S3: s3://{RESULTS_BUCKET}/{key}")
-            S3.put_object(
-                Bucket=RESULTS_BUCKET,
-                Key=key,
-                Body=json.dumps(full_payload, ensure_ascii=False, indent=2).encode("utf-8"),
-                ContentType="application/json; charset=utf-8",
-            )
+            if partitioned is not None:
+                with partitioned as writer:
+                    writer.write_many(stream)
+                final_summary = finalize(writer.count)
+                final_summary.update(results_format="ndjson", results_layout="partitioned",
+                                     partitions=len(writer.partitions))
+                # El manifest es el punto de entrada: particiones más el resumen de la ejecución
+                S3.put_object(Bucket=RESULTS_BUCKET, Key=key, ContentType="application/json",
+                              Body=json.dumps(writer.manifest(summary=final_summary), ensure_ascii=False).encode("utf-8"))
+            elif columnar_format:
+                # El formato columnar se codifica completo: aquí la memoria sí es proporcional al total
+                all_orders = list(stream)
+                final_summary = finalize(len(all_orders))
+                # Solo las órdenes; el resumen viaja en la respuesta y en la metadata del objeto
+                put_orders(S3, RESULTS_BUCKET, key, all_orders, metadata={
+                    "total_orders": str(len(all_orders)),
+                    "symbols_with_data": str(final_summary["symbols_with_data"]),
+                    "error_count": str(final_summary["error_count"]),
+                })
+                final_summary["results_format"] = columnar_format
+            elif RESULTS_FORMAT == "ndjson":
+                with S3NdjsonWriter(S3, RESULTS_BUCKET, key, codec=codec,
+                                    part_size=RESULTS_PART_SIZE_MB * 1024 * 1024,
+                                    metadata={RUN_SORT_METADATA: RUN_SORT_CTIME_DESC}) as writer:
+                    if pool is not None:
+                        # Líneas ya serializadas por los hijos; la compresión también va en paralelo, por bloques
+                        chunks = _packed_chunks(stream)
+                        if codec == "none":
+                            encoded = ((data, count, len(data)) for data, count in chunks)
+                        else:
+                            encoded = pool.imap(("encode", (data, codec, count)) for data, count in chunks)
+                        for data, count, raw_bytes in encoded:
+                            writer.write_encoded(data, count, raw_bytes)
+                    else:
+                        writer.write_many(stream)
+                final_summary = finalize(writer.count)
+                final_summary["results_format"] = "ndjson"
+            else:
+                # Documento JSON {"orders": [...], <resumen>} escrito en streaming: las órdenes
+                # van primero y el resumen al final, cuando ya se conocen los totales
+                with S3NdjsonWriter(S3, RESULTS_BUCKET, key, codec="none",
+                                    part_size=RESULTS_PART_SIZE_MB * 1024 * 1024,
+                                    content_type="application/json; charset=utf-8") as writer:
+                    if pool is not None:
+                        lines = (run.line(i) for _, _, run, i in stream)
+                    else:
+                        lines = (json.dumps(order, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                                 for order in stream)
+                    total_orders = 0
+                    writer.write_raw(b'{"orders":[')
+                    for line in lines:
+                        prefix = b"," if total_orders else b""
+                        writer.write_raw(prefix + line)
+                        total_orders += 1
+                    final_summary = finalize(total_orders)
+                    trailer = json.dumps(final_summary, ensure_ascii=False, separators=(",", ":"))
+                    writer.write_raw(b"]," + trailer[1:].encode("utf-8"))
             # En la respuesta: punteros al archivo
             final_summary["s3_uri"] = f"s3://{RESULTS_BUCKET}/{key}"
             final_summary["public_url"] = f"https://{RESULTS_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{key}"
-            print("Results stored successfully in S3")
+            print(f"Results stored successfully in S3 ({final_summary['duplicates_dropped']} duplicates dropped)")
+            if rollups is not None:
+                for packed in run_set.packed:
+                    packed.feed_rollups(rollups)
+                final_summary.update(_store_rollups(rollups, key))
 
-            if per_symbol_keys_to_delete:
-                print(f"Starting cleanup of {len(per_symbol_keys_to_delete)} per-symbol files...")
-                cleanup_result = _delete_per_symbol_files(per_symbol_keys_to_delete)
-                final_summary["cleanup"] = cleanup_result
-
-                if cleanup_result.get("cleaned"):
-                    print(f"Cleanup successful: {cleanup_result.get('deleted_count', 0)} files deleted")
-                else:
-                    print(f"Cleanup failed or skipped: {cleanup_result.get('reason', 'unknown')}")
-            else:
-                final_summary["cleanup"] = {"cleaned": False, "reason": "no per-symbol files to clean"}
+            final_summary["cleanup"] = _cleanup(run_set.consumed_keys())
         except Exception as e:
-            error_msg = f"S3 put_object failed: {str(e)}"
+            error_msg = f"S3 upload failed: {str(e)}"
+            if final_summary is None:
+                final_summary = finalize(0)
             errors.append({"symbol": None, "error": error_msg})
+            final_summary["error_count"] = len(errors)
+            final_summary["s3_error"] = error_msg
             print(f"ERROR: {error_msg}")
     else:
         warning_msg = "RESULTS_BUCKET env var is not set; skipping S3 upload"
+        total_orders = sum(1 for _ in merged)
         errors.append({"symbol": None, "error": warning_msg})
         print(f"WARNING: {warning_msg}")
+        final_summary = finalize(total_orders)
         final_summary["cleanup"] = {"cleaned": False, "reason": "S3 not configured"}
 
-    print(f"Aggregator completed: {len(all_orders)} orders from {total_symbols_with_data}/{total_symbols_processed} symbols")
+    if pool is not None:
+        pool.close()
+        final_summary["processes"] = pool.processes
+    print(f"Aggregator completed: {final_summary['total_orders']} orders from "
+          f"{final_summary['symbols_with_data']}/{run_set.symbols_processed} symbols")
     return final_summary
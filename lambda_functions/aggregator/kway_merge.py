@@ -0,0 +1,73 @@
+"""
+Fusión k-way de corridas per-symbol ordenadas por cTime DESC.
+
+Cada worker deja su archivo ya ordenado, así que el aggregator no necesita
+juntar todo en una lista y ordenarlo: un heap con la cabeza de cada corrida
+produce el orden global leyendo una orden a la vez por corrida. La memoria queda
+en O(k) órdenes más lo que el escritor tenga en su parte actual.
+
+Duplicados: una misma orden (market, orderId) repetida tiene el mismo cTime, así
+que tras la fusión aparece dentro del mismo grupo de cTime. Basta con recordar
+las claves del grupo actual, no las de toda la ejecución.
+"""
+
+import heapq
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+from result_writer import order_ctime
+
+
+def dedupe_key(order: Dict[str, Any]) -> Tuple[Any, Any]:
+    return order.get("_market"), order.get("orderId")
+
+
+def _order_identity(order: Dict[str, Any]) -> Optional[Tuple[Any, Any]]:
+    key = dedupe_key(order)
+    return key if key[1] is not None else None
+
+
+class KWayMerge:
+    """
+    Uso:
+        merged = KWayMerge(runs)
+        for order in merged: ...
+        merged.duplicates -> órdenes descartadas por (market, orderId) repetido
+
+    Las corridas deben venir ordenadas por cTime DESC; las que no cumplen se
+    ordenan en memoria antes de pasarlas (ver `sorted_run`).
+
+    `ctime` e `identity` permiten fusionar otras entradas que no sean dicts (las
+    corridas empaquetadas del modo multi-proceso); `identity` retorna None para
+    las entradas que no se deduplican. `on_duplicate` recibe cada entrada descartada.
+    """
+    def __init__(self, runs: Iterable[Iterable[Any]], ctime: Callable[[Any], int] = order_ctime,
+                 identity: Callable[[Any], Optional[Hashable]] = _order_identity,
+                 on_duplicate: Optional[Callable[[Any], None]] = None):
+        self.runs = list(runs)
+        self.ctime = ctime
+        self.identity = identity
+        self.on_duplicate = on_duplicate
+        self.duplicates = 0
+
+    def __iter__(self) -> Iterator[Any]:
+        current_ctime = None
+        seen_in_group = set()
+        for order in heapq.merge(*self.runs, key=self.ctime, reverse=True):
+            ctime = self.ctime(order)
+            if ctime != current_ctime:
+                current_ctime = ctime
+                seen_in_group.clear()
+            key = self.identity(order)
+            if key is not None:
+                if key in seen_in_group:
+                    self.duplicates += 1
+                    if self.on_duplicate is not None:
+                        self.on_duplicate(order)
+                    continue
+                seen_in_group.add(key)
+            yield order
+
+
+def sorted_run(orders: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Corrida legada (JSON inline o archivos sin `sort-order`): se ordena en memoria."""
+    return sorted(orders, key=order_ctime, reverse=True)
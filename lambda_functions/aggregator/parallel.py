@@ -0,0 +1,238 @@
+"""
+Modo multi-proceso del aggregator: decodificación de corridas y compresión de la
+salida en procesos hijos, para usar todos los vCPU que Lambda asigna con más memoria.
+
+Lambda no tiene /dev/shm, así que `multiprocessing.Pool` y `ProcessPoolExecutor`
+no funcionan (necesitan semáforos POSIX). `ProcessPool` usa solo `Process` +
+`Pipe`, que sí funcionan, con un hijo por proceso y una tarea en vuelo por hijo.
+
+Lo que vuelve de los hijos no son dicts: `PackedRun` lleva las líneas NDJSON ya
+serializadas en un solo buffer y columnas tipadas (cTime, clave de deduplicación,
+campos de rollups). El padre fusiona por cTime y escribe las líneas tal cual, sin
+volver a parsear ni serializar ninguna orden; los rollups se cargan por columnas
+al final. A cambio, todas las corridas quedan en memoria del padre (ocupan lo
+mismo que el NDJSON sin comprimir) en lugar de leerse en streaming.
+"""
+
+import hashlib
+import json
+import multiprocessing
+from array import array
+from multiprocessing.connection import wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from order_stats import RollupBuilder, add_order, empty_summary, rollup_fields
+from result_writer import order_ctime
+
+
+def _worker_loop(conn, fn: Callable[[Any], Any], initializer: Optional[Callable[[], None]]):
+    if initializer is not None:
+        initializer()
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        seq, task = message
+        try:
+            conn.send((seq, fn(task), None))
+        except Exception as e:
+            conn.send((seq, None, f"{type(e).__name__}: {str(e)}"))
+    conn.close()
+
+
+class ProcessPool:
+    """
+    Uso:
+        with ProcessPool(4, fn, initializer=...) as pool:
+            for task, result, error in pool.imap_unordered(tasks): ...
+            for result in pool.imap(tasks): ...        # en orden; una falla levanta RuntimeError
+
+    `fn` e `initializer` pasan a los hijos por fork (no se serializan); las tareas y
+    los resultados sí viajan serializados por el pipe.
+    """
+    def __init__(self, processes: int, fn: Callable[[Any], Any], initializer: Optional[Callable[[], None]] = None):
+        ctx = multiprocessing.get_context("fork")
+        self._workers = []
+        for _ in range(max(1, processes)):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_worker_loop, args=(child_conn, fn, initializer), daemon=True)
+            process.start()
+            child_conn.close()
+            self._workers.append((process, parent_conn))
+        self.processes = len(self._workers)
+
+    def _run(self, tasks: Iterable[Any]) -> Iterator[Tuple[int, Any, Any, Optional[str]]]:
+        """Reparte las tareas entre los hijos libres; entrega (seq, tarea, resultado, error) según terminan."""
+        pending = iter(enumerate(tasks))
+        in_flight: Dict[Any, Tuple[int, Any]] = {}
+
+        def submit(conn) -> bool:
+            for seq, task in pending:
+                conn.send((seq, task))
+                in_flight[conn] = (seq, task)
+                return True
+            return False
+
+        for _, conn in self._workers:
+            if not submit(conn):
+                break
+        while in_flight:
+            for conn in wait(list(in_flight)):
+                seq, result, error = conn.recv()
+                _, task = in_flight.pop(conn)
+                yield seq, task, result, error
+                submit(conn)
+
+    def imap_unordered(self, tasks: Iterable[Any]) -> Iterator[Tuple[Any, Any, Optional[str]]]:
+        for _, task, result, error in self._run(tasks):
+            yield task, result, error
+
+    def imap(self, tasks: Iterable[Any]) -> Iterator[Any]:
+        """Resultados en el orden de las tareas; se guardan a lo sumo los que llegaron adelantados."""
+        ready: Dict[int, Any] = {}
+        next_seq = 0
+        for seq, _, result, error in self._run(tasks):
+            if error is not None:
+                raise RuntimeError(error)
+            ready[seq] = result
+            while next_seq in ready:
+                yield ready.pop(next_seq)
+                next_seq += 1
+
+    def close(self):
+        for process, conn in self._workers:
+            try:
+                conn.send(None)
+                conn.close()
+            except (OSError, ValueError):
+                pass
+        for process, _ in self._workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def identity_hash(order: Dict[str, Any]) -> int:
+    """Clave (market, orderId) como entero estable entre procesos; 0 = sin orderId (no se deduplica)."""
+    order_id = order.get("orderId")
+    if order_id is None:
+        return 0
+    digest = hashlib.blake2b(f"{order.get('_market')}\x00{order_id}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True) or 1
+
+
+class PackedRun:
+    """
+    Corrida empaquetada: `lines` (NDJSON, una orden por línea) con sus `offsets`, más
+    columnas paralelas con cTime, clave de deduplicación y los campos de rollups.
+    `errors` trae los mensajes de las entradas inválidas; `summary`, el resumen de la
+    corrida si se pidió (corridas sin sidecar).
+    """
+    def __init__(self):
+        self.lines = bytearray()
+        self.offsets = array("q", [0])
+        self.ctimes = array("q")
+        self.keys = array("q")
+        self.symbols: List[str] = []
+        self.symbol_codes = array("q")
+        self.base = array("d")
+        self.quote = array("d")
+        self.buy = array("b")
+        self.fee_rows = array("q")
+        self.coins: List[str] = []
+        self.fee_coins = array("q")
+        self.fee_values = array("d")
+        self.errors: List[str] = []
+        self.summary: Optional[Dict[str, Any]] = None
+        self.dropped: Set[int] = set()  # índices descartados como duplicados en la fusión (en el padre)
+
+    @property
+    def count(self) -> int:
+        return len(self.ctimes)
+
+    def line(self, i: int) -> bytes:
+        """Línea i sin el salto final."""
+        return bytes(self.lines[self.offsets[i]:self.offsets[i + 1] - 1])
+
+    def entries(self) -> Iterator[Tuple[int, int, "PackedRun", int]]:
+        """
+        Entradas (cTime, clave, corrida, índice) para la fusión; ya vienen en orden cTime DESC.
+        Al agotarse la corrida se liberan las líneas (las columnas quedan para los rollups).
+        """
+        for i in range(self.count):
+            yield self.ctimes[i], self.keys[i], self, i
+        self.lines = bytearray()
+        self.offsets = array("q", [0])
+
+    def feed_rollups(self, builder: RollupBuilder):
+        """Carga las filas en los rollups por columnas, sin los duplicados ni las órdenes sin cTime."""
+        rows = [i for i in range(self.count) if i not in self.dropped and self.symbol_codes[i] >= 0]
+        if len(rows) == self.count:
+            builder.extend(self.ctimes, self.symbols, self.symbol_codes, self.base, self.quote, self.buy,
+                           self.fee_rows, self.coins, self.fee_coins, self.fee_values)
+            return
+        position = {i: n for n, i in enumerate(rows)}
+        fees = [(position[r], c, v) for r, c, v in zip(self.fee_rows, self.fee_coins, self.fee_values) if r in position]
+        builder.extend(
+            [self.ctimes[i] for i in rows], self.symbols, [self.symbol_codes[i] for i in rows],
+            [self.base[i] for i in rows], [self.quote[i] for i in rows], [self.buy[i] for i in rows],
+            [f[0] for f in fees], self.coins, [f[1] for f in fees], [f[2] for f in fees],
+        )
+
+
+def _code(values: List[str], codes: Dict[str, int], value: str) -> int:
+    code = codes.get(value)
+    if code is None:
+        code = codes[value] = len(values)
+        values.append(value)
+    return code
+
+
+def pack_run(orders: Iterable[Any], sym: Optional[str], summarize: bool = False) -> PackedRun:
+    """
+    Serializa una corrida ya ordenada (cTime DESC). Hace lo mismo que el camino en
+    proceso: etiqueta `_symbol`, descarta entradas que no son dicts y, si `summarize`,
+    arma el resumen de la corrida.
+    """
+    packed = PackedRun()
+    symbol_codes: Dict[str, int] = {}
+    coin_codes: Dict[str, int] = {}
+    summary = empty_summary() if summarize else None
+    for jdx, o in enumerate(orders):
+        if not isinstance(o, dict):
+            packed.errors.append(f"Invalid order data at index {jdx}: {type(o).__name__}")
+            continue
+        o.setdefault("_symbol", sym)
+        if summary is not None:
+            add_order(summary, o)
+        packed.lines += json.dumps(o, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        packed.offsets.append(len(packed.lines))
+        packed.ctimes.append(order_ctime(o))
+        packed.keys.append(identity_hash(o))
+
+        fields = rollup_fields(o)
+        if fields is None:
+            packed.symbol_codes.append(-1)
+            packed.base.append(0.0)
+            packed.quote.append(0.0)
+            packed.buy.append(0)
+        else:
+            _, symbol, base, quote, buy, fees = fields
+            packed.symbol_codes.append(_code(packed.symbols, symbol_codes, symbol))
+            packed.base.append(base)
+            packed.quote.append(quote)
+            packed.buy.append(1 if buy else 0)
+            for coin, value in fees.items():
+                packed.fee_rows.append(packed.count - 1)
+                packed.fee_coins.append(_code(packed.coins, coin_codes, coin))
+                packed.fee_values.append(value)
+    packed.summary = summary
+    return packed
@@ -0,0 +1,148 @@
+"""
+Composición del resultado final en S3 sin descargar los archivos per-symbol.
+
+Los archivos NDJSON comprimidos se pueden concatenar tal cual: varios miembros
+gzip (o frames zstd) seguidos forman un stream válido y cada línea sigue siendo
+una orden. El objeto final se arma con un multipart upload en el que las fuentes
+de al menos 5 MB entran por `UploadPartCopy` (copia del lado de S3). Las más
+chicas no pueden ser una parte por sí solas, así que se descargan y se agrupan
+en una parte propia hasta llegar al mínimo.
+
+Cada fuente queda en un rango de bytes conocido del objeto final. Como cada
+miembro se puede descomprimir por separado, el manifest permite leer un solo
+símbolo con un GET por rango.
+"""
+
+from typing import Any, Dict, List, Optional
+
+from result_writer import MIN_PART_SIZE
+
+MAX_COPY_PART_SIZE = 5 * 1024 ** 3  # máximo de S3 por parte copiada
+
+
+class S3Composer:
+    """
+    Uso:
+        composer = S3Composer(s3, bucket, dest_key, object_args={...})
+        for source in sources:            # {"key", "size", ...} o {"data", ...} (bytes ya comprimidos)
+            composer.add(source)
+        stats = composer.close()          # {"parts", "bytes_copied", "bytes_downloaded", "entries": [...]}
+
+    `entries` trae, por fuente y en orden, su offset y largo dentro del objeto final.
+    """
+    def __init__(self, s3, bucket: str, dest_key: str, part_size: int = 8 * 1024 * 1024,
+                 object_args: Optional[Dict[str, Any]] = None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.dest_key = dest_key
+        self.part_size = max(MIN_PART_SIZE, int(part_size))
+        self.object_args = object_args or {}
+
+        self._upload_id: Optional[str] = None
+        self._parts: List[Dict[str, Any]] = []
+        self._buffer = bytearray()
+        self._closed = False
+
+        self.offset = 0
+        self.bytes_copied = 0
+        self.bytes_downloaded = 0
+        self.entries: List[Dict[str, Any]] = []
+
+    def _ensure_upload(self):
+        if self._upload_id is None:
+            res = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.dest_key, **self.object_args)
+            self._upload_id = res["UploadId"]
+
+    def _flush_buffer(self):
+        if not self._buffer:
+            return
+        self._ensure_upload()
+        number = len(self._parts) + 1
+        res = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.dest_key, UploadId=self._upload_id, PartNumber=number, Body=bytes(self._buffer)
+        )
+        self._parts.append({"ETag": res["ETag"], "PartNumber": number})
+        self._buffer.clear()
+
+    def _copy(self, key: str, size: int):
+        self._ensure_upload()
+        for start in range(0, size, MAX_COPY_PART_SIZE):
+            end = min(start + MAX_COPY_PART_SIZE, size) - 1
+            number = len(self._parts) + 1
+            res = self.s3.upload_part_copy(
+                Bucket=self.bucket, Key=self.dest_key, UploadId=self._upload_id, PartNumber=number,
+                CopySource={"Bucket": self.bucket, "Key": key}, CopySourceRange=f"bytes={start}-{end}",
+            )
+            self._parts.append({"ETag": res["CopyPartResult"]["ETag"], "PartNumber": number})
+        self.bytes_copied += size
+
+    def add(self, source: Dict[str, Any]):
+        source = dict(source)
+        data = source.pop("data", None)
+        if data is not None:
+            self._append(source, data)
+            return
+        key, size = source["key"], int(source["size"])
+        if size <= 0:
+            return
+        # Se copia del lado de S3 si puede ser una parte propia: la parte en buffer
+        # que la precede también tiene que llegar al mínimo
+        if size >= MIN_PART_SIZE and (not self._buffer or len(self._buffer) >= MIN_PART_SIZE):
+            self._flush_buffer()
+            self._copy(key, size)
+        else:
+            data = self.s3.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+            self.bytes_downloaded += len(data)
+            self._append(source, data)
+            return
+        self.entries.append({**source, "offset": self.offset, "length": size})
+        self.offset += size
+
+    def _append(self, source: Dict[str, Any], data: bytes):
+        """Agrega bytes a la parte en buffer; se sube al llegar a `part_size`."""
+        if not data:
+            return
+        self._buffer += data
+        if len(self._buffer) >= self.part_size:
+            self._flush_buffer()
+        self.entries.append({**source, "offset": self.offset, "length": len(data)})
+        self.offset += len(data)
+
+    def close(self) -> Dict[str, Any]:
+        if not self._closed:
+            if self._upload_id is None:
+                # Todo cupo en el buffer: un put_object alcanza
+                self.s3.put_object(Bucket=self.bucket, Key=self.dest_key, Body=bytes(self._buffer), **self.object_args)
+                self._buffer.clear()
+            else:
+                self._flush_buffer()
+                self.s3.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.dest_key, UploadId=self._upload_id,
+                    MultipartUpload={"Parts": self._parts},
+                )
+            self._closed = True
+        return {
+            "parts": max(1, len(self._parts)),
+            "bytes": self.offset,
+            "bytes_copied": self.bytes_copied,
+            "bytes_downloaded": self.bytes_downloaded,
+            "entries": self.entries,
+        }
+
+    def abort(self):
+        if self._upload_id is not None and not self._closed:
+            try:
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.dest_key, UploadId=self._upload_id)
+            except Exception as e:
+                print(f"Failed to abort multipart upload for {self.dest_key}: {str(e)}")
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
@@ -0,0 +1,276 @@
+"""
+Formato columnar compacto para los resultados de órdenes.
+
+Las órdenes de Bitget son dicts con las mismas claves repetidas en cada fila y
+todos los números como string. Aquí se guardan por columnas:
+
+- `symbol`, `side`, `status` y `_market` con codificación de diccionario.
+- `cTime` y `uTime` como int64 (al leer filas se restituye el tipo original).
+- El resto tal cual.
+
+Backends:
+- "parquet": si `pyarrow` está instalado (dictionary/int64 nativos, zstd).
+- "bcol": alternativa en Python puro. Es un gzip de líneas JSON: una cabecera y
+  luego un grupo de filas por línea, cada uno con sus columnas. Se puede leer
+  grupo a grupo, sin cargar el archivo completo.
+
+Los campos nulos o ausentes se omiten al reconstruir las filas, en ambos backends.
+
+Módulo compartido por worker, aggregator y DatabaseService: no depende de nada
+fuera de la librería estándar salvo `pyarrow`, que es opcional.
+"""
+
+import gzip
+import io
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # dependencia opcional
+    pyarrow = None
+    pq = None
+
+DICT_COLUMNS = ("symbol", "side", "status", "_market")
+INT64_COLUMNS = ("cTime", "uTime")
+
+FORMAT_SUFFIX = {"parquet": "parquet", "bcol": "bcol.gz"}
+FORMAT_CONTENT_TYPE = {"parquet": "application/vnd.apache.parquet", "bcol": "application/x-bitget-columnar"}
+BCOL_MAGIC = "bitget-columnar"
+BCOL_VERSION = 1
+ROW_GROUP_SIZE = 50_000
+
+
+def resolve_format(fmt: Optional[str] = "auto") -> str:
+    """"auto" elige parquet si hay pyarrow; "parquet" sin pyarrow cae a "bcol"."""
+    fmt = (fmt or "auto").lower()
+    if fmt not in ("auto", *FORMAT_SUFFIX):
+        raise ValueError(f"Unknown columnar format: {fmt}")
+    if fmt in ("auto", "parquet") and pyarrow is None:
+        if fmt == "parquet":
+            print("pyarrow not installed, falling back to bcol")
+        return "bcol"
+    return "parquet" if fmt == "auto" else fmt
+
+
+def format_for_key(key: str) -> Optional[str]:
+    for fmt, suffix in FORMAT_SUFFIX.items():
+        if key.endswith("." + suffix):
+            return fmt
+    return None
+
+
+def is_columnar_key(key: str) -> bool:
+    return format_for_key(key or "") is not None
+
+
+# --- Codificación por columnas ---------------------------------------------------
+
+def _column_names(orders: Sequence[Dict[str, Any]]) -> List[str]:
+    names: Dict[str, None] = {}
+    for order in orders:
+        for name in order:
+            names.setdefault(name, None)
+    return list(names)
+
+
+def _int64_column(values: List[Any]) -> Optional[Dict[str, Any]]:
+    """
+    Enteros si todos los valores presentes lo son (como int o string decimal);
+    None si hay algún valor que no lo sea, para guardar la columna sin convertir.
+    """
+    present = [v for v in values if v is not None]
+    if not present or any(isinstance(v, bool) for v in present):
+        return None
+    if all(isinstance(v, int) for v in present):
+        as_str = False
+    elif all(isinstance(v, str) for v in present):
+        as_str = True
+        if any(not v.lstrip("-").isdigit() or str(int(v)) != v for v in present):
+            return None  # "0012" o "" no sobreviven a int(); mejor no tocarlos
+    else:
+        return None
+    return {"values": [None if v is None else int(v) for v in values], "as_str": as_str}
+
+
+def _encode_group(orders: Sequence[Dict[str, Any]], names: List[str]) -> Dict[str, Any]:
+    columns: Dict[str, Any] = {}
+    for name in names:
+        values = [order.get(name) for order in orders]
+        if name in INT64_COLUMNS:
+            ints = _int64_column(values)
+            if ints is not None:
+                columns[name] = {"enc": "int64", **ints}
+                continue
+        if name in DICT_COLUMNS:
+            dictionary: Dict[Any, int] = {}
+            codes = []
+            for v in values:
+                if v is None:
+                    codes.append(None)
+                    continue
+                hashable = json.dumps(v, sort_keys=True) if isinstance(v, (dict, list)) else v
+                if hashable not in dictionary:
+                    dictionary[hashable] = len(dictionary)
+                codes.append(dictionary[hashable])
+            columns[name] = {"enc": "dict", "dictionary": list(dictionary), "codes": codes}
+            continue
+        columns[name] = {"enc": "plain", "values": values}
+    return {"rows": len(orders), "columns": columns}
+
+
+def _column_values(column: Dict[str, Any], typed: bool = True) -> List[Any]:
+    """Valores de una columna; con typed=False las int64 recuperan su tipo original."""
+    enc = column["enc"]
+    if enc == "dict":
+        dictionary = column["dictionary"]
+        return [None if c is None else dictionary[c] for c in column["codes"]]
+    if enc == "int64" and column.get("as_str") and not typed:
+        return [None if v is None else str(v) for v in column["values"]]
+    return column["values"]
+
+
+def _group_rows(group: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    names = list(group["columns"])
+    columns = [_column_values(group["columns"][n], typed=False) for n in names]
+    for i in range(group["rows"]):
+        yield {name: values[i] for name, values in zip(names, columns) if values[i] is not None}
+
+
+# --- bcol (Python puro) ------------------------------------------------------------
+
+def _encode_bcol(orders: Sequence[Dict[str, Any]]) -> bytes:
+    names = _column_names(orders)
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6, mtime=0) as gz:
+        header = {"format": BCOL_MAGIC, "version": BCOL_VERSION, "rows": len(orders), "columns": names}
+        gz.write(json.dumps(header, separators=(",", ":")).encode("utf-8") + b"\n")
+        for start in range(0, len(orders), ROW_GROUP_SIZE):
+            group = _encode_group(orders[start:start + ROW_GROUP_SIZE], names)
+            gz.write(json.dumps(group, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+    return out.getvalue()
+
+
+def _iter_bcol_groups(fileobj) -> Iterator[Dict[str, Any]]:
+    stream = gzip.GzipFile(fileobj=fileobj)
+    header = json.loads(stream.readline() or b"{}")
+    if header.get("format") != BCOL_MAGIC:
+        raise ValueError("Not a bitget-columnar file")
+    if header.get("version", 0) > BCOL_VERSION:
+        raise ValueError(f"Unsupported bitget-columnar version {header.get('version')}")
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+# --- Parquet (pyarrow) -------------------------------------------------------------
+
+def _encode_parquet(orders: Sequence[Dict[str, Any]]) -> bytes:
+    names = _column_names(orders)
+    group = _encode_group(orders, names)
+    arrays, fields_meta = [], {"int64_as_str": [], "json": []}
+    for name in names:
+        column = group["columns"][name]
+        if column["enc"] == "int64":
+            arrays.append(pyarrow.array(column["values"], type=pyarrow.int64()))
+            if column["as_str"]:
+                fields_meta["int64_as_str"].append(name)
+            continue
+        values = _column_values(column)
+        if any(v is not None and not isinstance(v, str) for v in values):
+            # Tipos mezclados o anidados: se guardan como JSON para no perderlos
+            values = [None if v is None else json.dumps(v, ensure_ascii=False) for v in values]
+            fields_meta["json"].append(name)
+        array = pyarrow.array(values, type=pyarrow.string())
+        arrays.append(array.dictionary_encode() if name in DICT_COLUMNS else array)
+
+    table = pyarrow.Table.from_arrays(arrays, names=names)
+    table = table.replace_schema_metadata({BCOL_MAGIC: json.dumps(fields_meta)})
+    out = io.BytesIO()
+    pq.write_table(table, out, compression="zstd", row_group_size=ROW_GROUP_SIZE)
+    return out.getvalue()
+
+
+def _read_parquet(fileobj, columns: Optional[List[str]] = None):
+    if pq is None:
+        raise RuntimeError("pyarrow is required to read parquet results")
+    table = pq.read_table(io.BytesIO(fileobj.read()), columns=columns)
+    meta = json.loads((table.schema.metadata or {}).get(BCOL_MAGIC.encode(), b"{}"))
+    return table, meta
+
+
+def _parquet_column(table, meta: Dict[str, Any], name: str, typed: bool = True) -> List[Any]:
+    values = table.column(name).to_pylist()
+    if name in meta.get("json", ()):
+        return [None if v is None else json.loads(v) for v in values]
+    if name in meta.get("int64_as_str", ()) and not typed:
+        return [None if v is None else str(v) for v in values]
+    return values
+
+
+# --- API ----------------------------------------------------------------------------
+
+def encode_orders(orders: Iterable[Dict[str, Any]], fmt: str = "auto") -> bytes:
+    orders = orders if isinstance(orders, list) else list(orders)
+    if resolve_format(fmt) == "parquet":
+        return _encode_parquet(orders)
+    return _encode_bcol(orders)
+
+
+def iter_columnar_orders(fileobj, key: str) -> Iterator[Dict[str, Any]]:
+    """Filas de un archivo columnar, con los tipos originales de cTime/uTime."""
+    if format_for_key(key) == "parquet":
+        table, meta = _read_parquet(fileobj)
+        names = table.column_names
+        columns = [_parquet_column(table, meta, n, typed=False) for n in names]
+        for i in range(table.num_rows):
+            yield {name: values[i] for name, values in zip(names, columns) if values[i] is not None}
+        return
+    for group in _iter_bcol_groups(fileobj):
+        yield from _group_rows(group)
+
+
+def decode_orders(fileobj, key: str) -> List[Dict[str, Any]]:
+    return list(iter_columnar_orders(fileobj, key))
+
+
+def read_columns(fileobj, key: str, columns: Optional[List[str]] = None) -> Dict[str, List[Any]]:
+    """
+    Proyección por columnas (sin armar dicts por orden): cTime/uTime como int.
+    Las columnas pedidas que no existen en el archivo vuelven como lista de None.
+    """
+    if format_for_key(key) == "parquet":
+        table, meta = _read_parquet(fileobj)
+        wanted = columns or table.column_names
+        return {
+            name: _parquet_column(table, meta, name) if name in table.column_names else [None] * table.num_rows
+            for name in wanted
+        }
+
+    result: Dict[str, List[Any]] = {name: [] for name in columns or ()}
+    for group in _iter_bcol_groups(fileobj):
+        wanted = columns or list(group["columns"])
+        for name in wanted:
+            column = group["columns"].get(name)
+            values = _column_values(column) if column else [None] * group["rows"]
+            result.setdefault(name, []).extend(values)
+    return result
+
+
+def put_orders(s3, bucket: str, key: str, orders: Iterable[Dict[str, Any]],
+               metadata: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Codifica según la extensión de `key` y sube en un solo put_object."""
+    fmt = format_for_key(key)
+    if fmt is None:
+        raise ValueError(f"Not a columnar key: {key}")
+    orders = orders if isinstance(orders, list) else list(orders)
+    body = encode_orders(orders, fmt)
+    s3.put_object(Bucket=bucket, Key=key, Body=body,
+                  ContentType=FORMAT_CONTENT_TYPE[fmt], Metadata=metadata or {})
+    return {"s3_key": key, "count": len(orders), "bytes": len(body), "format": fmt}
+
+
+def get_orders(s3, bucket: str, key: str) -> List[Dict[str, Any]]:
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+    return decode_orders(body, key)
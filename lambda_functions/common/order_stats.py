@@ -0,0 +1,353 @@
+"""
+Resumen compacto de un conjunto de órdenes: conteo, rango de cTime, conteo por
+mercado y, por lado, conteo y nocional, además de la suma de fees por moneda.
+
+El worker lo calcula una vez sobre su corrida y lo guarda en el sidecar. El
+aggregator y DatabaseService solo combinan resúmenes (`merge_summaries`) y no
+vuelven a recorrer las órdenes.
+
+Nocional: `quoteVolume` (spot) o `filledAmount` (futuros); si faltan, se usa
+priceAvg × cantidad ejecutada. Fees: `fee` en la moneda de margen (futuros) o
+el `feeDetail` de spot (JSON con `totalFee` por moneda, o `newFees.t`).
+
+Rollups (`RollupBuilder`): volumen, fees y reparto compra/venta por símbolo y
+por hora/día (UTC). El aggregator los arma en la misma pasada en que fusiona
+las órdenes: cada orden deja una fila en columnas tipadas (array de la stdlib)
+y al final se agrupa de forma vectorizada con NumPy. Sin NumPy se agrupa con
+diccionarios y el resultado es el mismo.
+"""
+
+import json
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:  # dependencia opcional
+    numpy = None
+
+ROUND_DIGITS = 8
+ROLLUP_GRANULARITIES = {"hourly": 3_600_000, "daily": 86_400_000}
+ROLLUP_METRICS = ("count", "base_volume", "quote_volume", "buy_count", "sell_count", "buy_quote", "sell_quote")
+BUY_SIDES = ("buy", "open_long", "close_short")
+
+
+def _num(value: Any) -> Optional[float]:
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _ctime(order: Dict[str, Any]) -> Optional[int]:
+    try:
+        return int(order.get("cTime"))
+    except (TypeError, ValueError):
+        return None
+
+
+def order_base_volume(order: Dict[str, Any]) -> Optional[float]:
+    qty = _num(order.get("baseVolume"))
+    if qty is None:
+        qty = _num(order.get("filledQty"))
+    return abs(qty) if qty is not None else None
+
+
+def order_notional(order: Dict[str, Any]) -> float:
+    for field in ("quoteVolume", "filledAmount"):
+        value = _num(order.get(field))
+        if value is not None:
+            return abs(value)
+    price = _num(order.get("priceAvg"))
+    qty = order_base_volume(order)
+    return abs(price * qty) if price is not None and qty is not None else 0.0
+
+
+def order_fees(order: Dict[str, Any]) -> Dict[str, float]:
+    """Fees de una orden por moneda (negativos = cobrados, como los reporta Bitget)."""
+    fee = _num(order.get("fee"))
+    if fee is not None:
+        return {str(order.get("marginCoin") or "margin").upper(): fee}
+
+    detail = order.get("feeDetail")
+    if isinstance(detail, str):
+        try:
+            detail = json.loads(detail) if detail else None
+        except ValueError:
+            detail = None
+    if not isinstance(detail, dict):
+        return {}
+    fees: Dict[str, float] = {}
+    for coin, entry in detail.items():
+        if coin == "newFees" or not isinstance(entry, dict):
+            continue
+        value = _num(entry.get("totalFee"))
+        if value is not None:
+            fees[coin.upper()] = fees.get(coin.upper(), 0.0) + value
+    if not fees and isinstance(detail.get("newFees"), dict):
+        value = _num(detail["newFees"].get("t"))
+        if value is not None:
+            fees["FEE"] = value  # el formato newFees no indica la moneda
+    return fees
+
+
+def empty_summary() -> Dict[str, Any]:
+    return {"count": 0, "min_ctime": None, "max_ctime": None, "markets": {}, "sides": {}, "fees": {}}
+
+
+def add_order(summary: Dict[str, Any], order: Dict[str, Any]) -> None:
+    summary["count"] += 1
+    ctime = _ctime(order)
+    if ctime is not None:
+        summary["min_ctime"] = ctime if summary["min_ctime"] is None else min(summary["min_ctime"], ctime)
+        summary["max_ctime"] = ctime if summary["max_ctime"] is None else max(summary["max_ctime"], ctime)
+
+    market = str(order.get("_market") or "unknown")
+    summary["markets"][market] = summary["markets"].get(market, 0) + 1
+
+    side = str(order.get("side") or "unknown").lower()
+    bucket = summary["sides"].setdefault(side, {"count": 0, "notional": 0.0})
+    bucket["count"] += 1
+    bucket["notional"] += order_notional(order)
+
+    for coin, value in order_fees(order).items():
+        summary["fees"][coin] = summary["fees"].get(coin, 0.0) + value
+
+
+def summarize_orders(orders: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    summary = empty_summary()
+    for order in orders:
+        if isinstance(order, dict):
+            add_order(summary, order)
+    return rounded(summary)
+
+
+def merge_summaries(summaries: Iterable[Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+    total = empty_summary()
+    for summary in summaries:
+        if not summary:
+            continue
+        total["count"] += int(summary.get("count") or 0)
+        for bound, pick in (("min_ctime", min), ("max_ctime", max)):
+            value = summary.get(bound)
+            if value is not None:
+                total[bound] = value if total[bound] is None else pick(total[bound], value)
+        for market, count in (summary.get("markets") or {}).items():
+            total["markets"][market] = total["markets"].get(market, 0) + int(count)
+        for side, bucket in (summary.get("sides") or {}).items():
+            into = total["sides"].setdefault(side, {"count": 0, "notional": 0.0})
+            into["count"] += int(bucket.get("count") or 0)
+            into["notional"] += float(bucket.get("notional") or 0)
+        for coin, value in (summary.get("fees") or {}).items():
+            total["fees"][coin] = total["fees"].get(coin, 0.0) + float(value)
+    return rounded(total)
+
+
+def rounded(summary: Dict[str, Any]) -> Dict[str, Any]:
+    for bucket in summary["sides"].values():
+        bucket["notional"] = round(bucket["notional"], ROUND_DIGITS)
+    summary["fees"] = {coin: round(value, ROUND_DIGITS) for coin, value in summary["fees"].items()}
+    return summary
+
+
+def rollup_fields(order: Dict[str, Any]) -> Optional[Tuple[int, str, float, float, bool, Dict[str, float]]]:
+    """(cTime, símbolo, volumen base, nocional, es compra, fees) de una orden; None si no tiene cTime."""
+    ctime = _ctime(order)
+    if ctime is None:
+        return None
+    symbol = str(order.get("symbol") or order.get("_symbol") or "unknown")
+    buy = str(order.get("side") or "").lower() in BUY_SIDES
+    return ctime, symbol, order_base_volume(order) or 0.0, order_notional(order), buy, order_fees(order)
+
+
+class RollupBuilder:
+    """
+    Uso:
+        builder = RollupBuilder()
+        for order in builder.feed(orders): ...   # o builder.add(order)
+        doc = builder.build()                     # {"symbols", "coins", "hourly": {...}, "daily": {...}}
+
+    Cada granularidad se guarda por columnas (`symbol` como índice en `symbols`,
+    `start` en ms UTC y una lista por métrica). Las fees van aparte, en forma
+    dispersa (`fee_row`, `fee_coin`, `fee_value`), porque no se suman entre monedas.
+    `rollup_rows` lo vuelve a expandir en filas.
+    """
+    def __init__(self):
+        self._symbol_codes: Dict[str, int] = {}
+        self._coin_codes: Dict[str, int] = {}
+        self.ctime = array("q")
+        self.symbol = array("q")
+        self.base = array("d")
+        self.quote = array("d")
+        self.buy = array("b")
+        self.fee_order = array("q")
+        self.fee_coin = array("q")
+        self.fee_value = array("d")
+
+    @staticmethod
+    def _code(codes: Dict[str, int], value: str) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def add(self, order: Dict[str, Any]):
+        fields = rollup_fields(order)
+        if fields is not None:
+            self.add_fields(*fields)
+
+    def add_fields(self, ctime: int, symbol: str, base: float, quote: float, buy: bool, fees: Dict[str, float]):
+        """Fila ya extraída con `rollup_fields` (p. ej. en otro proceso)."""
+        row = len(self.ctime)
+        self.ctime.append(ctime)
+        self.symbol.append(self._code(self._symbol_codes, symbol))
+        self.base.append(base)
+        self.quote.append(quote)
+        self.buy.append(1 if buy else 0)
+        for coin, value in fees.items():
+            self.fee_order.append(row)
+            self.fee_coin.append(self._code(self._coin_codes, coin))
+            self.fee_value.append(value)
+
+    def extend(self, ctime: Iterable[int], symbols: List[str], symbol_codes: Iterable[int], base: Iterable[float],
+               quote: Iterable[float], buy: Iterable[int], fee_rows: Iterable[int], coins: List[str],
+               fee_coins: Iterable[int], fee_values: Iterable[float]):
+        """Bloque de filas ya en columnas; los códigos de símbolo/moneda y `fee_rows` son locales al bloque."""
+        first_row = len(self.ctime)
+        symbol_map = [self._code(self._symbol_codes, symbol) for symbol in symbols]
+        coin_map = [self._code(self._coin_codes, coin) for coin in coins]
+        self.ctime.extend(ctime)
+        self.symbol.extend([symbol_map[code] for code in symbol_codes])
+        self.base.extend(base)
+        self.quote.extend(quote)
+        self.buy.extend(buy)
+        self.fee_order.extend([first_row + row for row in fee_rows])
+        self.fee_coin.extend([coin_map[code] for code in fee_coins])
+        self.fee_value.extend(fee_values)
+
+    def feed(self, orders: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Deja pasar las órdenes registrando cada una: sirve para armar los rollups durante la escritura."""
+        for order in orders:
+            self.add(order)
+            yield order
+
+    def build(self) -> Dict[str, Any]:
+        group = _group_numpy if numpy is not None else _group_python
+        doc: Dict[str, Any] = {
+            "version": 1,
+            "timezone": "UTC",
+            "symbols": list(self._symbol_codes),
+            "coins": list(self._coin_codes),
+        }
+        for name, width in ROLLUP_GRANULARITIES.items():
+            doc[name] = group(self, width)
+        return doc
+
+
+def _group_numpy(builder: RollupBuilder, width: int) -> Dict[str, List[Any]]:
+    """Group-by (símbolo, bucket) con `numpy.unique` + `bincount` sobre las columnas sin copiarlas."""
+    empty = {name: [] for name in ("symbol", "start", *ROLLUP_METRICS, "fee_row", "fee_coin", "fee_value")}
+    if not builder.ctime:
+        return empty
+    ctime = numpy.frombuffer(builder.ctime, dtype=numpy.int64)
+    symbol = numpy.frombuffer(builder.symbol, dtype=numpy.int64)
+    base = numpy.frombuffer(builder.base, dtype=numpy.float64)
+    quote = numpy.frombuffer(builder.quote, dtype=numpy.float64)
+    buy = numpy.frombuffer(builder.buy, dtype=numpy.int8).astype(bool)
+
+    bucket = ctime // width
+    offset = bucket - bucket.min()
+    span = int(offset.max()) + 1
+    keys, inverse = numpy.unique(symbol * span + offset, return_inverse=True)
+    n = len(keys)
+
+    def total(weights=None):
+        return numpy.bincount(inverse, weights=weights, minlength=n)
+
+    out = {
+        "symbol": (keys // span).tolist(),
+        "start": ((keys % span + bucket.min()) * width).tolist(),
+        "count": total().astype(numpy.int64).tolist(),
+        "base_volume": numpy.round(total(base), ROUND_DIGITS).tolist(),
+        "quote_volume": numpy.round(total(quote), ROUND_DIGITS).tolist(),
+        "buy_count": total(buy.astype(numpy.float64)).astype(numpy.int64).tolist(),
+        "buy_quote": numpy.round(total(numpy.where(buy, quote, 0.0)), ROUND_DIGITS).tolist(),
+    }
+    out["sell_count"] = [c - b for c, b in zip(out["count"], out["buy_count"])]
+    out["sell_quote"] = numpy.round(total(numpy.where(buy, 0.0, quote)), ROUND_DIGITS).tolist()
+
+    if builder.fee_order:
+        fee_order = numpy.frombuffer(builder.fee_order, dtype=numpy.int64)
+        fee_coin = numpy.frombuffer(builder.fee_coin, dtype=numpy.int64)
+        n_coins = int(fee_coin.max()) + 1
+        fee_keys, fee_inverse = numpy.unique(inverse[fee_order] * n_coins + fee_coin, return_inverse=True)
+        sums = numpy.bincount(fee_inverse, weights=numpy.frombuffer(builder.fee_value, dtype=numpy.float64),
+                              minlength=len(fee_keys))
+        out["fee_row"] = (fee_keys // n_coins).tolist()
+        out["fee_coin"] = (fee_keys % n_coins).tolist()
+        out["fee_value"] = numpy.round(sums, ROUND_DIGITS).tolist()
+    else:
+        out.update(fee_row=[], fee_coin=[], fee_value=[])
+    return out
+
+
+def _group_python(builder: RollupBuilder, width: int) -> Dict[str, List[Any]]:
+    """Mismo resultado que `_group_numpy`, acumulando en diccionarios."""
+    groups: Dict[Tuple[int, int], List[float]] = {}
+    row_group: List[Tuple[int, int]] = []
+    for ctime, symbol, base, quote, buy in zip(builder.ctime, builder.symbol, builder.base, builder.quote, builder.buy):
+        key = (symbol, ctime // width)
+        acc = groups.get(key)
+        if acc is None:
+            acc = groups[key] = [0, 0.0, 0.0, 0, 0, 0.0, 0.0]
+        acc[0] += 1
+        acc[1] += base
+        acc[2] += quote
+        acc[3 if buy else 4] += 1
+        acc[5 if buy else 6] += quote
+        row_group.append(key)
+
+    keys = sorted(groups)
+    index = {key: i for i, key in enumerate(keys)}
+    out: Dict[str, List[Any]] = {"symbol": [k[0] for k in keys], "start": [k[1] * width for k in keys]}
+    for i, name in enumerate(ROLLUP_METRICS):
+        values = [groups[k][i] for k in keys]
+        out[name] = values if name.endswith("count") else [round(v, ROUND_DIGITS) for v in values]
+
+    fees: Dict[Tuple[int, int], float] = {}
+    for row, coin, value in zip(builder.fee_order, builder.fee_coin, builder.fee_value):
+        fee_key = (index[row_group[row]], coin)
+        fees[fee_key] = fees.get(fee_key, 0.0) + value
+    fee_keys = sorted(fees)
+    out["fee_row"] = [k[0] for k in fee_keys]
+    out["fee_coin"] = [k[1] for k in fee_keys]
+    out["fee_value"] = [round(fees[k], ROUND_DIGITS) for k in fee_keys]
+    return out
+
+
+def rollup_rows(doc: Dict[str, Any], granularity: str = "daily", symbol: Optional[str] = None,
+                start_ms: Optional[int] = None, end_ms: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Expande una granularidad del documento de rollups en filas, con filtro opcional por símbolo y rango."""
+    cols = doc.get(granularity)
+    if cols is None:
+        raise ValueError(f"Granularidad no soportada: {granularity}")
+    symbols, coins = doc.get("symbols") or [], doc.get("coins") or []
+
+    fees_by_row: Dict[int, Dict[str, float]] = {}
+    for row, coin, value in zip(cols["fee_row"], cols["fee_coin"], cols["fee_value"]):
+        fees_by_row.setdefault(row, {})[coins[coin]] = value
+
+    rows = []
+    for i, code in enumerate(cols["symbol"]):
+        start = cols["start"][i]
+        if symbol is not None and symbols[code] != symbol:
+            continue
+        if (start_ms is not None and start < start_ms) or (end_ms is not None and start > end_ms):
+            continue
+        row = {"symbol": symbols[code], "start_ms": start}
+        row.update({name: cols[name][i] for name in ROLLUP_METRICS})
+        row["fees"] = fees_by_row.get(i, {})
+        rows.append(row)
+    return rows
@@ -0,0 +1,540 @@
+"""
+Escritura en streaming de órdenes a S3 como NDJSON comprimido.
+
+Cada orden se serializa en una línea y pasa directo por el compresor; la salida
+comprimida se acumula solo hasta `part_size` y entonces se sube como parte de un
+multipart upload. La memoria queda acotada por una parte, no por el historial
+completo, y sin `indent=2` el objeto ocupa varias veces menos.
+
+Codecs: "gzip" (por defecto), "zstd" (requiere `zstandard`) y "none".
+
+Los archivos per-symbol del worker son corridas ordenadas por cTime DESC
+(metadata `sort-order: ctime-desc`): el aggregator las fusiona en streaming.
+Junto a cada archivo va un sidecar `<key>.meta.json` con su resumen (ver
+order_stats), para que el aggregator pueda resumir sin descargar los datos.
+
+Resultado particionado (`PartitionedWriter`): un NDJSON por símbolo y día
+(`<base>/symbol=X/date=YYYY-MM-DD/part-00000.ndjson.gz`) y un `manifest.json`
+con key, bytes, filas y rango de cTime de cada partición; los lectores eligen
+con `select_partitions` solo las que necesitan.
+
+Órdenes inline: los símbolos chicos no pasan por S3; el worker las devuelve en la
+respuesta, como lista `orders` o como NDJSON gzip en base64 en `orders_gz`
+(`inline_orders` lee cualquiera de las dos).
+"""
+
+import base64
+import codecs
+import gzip
+import json
+import re
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+try:
+    import zstandard
+except ImportError:  # dependencia opcional
+    zstandard = None
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # mínimo de S3 para todas las partes salvo la última
+READ_CHUNK_SIZE = 256 * 1024
+
+CODEC_SUFFIX = {"gzip": "ndjson.gz", "zstd": "ndjson.zst", "none": "ndjson"}
+CODEC_ENCODING = {"gzip": "gzip", "zstd": "zstd"}
+
+# Metadata S3 que marca un archivo como corrida ordenada
+RUN_SORT_METADATA = "sort-order"
+RUN_SORT_CTIME_DESC = "ctime-desc"
+
+SIDECAR_SUFFIX = ".meta.json"
+MANIFEST_NAME = "manifest.json"
+
+INLINE_ORDERS_FIELD = "orders_gz"  # NDJSON gzip en base64 dentro de la respuesta del worker
+
+# Sufijo de contrato v1 de futuros: BTCUSDT_UMCBL se particiona y filtra como BTCUSDT
+CONTRACT_SUFFIX_RE = re.compile(r"_S?[UDC]MCBL$")
+
+
+def order_ctime(order: Any) -> int:
+    """Clave de orden de las corridas: cTime (ms); 0 si falta o no es numérico."""
+    if not isinstance(order, dict):
+        return 0
+    try:
+        return int(order.get("cTime") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def resolve_codec(codec: str) -> str:
+    codec = (codec or "gzip").lower()
+    if codec not in CODEC_SUFFIX:
+        raise ValueError(f"Unknown results codec: {codec}")
+    if codec == "zstd" and zstandard is None:
+        print("zstandard not installed, falling back to gzip")
+        return "gzip"
+    return codec
+
+
+class _Identity:
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _compressor(codec: str):
+    if codec == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: contenedor gzip
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return _Identity()
+
+
+def encode_chunk(data: bytes, codec: str) -> bytes:
+    """
+    Comprime un bloque de líneas como miembro gzip / frame zstd completo. Los bloques
+    concatenados forman un stream válido, así que se pueden comprimir en paralelo.
+    """
+    compressor = _compressor(codec)
+    return compressor.compress(data) + compressor.flush()
+
+
+class S3NdjsonWriter:
+    """
+    Uso:
+        with S3NdjsonWriter(s3, bucket, key) as writer:
+            writer.write_many(page)
+        writer.stats -> {"s3_key", "count", "raw_bytes", "bytes", "parts", "codec"}
+
+    Si todo cabe en una parte se hace un único put_object; si no, multipart upload
+    (abortado si hay una excepción, para no dejar partes huérfanas).
+    """
+    def __init__(
+        self,
+        s3,
+        bucket: str,
+        key: str,
+        codec: str = "gzip",
+        part_size: int = 8 * 1024 * 1024,
+        metadata: Optional[Dict[str, str]] = None,
+        content_type: str = "application/x-ndjson; charset=utf-8",
+    ):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.codec = resolve_codec(codec)
+        self.part_size = max(MIN_PART_SIZE, int(part_size))
+        self.metadata = metadata or {}
+        self.content_type = content_type
+
+        self._compressor = _compressor(self.codec)
+        self._compressor_used = False
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts = []
+        self._closed = False
+
+        self.count = 0
+        self.raw_bytes = 0
+        self.bytes = 0
+
+    def _object_args(self) -> Dict[str, Any]:
+        args = {"ContentType": self.content_type, "Metadata": self.metadata}
+        if self.codec in CODEC_ENCODING:
+            args["ContentEncoding"] = CODEC_ENCODING[self.codec]
+        return args
+
+    def _upload_part(self, data: bytes):
+        if self._upload_id is None:
+            res = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self._object_args())
+            self._upload_id = res["UploadId"]
+        number = len(self._parts) + 1
+        res = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=number, Body=data
+        )
+        self._parts.append({"ETag": res["ETag"], "PartNumber": number})
+        self.bytes += len(data)
+
+    def _feed(self, chunk: bytes):
+        self._buffer += chunk
+        if len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer))
+            self._buffer.clear()
+
+    def write(self, order: Dict[str, Any]):
+        line = json.dumps(order, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        self.count += 1
+        self.raw_bytes += len(line)
+        self._compressor_used = True
+        self._feed(self._compressor.compress(line))
+
+    def write_many(self, orders: Iterable[Dict[str, Any]]):
+        for order in orders:
+            self.write(order)
+
+    def write_raw(self, data: bytes):
+        """Bytes tal cual (p. ej. el marco de un documento JSON); no cuenta como orden."""
+        self.raw_bytes += len(data)
+        self._compressor_used = True
+        self._feed(self._compressor.compress(data))
+
+    def write_encoded(self, data: bytes, count: int, raw_bytes: int):
+        """
+        Bloque ya comprimido con `encode_chunk` (mismo codec). No se mezcla con
+        `write`/`write_raw`: el compresor interno quedaría con datos a medias.
+        """
+        if self._compressor_used:
+            raise ValueError("write_encoded cannot follow write/write_raw on the same writer")
+        self.count += count
+        self.raw_bytes += raw_bytes
+        self._feed(data)
+
+    def close(self) -> Dict[str, Any]:
+        if self._closed:
+            return self.stats
+        if self._compressor_used or not self.count:
+            self._buffer += self._compressor.flush()
+        if self._upload_id is None:
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), **self._object_args())
+            self.bytes += len(self._buffer)
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        self._buffer.clear()
+        self._closed = True
+        return self.stats
+
+    def abort(self):
+        if self._upload_id is not None and not self._closed:
+            try:
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except Exception as e:
+                print(f"Failed to abort multipart upload for {self.key}: {str(e)}")
+        self._closed = True
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "s3_key": self.key,
+            "count": self.count,
+            "raw_bytes": self.raw_bytes,
+            "bytes": self.bytes,
+            "parts": max(1, len(self._parts)),
+            "codec": self.codec,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def sidecar_key(key: str) -> str:
+    return f"{key}{SIDECAR_SUFFIX}"
+
+
+def build_sidecar(symbol: str, key: str, summary: Dict[str, Any], stats: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Sidecar de una corrida: el resumen de `order_stats.summarize_orders` (count, min/max
+    cTime, markets, sides, fees) más los datos del archivo.
+    """
+    return {
+        "symbol": symbol,
+        "s3_key": key,
+        **summary,
+        "bytes": stats.get("bytes"),
+        "raw_bytes": stats.get("raw_bytes"),
+        "codec": stats.get("codec") or stats.get("format"),
+        "sort_order": RUN_SORT_CTIME_DESC,
+    }
+
+
+_JSON_WS = re.compile(r"[ \t\n\r]*")
+
+
+class JsonOrdersStream:
+    """
+    Uso:
+        stream = JsonOrdersStream(body)
+        for order in stream: ...           # elementos de "orders", uno a la vez
+        stream.document -> el resto de las claves de primer nivel (resumen del aggregator)
+
+    Lee `body` por bloques y decodifica cada elemento del arreglo con `raw_decode`, así
+    que la memoria queda en un bloque más una orden, no en el documento completo.
+    `document` se completa a medida que se leen sus claves; en el documento del
+    aggregator el resumen va después de las órdenes. Un arreglo en la raíz también sirve.
+    """
+    def __init__(self, body, field: str = "orders", chunk_size: int = READ_CHUNK_SIZE):
+        self.body = body
+        self.field = field
+        self.chunk_size = chunk_size
+        self.document: Dict[str, Any] = {}
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self.body.read(self.chunk_size)
+        if not chunk:
+            self._eof = True
+        self._buf = self._buf[self._pos:] + self._text.decode(chunk or b"", final=not chunk)
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Siguiente carácter que no es espacio; "" al final del documento."""
+        while True:
+            self._pos = _JSON_WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"Invalid JSON document: expected {char!r} at offset {self._pos}")
+        self._pos += 1
+
+    def _value(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            if end == len(self._buf) and self._fill():
+                continue  # un número al final del bloque puede seguir en el siguiente
+            self._pos = end
+            return value
+
+    def _array(self) -> Iterator[Any]:
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._peek() == "]":
+                self._pos += 1
+                return
+            self._expect(",")
+
+    def __iter__(self) -> Iterator[Any]:
+        if self._peek() == "[":
+            yield from self._array()
+            return
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            name = self._value()
+            self._expect(":")
+            if name == self.field and self._peek() == "[":
+                yield from self._array()
+            else:
+                self.document[name] = self._value()
+            if self._peek() == "}":
+                return
+            self._expect(",")
+
+
+def iter_orders(body, key: str) -> Iterator[Dict[str, Any]]:
+    """
+    Lee en streaming un objeto de resultados según su extensión: .ndjson(.gz|.zst)
+    o el JSON legado {"orders": [...]} (ver JsonOrdersStream).
+    """
+    if key.endswith(".ndjson.gz"):
+        stream = gzip.GzipFile(fileobj=body)
+    elif key.endswith(".ndjson.zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {key}")
+        # Un resultado compuesto concatena varios frames zstd
+        stream = zstandard.ZstdDecompressor().stream_reader(body, read_across_frames=True)
+    elif key.endswith(".ndjson"):
+        stream = body
+    else:
+        yield from JsonOrdersStream(body)
+        return
+
+    pending = b""
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if pending.strip():
+        yield json.loads(pending)
+
+
+def inline_orders(item: Dict[str, Any]) -> List[Any]:
+    """Órdenes que vinieron dentro de la respuesta del worker (`orders_gz` o la lista `orders`)."""
+    packed = item.get(INLINE_ORDERS_FIELD)
+    if packed:
+        data = gzip.decompress(base64.b64decode(packed))
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
+    return item.get("orders") or []
+
+
+def base_symbol(symbol: Any) -> str:
+    """Símbolo base (BTCUSDT) de un símbolo spot o de un contrato de futuros (BTCUSDT_UMCBL)."""
+    return CONTRACT_SUFFIX_RE.sub("", str(symbol).upper())
+
+
+def order_symbol(order: Dict[str, Any]) -> str:
+    """Símbolo base de la orden: el `_symbol` que se pidió al worker o, si falta, `symbol` sin sufijo de contrato."""
+    symbol = order.get("_symbol") or order.get("symbol")
+    return base_symbol(symbol) if symbol else "unknown"
+
+
+def order_day(order: Dict[str, Any]) -> str:
+    """Día UTC (YYYY-MM-DD) del cTime de la orden."""
+    return datetime.fromtimestamp(order_ctime(order) / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def is_manifest_key(key: str) -> bool:
+    return key.endswith("/" + MANIFEST_NAME)
+
+
+class PartitionedWriter:
+    """
+    Uso:
+        with PartitionedWriter(s3, bucket, base_key, codec="gzip") as writer:
+            writer.write_many(merged)          # cTime DESC
+        writer.partitions -> [{"symbol", "date", "key", "bytes", "raw_bytes", "count", "min_ctime", "max_ctime"}]
+
+    Las órdenes llegan en cTime DESC, así que cuando cambia el día las particiones
+    abiertas ya están completas y se cierran: solo hay abiertos los escritores del
+    día en curso (uno por símbolo con órdenes ese día). Si un día reaparece (entrada
+    no ordenada) se abre otra parte en lugar de pisar la anterior.
+    """
+    def __init__(self, s3, bucket: str, base_key: str, codec: str = "gzip", part_size: int = 8 * 1024 * 1024,
+                 metadata: Optional[Dict[str, str]] = None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.base_key = base_key.rstrip("/")
+        self.codec = resolve_codec(codec)
+        self.part_size = part_size
+        self.metadata = metadata or {}
+
+        self._day: Optional[str] = None
+        self._open: Dict[str, Dict[str, Any]] = {}      # símbolo -> {"writer", "date", "min_ctime", "max_ctime"}
+        self._part_numbers: Dict[tuple, int] = {}
+        self.partitions: List[Dict[str, Any]] = []
+        self.count = 0
+
+    def partition_key(self, symbol: str, day: str, part: int) -> str:
+        return f"{self.base_key}/symbol={symbol}/date={day}/part-{part:05d}.{CODEC_SUFFIX[self.codec]}"
+
+    @property
+    def manifest_key(self) -> str:
+        return f"{self.base_key}/{MANIFEST_NAME}"
+
+    def _close_open(self):
+        for symbol, entry in self._open.items():
+            stats = entry["writer"].close()
+            self.partitions.append({
+                "symbol": symbol,
+                "date": entry["date"],
+                "key": stats["s3_key"],
+                "bytes": stats["bytes"],
+                "raw_bytes": stats["raw_bytes"],
+                "count": stats["count"],
+                "min_ctime": entry["min_ctime"],
+                "max_ctime": entry["max_ctime"],
+            })
+        self._open = {}
+
+    def write(self, order: Dict[str, Any]):
+        day = order_day(order)
+        if day != self._day:
+            self._close_open()
+            self._day = day
+        symbol = order_symbol(order)
+        entry = self._open.get(symbol)
+        if entry is None:
+            part = self._part_numbers.get((symbol, day), 0)
+            self._part_numbers[(symbol, day)] = part + 1
+            writer = S3NdjsonWriter(self.s3, self.bucket, self.partition_key(symbol, day, part), codec=self.codec,
+                                    part_size=self.part_size, metadata=self.metadata)
+            entry = self._open[symbol] = {"writer": writer, "date": day, "min_ctime": None, "max_ctime": None}
+        ctime = order_ctime(order)
+        entry["min_ctime"] = ctime if entry["min_ctime"] is None else min(entry["min_ctime"], ctime)
+        entry["max_ctime"] = ctime if entry["max_ctime"] is None else max(entry["max_ctime"], ctime)
+        entry["writer"].write(order)
+        self.count += 1
+
+    def write_many(self, orders: Iterable[Dict[str, Any]]):
+        for order in orders:
+            self.write(order)
+
+    def close(self) -> List[Dict[str, Any]]:
+        self._close_open()
+        return self.partitions
+
+    def abort(self):
+        for entry in self._open.values():
+            entry["writer"].abort()
+        self._open = {}
+
+    def manifest(self, **extra: Any) -> Dict[str, Any]:
+        return {
+            "version": 1,
+            "layout": "symbol/date",
+            "codec": self.codec,
+            "total_orders": self.count,
+            "partitions": sorted(self.partitions, key=lambda p: (p["symbol"], p["date"], p["key"])),
+            **extra,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def select_partitions(manifest: Dict[str, Any], symbols: Optional[Sequence[str]] = None,
+                      start_ms: Optional[int] = None, end_ms: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Particiones del manifest que pueden tener órdenes de esos símbolos dentro de [start_ms, end_ms].
+    Los símbolos se comparan por símbolo base, también los de manifests anteriores que
+    particionaban por contrato (symbol=BTCUSDT_UMCBL). Sirve también para las `entries`
+    del manifest de un resultado compuesto; una entrada sin min/max cTime no se descarta.
+    """
+    wanted = {base_symbol(symbol) for symbol in symbols} if symbols else None
+    selected = []
+    for partition in manifest.get("partitions") or []:
+        if wanted is not None and base_symbol(partition.get("symbol")) not in wanted:
+            continue
+        max_ctime, min_ctime = partition.get("max_ctime"), partition.get("min_ctime")
+        if start_ms is not None and max_ctime is not None and max_ctime < start_ms:
+            continue
+        if end_ms is not None and min_ctime is not None and min_ctime > end_ms:
+            continue
+        selected.append(partition)
+    return selected
@@ -1,15 +1,84 @@
 import json, os, boto3
+from concurrent.futures import ThreadPoolExecutor
 
 SF_ARN = os.environ["STATE_MACHINE_ARN"]
 sf = boto3.client("stepfunctions")
 
+# Pre-filtro de actividad: el worker en modo "probe" descarta los símbolos sin órdenes
+WORKER_FUNCTION_NAME = os.environ.get("WORKER_FUNCTION_NAME")
+PREFILTER_MIN_SYMBOLS = int(os.environ.get("PREFILTER_MIN_SYMBOLS", "20"))
+PREFILTER_BATCH_SIZE = int(os.environ.get("PREFILTER_BATCH_SIZE", "50"))
+PREFILTER_MAX_PARALLEL = int(os.environ.get("PREFILTER_MAX_PARALLEL", "4"))
+
+lambda_client = boto3.client("lambda") if WORKER_FUNCTION_NAME else None
+
+# Presupuesto inline: las respuestas de todos los workers quedan juntas en un solo estado
+# del Map (límite de 256 KB de Step Functions); cada worker recibe su parte en inline_max_bytes
+STATE_MAX_BYTES = int(os.environ.get("STATE_MAX_BYTES", str(256 * 1024)))
+INLINE_STATE_SHARE = float(os.environ.get("INLINE_STATE_SHARE", "0.5"))  # fracción del estado para órdenes inline
+INLINE_RESPONSE_OVERHEAD = 512  # campos de la respuesta del worker además de las órdenes
+INLINE_MIN_BYTES = 256          # con menos espacio el worker va directo a S3
+
+def _inline_budget(symbol_count):
+    """Bytes de órdenes inline por worker para que el estado del Map no pase de STATE_MAX_BYTES; 0 = solo S3."""
+    share = int(STATE_MAX_BYTES * INLINE_STATE_SHARE) // max(1, symbol_count) - INLINE_RESPONSE_OVERHEAD
+    return share if share >= INLINE_MIN_BYTES else 0
+
+def _probe_batch(symbols, body):
+    """
+    Invoca al worker en modo probe para un lote. Si algo falla, el lote completo
+    se considera activo: el pre-filtro nunca debe perder símbolos.
+    """
+    payload = {
+        "mode": "probe",
+        "symbols": symbols,
+        "start_ms": body.get("start_ms"),
+        "end_ms": body.get("end_ms"),
+    }
+    try:
+        res = lambda_client.invoke(
+            FunctionName=WORKER_FUNCTION_NAME,
+            InvocationType="RequestResponse",
+            Payload=json.dumps(payload).encode("utf-8"),
+        )
+        result = json.loads(res["Payload"].read() or b"{}")
+    except Exception as e:
+        print(f"Probe invocation failed for {len(symbols)} symbols, keeping all: {str(e)}")
+        return {"active": list(symbols), "inactive": [], "unprobed": []}
+
+    if res.get("FunctionError") or not isinstance(result, dict) or "active" not in result:
+        print(f"Probe returned an error for {len(symbols)} symbols, keeping all: {str(result)[:300]}")
+        return {"active": list(symbols), "inactive": [], "unprobed": []}
+    return result
+
+def _prefilter_active_symbols(symbols, body):
+    """
+    Retorna (símbolos a despachar, resumen). Los no probados por falta de tiempo se despachan igual.
+    """
+    batches = [symbols[i:i + PREFILTER_BATCH_SIZE] for i in range(0, len(symbols), PREFILTER_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=max(1, PREFILTER_MAX_PARALLEL)) as pool:
+        results = list(pool.map(lambda batch: _probe_batch(batch, body), batches))
+
+    keep = set()
+    summary = {"probed": len(symbols), "active": 0, "inactive": 0, "unprobed": 0}
+    for result in results:
+        keep.update(result.get("active") or [])
+        keep.update(result.get("unprobed") or [])
+        for k in ("active", "inactive", "unprobed"):
+            summary[k] += len(result.get(k) or [])
+
+    # Conservar el orden original
+    return [s for s in symbols if s in keep], summary
+
 def handler(event, context):
     """
     event esperado:
     {
       "symbols": ["BTCUSDT","ETHUSDT"],
       "start_ms": 1698796800000,   # opcional
-      "end_ms":   1698883200000    # opcional
+      "end_ms":   1698883200000,   # opcional
+      "sync": true,                # opcional: solo el delta desde el último high-water mark
+      "prefilter": true            # opcional: por defecto activo desde PREFILTER_MIN_SYMBOLS símbolos
     }
     """
     body = event if isinstance(event, dict) else {}
@@ -17,11 +86,30 @@ def handler(event, context):
     if not symbols:
         return {"statusCode": 400, "body": json.dumps({"error": "symbols required"})}
 
+    prefilter = body.get("prefilter")
+    if prefilter is None:
+        prefilter = len(symbols) >= PREFILTER_MIN_SYMBOLS
+    prefilter_summary = None
+    if prefilter and lambda_client:
+        symbols, prefilter_summary = _prefilter_active_symbols(symbols, body)
+        print(f"Prefilter: dispatching {len(symbols)} of {prefilter_summary['probed']} symbols: {prefilter_summary}")
+
+    if not symbols:
+        return {"statusCode": 200, "body": json.dumps({"executionArn": None, "prefilter": prefilter_summary})}
+
     # la entrada del State Machine puede conservar start/end para que el Map los pase a cada worker
-    input_obj = {"symbols": [{"symbol": s, "start_ms": body.get("start_ms"), "end_ms": body.get("end_ms")} for s in symbols]}
+    inline_max_bytes = _inline_budget(len(symbols))
+    input_obj = {"symbols": [
+        {"symbol": s, "start_ms": body.get("start_ms"), "end_ms": body.get("end_ms"), "sync": bool(body.get("sync")),
+         "inline_max_bytes": inline_max_bytes}
+        for s in symbols
+    ]}
 
     res = sf.start_execution(
         stateMachineArn=SF_ARN,
         input=json.dumps(input_obj)
     )
-    return {"statusCode": 202, "body": json.dumps({"executionArn": res["executionArn"]})}
\ No newline at end of file
+    response_body = {"executionArn": res["executionArn"]}
+    if prefilter_summary is not None:
+        response_body["prefilter"] = prefilter_summary
+    return {"statusCode": 202, "body": json.dumps(response_body)}
@@ -1,30 +1,45 @@
 import os
+import sys
 import time
 import hmac
 import json
 import hashlib
 import base64
 import urllib.parse
+import asyncio
 import boto3
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, Iterable, List, Optional, Tuple, Awaitable
 from datetime import datetime, timezone
 from threading import Lock, Thread
-from concurrent.futures import ThreadPoolExecutor, as_completed, Future
 from collections import defaultdict, deque
 import signal
 import threading
 from dataclasses import dataclass
 from enum import Enum
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from engine import AsyncEngine
+from rate_limiter import EndpointRateLimiter, EndpointLimit
+from shared_budget import SharedRateLimiter, budget_backend_from_env, budget_namespace
+from range_planner import DAY_MS, EndpointWindow, PageRun, RangeResult, RunSink, fetch_range, plan_windows
+from sync_state import SymbolSyncState, SyncStore, stream_watermark
+from contract_catalog import CONTRACTS_ENDPOINT, ContractCatalog
+
+# Módulos compartidos: en el paquete de despliegue van junto al handler (scripts/package_lambdas.py); en el repo, en ../common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import FORMAT_SUFFIX, decode_orders, is_columnar_key, put_orders, resolve_format
+from order_stats import add_order, empty_summary, rounded
+from result_writer import (
+    CODEC_SUFFIX, RUN_SORT_CTIME_DESC, RUN_SORT_METADATA, S3NdjsonWriter, build_sidecar, iter_orders, order_ctime,
+    resolve_codec, sidecar_key,
+)
+from order_spool import OrderSpool
 
 # Importar optimizador de respuestas
 try:
     from response_optimizer import (
         optimize_orders_response,
         create_minimal_response,
+        pack_orders_inline,
     )
     OPTIMIZER_AVAILABLE = True
 except ImportError:
@@ -33,9 +48,26 @@ except ImportError:
 
 # Config
 BITGET_BASE = os.environ.get("BITGET_BASE", "https://api.bitget.com").rstrip("/")
-API_KEY = os.environ["BITGET_API_KEY"]
-API_SECRET = os.environ["BITGET_API_SECRET"]
-API_PASSPHRASE = os.environ["BITGET_API_PASSPHRASE"]
+CREDENTIALS_SECRET_NAME = os.environ.get("CREDENTIALS_SECRET_NAME")
+
+
+def _load_credentials() -> Tuple[str, str, str]:
+    """
+    Credenciales de Bitget: de las variables BITGET_API_* si están definidas o, en el
+    despliegue CDK, del secreto CREDENTIALS_SECRET_NAME (claves apiKey, secretKey, passphrase).
+    """
+    if os.environ.get("BITGET_API_KEY") or not CREDENTIALS_SECRET_NAME:
+        return os.environ["BITGET_API_KEY"], os.environ["BITGET_API_SECRET"], os.environ["BITGET_API_PASSPHRASE"]
+    secret = boto3.client("secretsmanager").get_secret_value(SecretId=CREDENTIALS_SECRET_NAME)
+    creds = json.loads(secret.get("SecretString") or "{}")
+    return (
+        creds.get("apiKey") or creds["api_key"],
+        creds.get("secretKey") or creds["secret_key"],
+        creds.get("passphrase") or "",
+    )
+
+
+API_KEY, API_SECRET, API_PASSPHRASE = _load_credentials()
 
 # Configuración general - OPTIMIZADA para Lambda
 TIMEOUT = float(os.environ.get("BITGET_TIMEOUT", "15"))
@@ -54,6 +86,8 @@ FUTURES_MAX_PAGES = int(os.environ.get("FUTURES_MAX_PAGES", "25"))
 # PARALELIZACIÓN CONTROLADA
 MAX_CONCURRENT_FUTURES = int(os.environ.get("MAX_CONCURRENT_FUTURES", "3"))
 MAX_CONCURRENT_SPOT = int(os.environ.get("MAX_CONCURRENT_SPOT", "2"))
+# Requests en vuelo compartidos por TODAS las corrientes (spot + futures) de un símbolo
+MAX_INFLIGHT_REQUESTS = int(os.environ.get("MAX_INFLIGHT_REQUESTS", str(MAX_CONCURRENT_SPOT + MAX_CONCURRENT_FUTURES)))
 ENABLE_SMART_PAGINATION = os.environ.get("ENABLE_SMART_PAGINATION", "true").lower() == "true"
 ENABLE_CIRCUIT_BREAKER = os.environ.get("ENABLE_CIRCUIT_BREAKER", "true").lower() == "true"
 
@@ -69,17 +103,42 @@ ALL_FUTURES_V1_SUFFIXES = [
     "CMCBL",
 ]
 
+# Catálogo de contratos de futuros (evita consultar {symbol}_{suffix} inexistentes)
+CONTRACT_CATALOG_ENABLED = os.environ.get("CONTRACT_CATALOG_ENABLED", "true").lower() == "true"
+CONTRACT_CATALOG_TTL = int(os.environ.get("CONTRACT_CATALOG_TTL", str(6 * 3600)))
+CONTRACT_CATALOG_PATH = os.environ.get("CONTRACT_CATALOG_PATH", "/tmp/bitget-futures-contracts.json")
+
 # S3 Configuration for storing large results
 RESULTS_BUCKET = os.environ.get("RESULTS_BUCKET")
 RESULTS_PREFIX = os.environ.get("RESULTS_PREFIX", "per-symbol/").rstrip("/") + "/"
 AWS_REGION = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or "us-east-2"
 
-S3_THRESHOLD = int(os.environ.get("S3_THRESHOLD", "1"))
+# Resultados chicos vuelven dentro de la respuesta, sin pasar por S3. El límite es por símbolo,
+# pero el estado de Step Functions (256KB) junta las respuestas de todos: mantenerlo chico
+INLINE_RESULTS_MAX_BYTES = int(os.environ.get("INLINE_RESULTS_MAX_BYTES", "2048"))  # 0 = siempre a S3
+INLINE_RESULTS_COMPRESS = os.environ.get("INLINE_RESULTS_COMPRESS", "true").lower() == "true"
+RESULTS_CODEC = os.environ.get("RESULTS_CODEC", "gzip")          # gzip | zstd | none
+RESULTS_PART_SIZE_MB = int(os.environ.get("RESULTS_PART_SIZE_MB", "8"))
+RESULTS_FORMAT = os.environ.get("RESULTS_FORMAT", "ndjson").lower()  # ndjson | columnar | parquet | bcol
+# Las corridas de cada ventana se vuelcan aquí mientras se pagina (ver order_spool)
+SPOOL_DIR = os.environ.get("SPOOL_DIR") or None  # None = directorio temporal del sistema (/tmp en Lambda)
+# Un spool de más de INLINE_SPOOL_RATIO veces el espacio inline (NDJSON sin comprimir) ni se intenta devolver inline
+INLINE_SPOOL_RATIO = 16
+
+# Sync incremental: high-water marks por símbolo/corriente
+SYNC_MODE_DEFAULT = os.environ.get("SYNC_MODE_DEFAULT", "false").lower() == "true"
+SYNC_PREFIX = os.environ.get("SYNC_PREFIX", "sync-state/")
+SYNC_OVERLAP_MS = int(os.environ.get("SYNC_OVERLAP_MS", str(5 * 60 * 1000)))
+
+# Continuation tokens: cuántas veces puede re-invocarse el worker para el mismo símbolo
+MAX_RESUME_INVOCATIONS = int(os.environ.get("MAX_RESUME_INVOCATIONS", "5"))
 
 # S3 client (only initialize if bucket is configured)
 S3 = None
+SYNC_STORE = None
 if RESULTS_BUCKET:
     S3 = boto3.client("s3")
+    SYNC_STORE = SyncStore(S3, RESULTS_BUCKET, SYNC_PREFIX)
 
 # Circuit breaker implementation
 @dataclass
@@ -280,73 +339,77 @@ def init_timer(max_time: int = MAX_EXECUTION_TIME):
     global execution_timer
     execution_timer = ExecutionTimer(max_time)
 
-# Rate limiting
-class RateLimiter:
-    """
-    Rate limiter optimizado que respeta los límites de la API de Bitget
-    pero prioriza velocidad sobre capacidad máxima.
-    """
-    def __init__(self):
-        self.last_requests = {
-            'spot': [],
-            'futures': []
-        }
-        self.lock = Lock()
-        self.limits = {
-            'spot': 15,
-            'futures': 8
-        }
-
-    def wait_if_needed(self, api_type: str):
-        """
-        Espera si es necesario para respetar el rate limit.
-        Versión optimizada con timeouts más cortos.
-        """
-        if execution_timer:
-            execution_timer.check_timeout(f"rate limiting {api_type}")
-
-        with self.lock:
-            now = time.time()
-            limit = self.limits.get(api_type, 8)
-
-            self.last_requests[api_type] = [
-                req_time for req_time in self.last_requests[api_type]
-                if now - req_time < 1.0
-            ]
-
-            if len(self.last_requests[api_type]) >= limit:
-                oldest_in_window = min(self.last_requests[api_type])
-                wait_time = 1.0 - (now - oldest_in_window)
-                if wait_time > 0:
-                    # MÁXIMO 500ms de espera para evitar timeouts
-                    actual_wait = min(wait_time, 0.5)
-                    print(f"⏳ Rate limiting: waiting {actual_wait:.3f}s for {api_type} API")
-                    time.sleep(actual_wait)
-                    now = time.time()
-                    self.last_requests[api_type] = [
-                        req_time for req_time in self.last_requests[api_type]
-                        if now - req_time < 1.0
-                    ]
-
-            # Registrar esta request
-            self.last_requests[api_type].append(now)
-
-# Instancia global del rate limiter
-rate_limiter = RateLimiter()
-
-# HTTP session with retries
-_session = requests.Session()
-retry_cfg = Retry(
-    total=RETRIES,  # Reducido
-    connect=RETRIES,
-    read=RETRIES,
-    backoff_factor=0.3,  # Reducido de 0.6 a 0.3
-    status_forcelist=(429, 500, 502, 503, 504),
-    allowed_methods=frozenset(["GET", "POST", "DELETE"])
+# Rate limiting: token bucket por endpoint (límites de Bitget por UID)
+SPOT_HISTORY_ENDPOINT = "/api/v2/spot/trade/history-orders"
+FUTURES_HISTORY_ENDPOINT = "/api/mix/v1/order/history"
+
+SPOT_RATE_LIMIT = float(os.environ.get("SPOT_RATE_LIMIT", "10"))
+FUTURES_RATE_LIMIT = float(os.environ.get("FUTURES_RATE_LIMIT", "8"))
+
+_local_rate_limiter = EndpointRateLimiter(
+    endpoint_limits={
+        SPOT_HISTORY_ENDPOINT: EndpointLimit(
+            rate=SPOT_RATE_LIMIT,
+            burst=SPOT_RATE_LIMIT,
+            weight=float(os.environ.get("SPOT_HISTORY_WEIGHT", "1")),
+        ),
+        FUTURES_HISTORY_ENDPOINT: EndpointLimit(
+            rate=FUTURES_RATE_LIMIT,
+            burst=FUTURES_RATE_LIMIT,
+            weight=float(os.environ.get("FUTURES_HISTORY_WEIGHT", "1")),
+        ),
+    },
+    default_limits={
+        'spot': EndpointLimit(rate=SPOT_RATE_LIMIT, burst=SPOT_RATE_LIMIT),
+        'futures': EndpointLimit(rate=FUTURES_RATE_LIMIT, burst=FUTURES_RATE_LIMIT),
+    },
 )
-_adapter = HTTPAdapter(max_retries=retry_cfg)
-_session.mount("https://", _adapter)
-_session.mount("http://", _adapter)
+
+# Presupuesto compartido por toda la flota de workers (misma API key). Sin
+# SHARED_RATE_BACKEND cada worker solo se limita a sí mismo.
+SHARED_RATE_LEASE_SIZE = float(os.environ.get("SHARED_RATE_LEASE_SIZE", "2"))
+_budget_backend = budget_backend_from_env()
+if _budget_backend is not None:
+    rate_limiter = SharedRateLimiter(
+        _local_rate_limiter,
+        _budget_backend,
+        namespace=budget_namespace(API_KEY),
+        lease_size=SHARED_RATE_LEASE_SIZE,
+    )
+else:
+    rate_limiter = _local_rate_limiter
+
+# Ventanas máximas por endpoint, conocidas de antemano (antes se descubrían parseando errores)
+SPOT_MAX_WINDOW_DAYS = int(os.environ.get("SPOT_MAX_WINDOW_DAYS", "30"))
+FUTURES_MAX_WINDOW_DAYS = int(os.environ.get("FUTURES_MAX_WINDOW_DAYS", "0"))  # 0 = sin límite
+RANGE_INITIAL_SPLITS = int(os.environ.get("RANGE_INITIAL_SPLITS", "1"))
+MAX_BISECT_DEPTH = int(os.environ.get("MAX_BISECT_DEPTH", "4"))
+
+ENDPOINT_WINDOWS = {
+    SPOT_HISTORY_ENDPOINT: EndpointWindow(max_window_ms=SPOT_MAX_WINDOW_DAYS * DAY_MS or None),
+    FUTURES_HISTORY_ENDPOINT: EndpointWindow(max_window_ms=FUTURES_MAX_WINDOW_DAYS * DAY_MS or None),
+}
+
+async def _on_throttled(path: str, retry_after: float):
+    """429 de Bitget: vaciar el bucket del endpoint y esperar turno antes de reintentar."""
+    print(f"⏳ Throttled by Bitget on {path}, backing off {retry_after:.3f}s")
+    rate_limiter.penalize(path, retry_after)
+    await rate_limiter.acquire_async(path)
+
+# Motor asíncrono compartido: se crea una vez por contenedor y se reutiliza en invocaciones warm
+_engine: Optional[AsyncEngine] = None
+
+def get_engine() -> AsyncEngine:
+    global _engine
+    if _engine is None:
+        _engine = AsyncEngine(
+            timeout=TIMEOUT,
+            retries=RETRIES,
+            backoff_factor=0.3,
+            max_inflight=MAX_INFLIGHT_REQUESTS,
+            on_throttle=_on_throttled,
+        )
+    return _engine
 
 # S3 helpers
 def _generate_s3_key(symbol: str, suffix: str = "json") -> str:
@@ -355,28 +418,61 @@ def _generate_s3_key(symbol: str, suffix: str = "json") -> str:
     timestamp = now.strftime('%Y%m%d-%H%M%S')
     return f"{RESULTS_PREFIX}{symbol}/{timestamp}.{suffix}"
 
-def _store_orders_in_s3(symbol: str, orders: List[Dict[str, Any]]) -> Dict[str, str]:
+def _store_orders_in_s3(symbol: str, orders: Iterable[Dict[str, Any]]) -> Dict[str, str]:
     """
-    Store orders in S3 and return metadata
+    Store orders in S3 as compressed NDJSON (streamed, multipart above RESULTS_PART_SIZE_MB),
+    or in the columnar format when RESULTS_FORMAT is not "ndjson"
+    An OrderSpool is written as it is merged, without building the list
     Returns dict with s3_key, s3_uri, and public_url
     """
     if not S3 or not RESULTS_BUCKET:
         raise RuntimeError("S3 not configured but needed for large result storage")
 
-    s3_key = _generate_s3_key(symbol)
+    # Corrida ordenada por cTime DESC: el aggregator la fusiona sin volver a ordenar
+    if not isinstance(orders, OrderSpool):
+        orders = sorted(orders, key=order_ctime, reverse=True)
+    summary = empty_summary()
 
-    payload = {
-        "symbol": symbol,
-        "orders": orders,
-        "count": len(orders),
+    def summarized(items: Iterable[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+        for order in items:
+            add_order(summary, order)
+            yield order
+
+    metadata = {
+        "symbol": str(symbol),
         "stored_at": datetime.now(timezone.utc).isoformat(),
+        RUN_SORT_METADATA: RUN_SORT_CTIME_DESC,
     }
-
+    if RESULTS_FORMAT != "ndjson":
+        fmt = resolve_format("auto" if RESULTS_FORMAT == "columnar" else RESULTS_FORMAT)
+        s3_key = _generate_s3_key(symbol, FORMAT_SUFFIX[fmt])
+        stats = put_orders(S3, RESULTS_BUCKET, s3_key, summarized(orders), metadata=metadata)
+        print(f"Stored {stats['count']} orders in {stats['bytes']} bytes ({fmt})")
+    else:
+        codec = resolve_codec(RESULTS_CODEC)
+        s3_key = _generate_s3_key(symbol, CODEC_SUFFIX[codec])
+
+        with S3NdjsonWriter(
+            S3,
+            RESULTS_BUCKET,
+            s3_key,
+            codec=codec,
+            part_size=RESULTS_PART_SIZE_MB * 1024 * 1024,
+            metadata=metadata,
+        ) as writer:
+            writer.write_many(summarized(orders))
+
+        stats = writer.stats
+        ratio = stats["raw_bytes"] / stats["bytes"] if stats["bytes"] else 0
+        print(f"Stored {stats['count']} orders in {stats['bytes']} bytes "
+              f"({codec}, {stats['parts']} part(s), {ratio:.1f}x)")
+
+    # Sidecar con los conteos: el aggregator puede resumir (o componer) sin descargar los datos
     S3.put_object(
         Bucket=RESULTS_BUCKET,
-        Key=s3_key,
-        Body=json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8"),
-        ContentType="application/json; charset=utf-8",
+        Key=sidecar_key(s3_key),
+        Body=json.dumps(build_sidecar(symbol, s3_key, rounded(summary), stats)).encode("utf-8"),
+        ContentType="application/json",
     )
 
     return {
@@ -385,6 +481,22 @@ def _store_orders_in_s3(symbol: str, orders: List[Dict[str, Any]]) -> Dict[str,
         "public_url": f"https://{RESULTS_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{s3_key}"
     }
 
+def _iter_previous_orders(s3_key: str) -> Iterable[Dict[str, Any]]:
+    """Órdenes guardadas por la invocación anterior del mismo símbolo (continuation), leídas en streaming."""
+    obj = S3.get_object(Bucket=RESULTS_BUCKET, Key=s3_key)
+    if is_columnar_key(s3_key):
+        return decode_orders(obj["Body"], s3_key)
+    return iter_orders(obj["Body"], s3_key)
+
+def _delete_previous_orders(s3_key: Optional[str], current_key: Optional[str]):
+    if not s3_key or s3_key == current_key:
+        return
+    try:
+        S3.delete_object(Bucket=RESULTS_BUCKET, Key=s3_key)
+        S3.delete_object(Bucket=RESULTS_BUCKET, Key=sidecar_key(s3_key))
+    except Exception as e:
+        print(f"Failed to delete previous partial file {s3_key}: {str(e)}")
+
 def _ts_ms_local() -> str:
     return str(int(time.time() * 1000))
 
@@ -449,16 +561,16 @@ def _parse_bitget_error(error_text: str, symbol: str) -> str:
     except Exception:
         return f"Bitget API error for symbol '{symbol}'"
 
-def _bitget_get(path: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
+async def _bitget_get(path: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
     # Verificar timeout antes de hacer request
     if execution_timer:
         execution_timer.check_timeout(f"making request to {path}")
 
     # Determinar tipo de API basado en el path
-    api_type = 'spot' if '/spot/' in path else 'futures'
+    api_type = rate_limiter.api_type(path)
 
-    # Aplicar rate limiting
-    rate_limiter.wait_if_needed(api_type)
+    # Aplicar rate limiting (presupuesto compartido por todas las corrientes)
+    await rate_limiter.acquire_async(path)
 
     # MEDIR TIEMPO DE RESPUESTA PARA ADAPTIVE SIZING
     request_start_time = time.time()
@@ -468,20 +580,18 @@ def _bitget_get(path: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
     sig = _sign("GET", path, qs, "", ts)
     url = f"{BITGET_BASE}{path}" + (("?" + qs) if qs else "")
 
-    resp = _session.get(url, headers=_headers(ts, sig), timeout=TIMEOUT)
+    resp = await get_engine().get(url, headers=_headers(ts, sig))
     text = resp.text
 
     # Registrar tiempo de respuesta
     response_time = time.time() - request_start_time
 
-    try:
-        resp.raise_for_status()
-    except requests.HTTPError as http_err:
+    if resp.is_error:
         try:
             j = resp.json()
-            raise RuntimeError(f"HTTP {resp.status_code} Bitget: {j}") from http_err
         except Exception:
-            raise RuntimeError(f"HTTP {resp.status_code} Bitget (raw): {text}") from http_err
+            raise RuntimeError(f"HTTP {resp.status_code} Bitget (raw): {text}")
+        raise RuntimeError(f"HTTP {resp.status_code} Bitget: {j}")
 
     try:
         data = resp.json()
@@ -591,113 +701,36 @@ def _coerce_ms(x: Any) -> Optional[int]:
         return None
 
 # Spot handling
-def spot_history_orders(
-    symbol: str,
-    start_ms: Optional[int] = None,
-    end_ms: Optional[int] = None,
-    limit: int = PAGE_LIMIT,
-    max_pages: int = SPOT_MAX_PAGES,
-) -> List[Dict[str, Any]]:
+def _default_spot_window(start_ms: Optional[int], end_ms: Optional[int]) -> Tuple[int, int]:
     """
-    Versión OPTIMIZADA para Lambda
+    VENTANA REDUCIDA para velocidad: 30 días si no se especifica rango.
     """
-    # Omitir spot si el símbolo tiene guion bajo
-    if "_" in str(symbol):
-        print(f"Skipping spot retrieval for underscored symbol: {symbol}")
-        return []
-
-    all_results: List[Dict[str, Any]] = []
-
-    # VENTANA REDUCIDA para velocidad: 30 días
     if start_ms is None and end_ms is None:
         now_ms = int(time.time() * 1000)
-        thirty_days_ms = 30 * 24 * 60 * 60 * 1000
+        thirty_days_ms = 30 * DAY_MS
         start_ms = now_ms - thirty_days_ms
         end_ms = now_ms
         print(f"Auto-setting 30-day window for speed: {start_ms} to {end_ms}")
+    if end_ms is None:
+        end_ms = int(time.time() * 1000)
+    if start_ms is None:
+        start_ms = end_ms - 30 * DAY_MS
+    return start_ms, end_ms
 
-    return _get_spot_orders_chunk(symbol, start_ms, end_ms, limit, max_pages)
-
-def _get_spot_orders_chunk(
-    symbol: str,
-    start_ms: Optional[int],
-    end_ms: Optional[int],
-    limit: int,
-    max_pages: int
-) -> List[Dict[str, Any]]:
-    """
-    OPTIMIZADO: Paralelización inteligente para NORMAL y TPSL con circuit breaker
-    """
-    # Verificar circuit breaker
-    if not circuit_breaker.can_execute(symbol):
-        print(f"Circuit breaker OPEN for {symbol}, skipping spot orders")
-        return []
-
-    all_orders = []
-
-    # Verificar tiempo restante
-    if execution_timer and execution_timer.remaining_time() < 10:
-        print(f"Less than 10s remaining, skipping spot orders to avoid timeout")
-        return []
-
-    # PARALELIZACIÓN CONTROLADA para NORMAL y TPSL
-    tasks = []
-    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SPOT) as executor:
-        # TASK 1: NORMAL orders
-        future_normal = executor.submit(
-            _get_spot_orders_by_type_with_circuit_breaker,
-            symbol, "normal", start_ms, end_ms, limit, max_pages
-        )
-        tasks.append(("normal", future_normal))
-
-        # TASK 2: TPSL orders
-        if execution_timer and execution_timer.remaining_time() > 15:
-            future_tpsl = executor.submit(
-                _get_spot_orders_by_type_with_circuit_breaker,
-                symbol, "tpsl", start_ms, end_ms, limit, min(max_pages//2, 10)
-            )
-            tasks.append(("tpsl", future_tpsl))
-        else:
-            print(f"Skipping TPSL")
-
-        # Recopilar resultados conforme van completándose
-        for task_type, future in tasks:
-            try:
-                if execution_timer and execution_timer.remaining_time() < 3:
-                    print(f"Cancelling remaining tasks")
-                    future.cancel()
-                    continue
-
-                timeout = min(10, execution_timer.remaining_time() - 2) if execution_timer else 10
-                orders = future.result(timeout=timeout)
-
-                for order in orders:
-                    order["_tpsl_type"] = task_type
-                all_orders.extend(orders)
-                print(f"Retrieved {len(orders)} {task_type} spot orders concurrently")
-
-                # Registrar éxito en circuit breaker
-                circuit_breaker.record_success(f"{symbol}_{task_type}")
-
-            except Exception as e:
-                error_str = str(e)
-                print(f"Failed to get {task_type} orders: {error_str}")
-
-                # Registrar falla en circuit breaker
-                circuit_breaker.record_failure(f"{symbol}_{task_type}", error_str)
-
-    total = len(all_orders)
-    print(f"Total spot orders for {symbol}: {total}")
-    return all_orders
+def _has_time_to_split() -> bool:
+    """Bisectar solo si queda tiempo para pedir las nuevas sub-ventanas."""
+    return not execution_timer or execution_timer.remaining_time() > 5
 
-def _get_spot_orders_by_type_with_circuit_breaker(
+async def _get_spot_orders_by_type_with_circuit_breaker(
     symbol: str,
     tpsl_type: str,
-    start_ms: Optional[int],
-    end_ms: Optional[int],
+    start_ms: int,
+    end_ms: int,
     limit: int,
-    max_pages: int
-) -> List[Dict[str, Any]]:
+    max_pages: int,
+    resume: Optional[List[Dict[str, Any]]] = None,
+    sink: Optional[RunSink] = None
+) -> RangeResult:
     """
     Wrapper con circuit breaker para _get_spot_orders_by_type
     """
@@ -705,113 +738,82 @@ def _get_spot_orders_by_type_with_circuit_breaker(
 
     if not circuit_breaker.can_execute(symbol_key):
         print(f"🔴 Circuit breaker prevents execution for {symbol_key}")
-        return []
+        return RangeResult(orders=[])
 
     try:
-        return _get_spot_orders_by_type(symbol, tpsl_type, start_ms, end_ms, limit, max_pages)
+        return await _get_spot_orders_by_type(symbol, tpsl_type, start_ms, end_ms, limit, max_pages, resume, sink)
     except Exception as e:
         circuit_breaker.record_failure(symbol_key, str(e))
         raise
 
-def _get_spot_orders_by_type(
+async def _get_spot_orders_by_type(
     symbol: str,
     tpsl_type: str,
-    start_ms: Optional[int],
-    end_ms: Optional[int],
-    limit: int,
-    max_pages: int
-) -> List[Dict[str, Any]]:
-    """
-    OPTIMIZADO: Intenta ventana completa, fallback más rápido a 30 días.
-    """
-    try:
-        return _get_spot_orders_by_type_single_chunk(symbol, tpsl_type, start_ms, end_ms, limit, max_pages)
-    except Exception as e:
-        error_str = str(e)
-
-        if "cannot be greater than 30 days" in error_str:
-            print(f"30-day limit detected, using 30-day window")
-            return _get_spot_orders_with_chunking(symbol, tpsl_type, start_ms, end_ms, 30, limit, max_pages)
-        elif "cannot be greater than 90 days" in error_str:
-            print(f"90-day limit detected, using 30-day window for speed")
-            return _get_spot_orders_with_chunking(symbol, tpsl_type, start_ms, end_ms, 30, limit, max_pages)
-        else:
-            print(f"Error for {tpsl_type} orders: {error_str}")
-            raise
-
-def _get_spot_orders_with_chunking(
-    symbol: str,
-    tpsl_type: str,
-    start_ms: Optional[int],
-    end_ms: Optional[int],
-    max_days: int,
+    start_ms: int,
+    end_ms: int,
     limit: int,
-    max_pages: int
-) -> List[Dict[str, Any]]:
+    max_pages: int,
+    resume: Optional[List[Dict[str, Any]]] = None,
+    sink: Optional[RunSink] = None
+) -> RangeResult:
     """
-    OPTIMIZADO: Chunking con límites más agresivos
+    Divide el rango en ventanas de SPOT_MAX_WINDOW_DAYS pedidas en paralelo;
+    `max_pages` es el presupuesto por ventana y las ventanas densas se bisectan.
+    Con `resume` solo se retoman los tramos pendientes de una invocación anterior;
+    con `sink`, cada ventana se le entrega al terminar (ver fetch_range).
     """
-    if not start_ms or not end_ms:
-        now_ms = int(time.time() * 1000)
-        max_days_ms = max_days * 24 * 60 * 60 * 1000
-        start_ms = now_ms - max_days_ms
-        end_ms = now_ms
-        return _get_spot_orders_by_type_single_chunk(symbol, tpsl_type, start_ms, end_ms, limit, max_pages)
-
-    # MÁXIMO 2 chunks para evitar timeout
-    total_range_ms = end_ms - start_ms
-    max_days_ms = max_days * 24 * 60 * 60 * 1000
-    num_chunks = min(2, (total_range_ms + max_days_ms - 1) // max_days_ms)
-
-    print(f"🔄 Processing max {num_chunks} chunks for {tpsl_type}")
-
-    all_results = []
-    current_start = start_ms
-    chunk_num = 1
-
-    while current_start < end_ms and chunk_num <= num_chunks:
-        # Verificar timeout
-        if execution_timer and execution_timer.remaining_time() < 5:
-            print(f"⏰ Stopping chunking due to time constraint")
-            break
-
-        chunk_end = min(current_start + max_days_ms, end_ms)
-        print(f"Chunk {chunk_num}/{num_chunks}: {current_start} to {chunk_end}")
-
-        chunk_results = _get_spot_orders_by_type_single_chunk(
-            symbol, tpsl_type, current_start, chunk_end, limit, max_pages//num_chunks
-        )
-        all_results.extend(chunk_results)
-
-        current_start = chunk_end
-        chunk_num += 1
-
-    return all_results
+    result = await fetch_range(
+        lambda lower, upper, budget, cursor: _get_spot_orders_by_type_single_chunk(
+            symbol, tpsl_type, lower, upper, limit, budget, cursor
+        ),
+        start_ms,
+        end_ms,
+        ENDPOINT_WINDOWS[SPOT_HISTORY_ENDPOINT],
+        page_budget=max_pages,
+        max_depth=MAX_BISECT_DEPTH,
+        splits=RANGE_INITIAL_SPLITS,
+        can_split=_has_time_to_split,
+        resume=resume,
+        sink=sink,
+    )
+    print(f"{symbol} {tpsl_type}: {len(result.orders) if sink is None else 'streamed'} orders from {result.windows_fetched} windows"
+          + (f" ({len(result.truncated)} incomplete)" if result.truncated else ""))
+    return result
 
-def _get_spot_orders_by_type_single_chunk(
+async def _get_spot_orders_by_type_single_chunk(
     symbol: str,
     tpsl_type: str,
     start_ms: Optional[int],
     end_ms: Optional[int],
     limit: int,
-    max_pages: int
-) -> List[Dict[str, Any]]:
+    max_pages: int,
+    cursor: Optional[Dict[str, Any]] = None
+) -> PageRun:
     """
-    OPTIMIZADO: Paginación inteligente con adaptive sizing y smart pagination
+    OPTIMIZADO: Paginación inteligente con adaptive sizing y smart pagination.
+    Retorna exhausted=True si quedan datos sin traer en [start_ms, resume_end_ms],
+    con el idLessThan alcanzado como cursor.
     """
     results: List[Dict[str, Any]] = []
-    id_less_than: Optional[str] = None
+    id_less_than: Optional[str] = (cursor or {}).get("idLessThan")
     pages = 0
     current_end_time = end_ms
+    exhausted = False
+    error: Optional[str] = None
 
     # ADAPTIVE PAGE SIZING
     current_limit = adaptive_sizer.get_optimal_page_size(symbol, f"spot_{tpsl_type}")
-    print(f"Using adaptive page size {current_limit} for {symbol} {tpsl_type}")
 
-    while pages < max_pages:
+    while True:
+        if pages >= max_pages:
+            exhausted = True
+            break
+
         # VERIFICAR TIMEOUT en cada página
         if execution_timer and execution_timer.remaining_time() < 3:
             print(f"Stopping pagination due to time constraint at page {pages}")
+            exhausted = True
+            error = "time constraint"
             break
 
         params = {
@@ -825,7 +827,7 @@ def _get_spot_orders_by_type_single_chunk(
         }
 
         try:
-            data = _bitget_get("/api/v2/spot/trade/history-orders", params)
+            data = await _bitget_get(SPOT_HISTORY_ENDPOINT, params)
             page = data.get("data") or []
 
             if not isinstance(page, list) or not page:
@@ -873,53 +875,64 @@ def _get_spot_orders_by_type_single_chunk(
             if len(page) < current_limit * 0.8:  # Si no hay suficientes resultados, probablemente no hay más
                 break
 
+        except TimeoutException:
+            raise
         except Exception as e:
             error_str = str(e)
-            if "cannot be greater than 30 days" in error_str or "cannot be greater than 90 days" in error_str:
+            if "cannot be greater than" in error_str:
+                # El plan de ventanas debería evitarlo: SPOT_MAX_WINDOW_DAYS mal configurado
                 raise
             print(f"Error in pagination: {error_str}")
+            exhausted = True
+            error = error_str
             break
 
-    try:
-        results.sort(key=lambda x: int(x.get("cTime", 0)), reverse=True)
-    except (ValueError, TypeError):
-        pass
-
-    print(f"{symbol} {tpsl_type}: {len(results)} orders in {pages} pages (avg: {len(results)/max(pages,1):.1f} per page)")
-    return results
+    return PageRun(
+        orders=results,
+        exhausted=exhausted,
+        resume_end_ms=current_end_time,
+        error=error,
+        cursor={"idLessThan": id_less_than} if exhausted and id_less_than else None,
+    )
 
 # Futures handling
-def futures_history_orders_v1(
-    symbol_with_suffix: str,
-    start_ms: Optional[int] = None,
-    end_ms: Optional[int] = None,
-    limit: int = 1000,
-    max_pages: int = FUTURES_MAX_PAGES,
-) -> List[Dict[str, Any]]:
+def _resume_end_from(orders: List[Dict[str, Any]], end_ms: int) -> int:
+    earliest_ctime, _ = _extract_ctime_range(orders)
+    return earliest_ctime - 1 if earliest_ctime else end_ms
+
+async def _futures_page_run(
+    symbol_v1: str,
+    start_ms: int,
+    end_ms: int,
+    limit: int,
+    max_pages: int,
+    cursor: Optional[Dict[str, Any]] = None,
+) -> PageRun:
     """
-    Versión OPTIMIZADA con timeout checking
+    Pagina una ventana de /api/mix/v1/order/history con lastEndId, como máximo `max_pages` páginas.
     """
-    # Verificar tiempo restante
-    if execution_timer and execution_timer.remaining_time() < 5:
-        print(f"Skipping {symbol_with_suffix}")
-        return []
-
-    symbol_v1 = str(symbol_with_suffix).upper()
     results: List[Dict[str, Any]] = []
-
-    if end_ms is None:
-        end_ms = int(time.time() * 1000)
-    if start_ms is None:
-        start_ms = 0
-
-    end_id = ""
+    end_id = (cursor or {}).get("lastEndId", "")
     count = 0
+    pages = 0
     limit_attempts = 10
 
+    def pending(error: Optional[str] = None) -> PageRun:
+        return PageRun(
+            results,
+            exhausted=True,
+            resume_end_ms=_resume_end_from(results, end_ms),
+            error=error,
+            cursor={"lastEndId": end_id} if end_id else None,
+        )
+
     while True:
+        if pages >= max_pages:
+            return pending()
+
         if execution_timer and execution_timer.remaining_time() < 2:
             print(f"Stopping futures query for {symbol_v1} due to time constraint")
-            break
+            return pending("time constraint")
 
         try:
             params = {
@@ -932,14 +945,14 @@ def futures_history_orders_v1(
             if end_id:
                 params["lastEndId"] = end_id
 
-            rate_limiter.wait_if_needed('futures')
-            data = _bitget_get("/api/mix/v1/order/history", params)
+            data = await _bitget_get(FUTURES_HISTORY_ENDPOINT, params)
 
             if data.get('data') is not None:
                 orders_data = data['data']
 
                 if orders_data.get('orderList') is not None:
                     page = orders_data['orderList']
+                    pages += 1
 
                     for order in page:
                         if isinstance(order, dict):
@@ -966,192 +979,440 @@ def futures_history_orders_v1(
                     count += 1
                     if count > limit_attempts:
                         raise RuntimeError(f"Max retry attempts reached for {symbol_v1}")
-                    time.sleep(0.2)  # REDUCIDO de 0.33 a 0.2
+                    await asyncio.sleep(0.2)  # REDUCIDO de 0.33 a 0.2
                     continue
                 else:
                     raise RuntimeError(f"Bitget error {error_code}: {data.get('msg', 'Unknown error')}")
 
+        except TimeoutException:
+            raise
         except Exception as e:
+            if "40034" in str(e):
+                # Contrato inexistente (catálogo desactualizado o no disponible): no reintentar
+                print(f"Symbol {symbol_v1} does not exist")
+                break
             count += 1
             if count > limit_attempts:
                 raise RuntimeError(f"Max retry attempts reached for {symbol_v1}: {str(e)}")
 
             print(f"Retrying {symbol_v1}, attempt {count}: {str(e)}")
-            time.sleep(0.2)  # REDUCIDO
+            await asyncio.sleep(0.2)  # REDUCIDO
             continue
 
-    return results
+    return PageRun(results)
 
-def futures_get_orders_for_symbol(
-    symbol: str,
+async def futures_history_orders_v1(
+    symbol_with_suffix: str,
     start_ms: Optional[int] = None,
     end_ms: Optional[int] = None,
-    favorite_symbols: List[str] = None,
     limit: int = 1000,
     max_pages: int = FUTURES_MAX_PAGES,
-) -> List[Dict[str, Any]]:
+    resume: Optional[List[Dict[str, Any]]] = None,
+    sink: Optional[RunSink] = None,
+) -> RangeResult:
     """
-    SUPER OPTIMIZADO: Paralelización masiva de futures con circuit breaker y batching inteligente
+    Versión OPTIMIZADA con timeout checking; `max_pages` es el presupuesto por
+    ventana y las ventanas que lo agotan se bisectan en paralelo.
     """
-    if not symbol:
-        return []
-
-    # Verificar tiempo restante antes de empezar
-    if execution_timer and execution_timer.remaining_time() < 10:
-        print(f"⏰ Insufficient time remaining for futures processing: {execution_timer.remaining_time():.1f}s")
-        return []
+    symbol_v1 = str(symbol_with_suffix).upper()
 
     if end_ms is None:
         end_ms = int(time.time() * 1000)
     if start_ms is None:
         start_ms = 0
 
-    base_symbol = str(symbol).upper()
-    all_orders: List[Dict[str, Any]] = []
-
-    # Generar símbolos con sufijos
-    symbols_to_query = []
-    for suffix in ALL_FUTURES_V1_SUFFIXES:
-        symbol_with_suffix = f"{base_symbol}_{suffix}"
-
-        # Aplicar circuit breaker a nivel de símbolo
-        if circuit_breaker.can_execute(symbol_with_suffix):
-            symbols_to_query.append(symbol_with_suffix)
-        else:
-            print(f"Circuit breaker prevents {symbol_with_suffix}")
-
-    # Filtrar por símbolos favoritos si se proporcionan
-    if favorite_symbols:
-        filtered_symbols = []
-        for fav in favorite_symbols:
-            fav_upper = fav.upper()
-            for symbol_suffix in symbols_to_query:
-                if fav_upper in symbol_suffix:
-                    filtered_symbols.append(symbol_suffix)
-        symbols_to_query = filtered_symbols
-
-    symbols_count = len(symbols_to_query)
-    print(f"Processing {symbols_count} futures symbols for {base_symbol} (parallel)")
-
-    if symbols_count == 0:
-        return []
-
-    # PARALELIZACIÓN MASIVA CON BATCHING INTELIGENTE
-    batch_size = min(MAX_CONCURRENT_FUTURES, symbols_count)
-    batches = [symbols_to_query[i:i + batch_size] for i in range(0, symbols_count, batch_size)]
-
-    print(f"Processing {len(batches)} batches of max {batch_size} symbols each")
-
-    for batch_idx, batch_symbols in enumerate(batches):
-        # Verificar tiempo restante para este batch
-        if execution_timer:
-            remaining = execution_timer.remaining_time()
-            if remaining < 5:
-                print(f"⏰ Stopping futures processing at batch {batch_idx+1}/{len(batches)} due to time constraint")
-                break
-            print(f"� Processing batch {batch_idx+1}/{len(batches)} with {len(batch_symbols)} symbols ({remaining:.1f}s remaining)")
-
-        # Procesar batch en paralelo
-        batch_orders = _process_futures_batch_parallel(
-            batch_symbols, start_ms, end_ms, limit, max_pages, base_symbol
+    # Verificar tiempo restante
+    if execution_timer and execution_timer.remaining_time() < 5:
+        print(f"Skipping {symbol_with_suffix}")
+        return RangeResult(
+            orders=[],
+            truncated=resume or [{"start_ms": start_ms, "end_ms": end_ms, "reason": "time constraint"}],
         )
-        all_orders.extend(batch_orders)
 
-        # Early exit si ya no hay tiempo
-        if execution_timer and execution_timer.remaining_time() < 3:
-            print(f"⏰ Early exit from futures processing due to time constraints")
-            break
+    return await fetch_range(
+        lambda lower, upper, budget, cursor: _futures_page_run(symbol_v1, lower, upper, limit, budget, cursor),
+        start_ms,
+        end_ms,
+        ENDPOINT_WINDOWS[FUTURES_HISTORY_ENDPOINT],
+        page_budget=max_pages,
+        max_depth=MAX_BISECT_DEPTH,
+        splits=RANGE_INITIAL_SPLITS,
+        can_split=_has_time_to_split,
+        resume=resume,
+        sink=sink,
+    )
 
-    print(f"Total futures orders for {base_symbol}: {len(all_orders)}")
-    return all_orders
+async def _fetch_contracts(product_type: str) -> List[str]:
+    data = await _bitget_get(CONTRACTS_ENDPOINT, {"productType": product_type})
+    return [c["symbol"] for c in data.get("data") or [] if isinstance(c, dict) and c.get("symbol")]
 
-def _process_futures_batch_parallel(
-    batch_symbols: List[str],
-    start_ms: Optional[int],
-    end_ms: Optional[int],
-    limit: int,
-    max_pages: int,
-    base_symbol: str
-) -> List[Dict[str, Any]]:
+# Cargado una vez por contenedor; persistido en /tmp para los cold starts
+contract_catalog = ContractCatalog(
+    _fetch_contracts,
+    product_types=ALL_FUTURES_V1_SUFFIXES,
+    ttl_seconds=CONTRACT_CATALOG_TTL,
+    cache_path=CONTRACT_CATALOG_PATH or None,
+)
+
+async def _futures_contracts_for(symbol: str) -> List[str]:
     """
-    Procesa un batch de símbolos de futures en paralelo
+    Expande el símbolo base a sus contratos v1 ({symbol}_UMCBL, ...) que existen según
+    el catálogo, respetando el circuit breaker.
     """
-    all_orders = []
-
-    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_FUTURES, len(batch_symbols))) as executor:
-        # Enviar todas las tareas del batch
-        future_to_symbol = {}
-        for symbol_with_suffix in batch_symbols:
-            future = executor.submit(
-                _get_futures_orders_with_circuit_breaker,
-                symbol_with_suffix, start_ms, end_ms, limit, max_pages, base_symbol
-            )
-            future_to_symbol[future] = symbol_with_suffix
-
-        # Recopilar resultados conforme van completándose
-        for future in as_completed(future_to_symbol, timeout=30):
-            symbol_with_suffix = future_to_symbol[future]
-
-            try:
-                # Timeout dinámico basado en tiempo restante
-                timeout = min(15, execution_timer.remaining_time() - 2) if execution_timer else 15
-                orders = future.result(timeout=timeout)
-
-                all_orders.extend(orders)
-                print(f"Retrieved {len(orders)} orders from {symbol_with_suffix} (parallel)")
-
-                # Registrar éxito en circuit breaker
-                circuit_breaker.record_success(symbol_with_suffix)
-
-            except Exception as e:
-                error_msg = _parse_bitget_error(str(e), symbol_with_suffix)
-                print(f"Error getting {symbol_with_suffix} (parallel): {error_msg}")
+    base_symbol = str(symbol).upper()
+    candidates = [f"{base_symbol}_{suffix}" for suffix in ALL_FUTURES_V1_SUFFIXES]
+    if CONTRACT_CATALOG_ENABLED:
+        existing = await contract_catalog.filter_existing(candidates)
+        skipped = [c for c in candidates if c not in existing]
+        if skipped:
+            print(f"Contract catalog: skipping non-existent {', '.join(skipped)}")
+        candidates = existing
 
-                # Registrar falla en circuit breaker
-                circuit_breaker.record_failure(symbol_with_suffix, str(e))
-                continue
+    contracts = []
+    for symbol_with_suffix in candidates:
 
-    return all_orders
+        # Aplicar circuit breaker a nivel de símbolo
+        if circuit_breaker.can_execute(symbol_with_suffix):
+            contracts.append(symbol_with_suffix)
+        else:
+            print(f"Circuit breaker prevents {symbol_with_suffix}")
+    return contracts
 
-def _get_futures_orders_with_circuit_breaker(
+async def _get_futures_orders_with_circuit_breaker(
     symbol_with_suffix: str,
     start_ms: Optional[int],
     end_ms: Optional[int],
     limit: int,
     max_pages: int,
-    base_symbol: str
-) -> List[Dict[str, Any]]:
+    resume: Optional[List[Dict[str, Any]]] = None,
+    sink: Optional[RunSink] = None
+) -> RangeResult:
     """
     Wrapper con circuit breaker para futures_history_orders_v1
     """
     if not circuit_breaker.can_execute(symbol_with_suffix):
         print(f"🔴 Circuit breaker prevents execution for {symbol_with_suffix}")
-        return []
+        return RangeResult(orders=[])
 
     try:
-        orders = futures_history_orders_v1(
+        result = await futures_history_orders_v1(
             symbol_with_suffix=symbol_with_suffix,
             start_ms=start_ms,
             end_ms=end_ms,
             limit=limit,
-            max_pages=max_pages
+            max_pages=max_pages,
+            resume=resume,
+            sink=sink
         )
-
-        # Agregar metadatos
-        for order in orders:
-            if isinstance(order, dict):
-                order["_symbol"] = base_symbol
-                order["_market"] = "futures_history"
-                order["_contractType"] = symbol_with_suffix.split("_")[-1]
-                order["_endpoint"] = "/api/mix/v1/order/history"
-                order["category"] = "Future"
-
-        return orders
+        return result
 
     except Exception as e:
         circuit_breaker.record_failure(symbol_with_suffix, str(e))
         raise
 
+# Symbol engine: todas las corrientes como tareas concurrentes
+@dataclass
+class SymbolOrders:
+    orders: List[Dict[str, Any]]
+    incomplete: Dict[str, List[Dict[str, Any]]]   # corriente -> tramos sin completar (con cursor)
+    watermarks: Dict[str, Dict[str, Any]]         # corriente completa -> high-water mark
+    stream_ends: Dict[str, int]                   # corriente -> end_ms pedido
+
+    def pending_streams(self) -> Dict[str, Dict[str, Any]]:
+        """Tramos pendientes por corriente, en el formato que acepta `resume`."""
+        return {
+            name: {"end_ms": self.stream_ends.get(name), "windows": windows}
+            for name, windows in self.incomplete.items()
+        }
+
+def _stream_coroutine(
+    symbol: str,
+    name: str,
+    start_ms: int,
+    end_ms: int,
+    resume: Optional[List[Dict[str, Any]]] = None,
+    sink: Optional[RunSink] = None,
+) -> Awaitable[RangeResult]:
+    """Construye la corriente a partir de su nombre: 'spot:<tpslType>' o 'futures:<contrato>'."""
+    market, stream_id = name.split(":", 1)
+    if market == "spot":
+        max_pages = SPOT_MAX_PAGES if stream_id == "normal" else min(SPOT_MAX_PAGES // 2, 10)
+        return _get_spot_orders_by_type_with_circuit_breaker(
+            symbol, stream_id, start_ms, end_ms, PAGE_LIMIT, max_pages, resume, sink
+        )
+    return _get_futures_orders_with_circuit_breaker(
+        stream_id, start_ms, end_ms, 1000, FUTURES_MAX_PAGES, resume, sink
+    )
+
+def _tag_stream_orders(symbol: str, name: str, orders: List[Dict[str, Any]]) -> None:
+    """Metadatos de origen (_symbol, _market, ...) según la corriente."""
+    market, stream_id = name.split(":", 1)
+    for o in orders:
+        if not isinstance(o, dict):
+            continue
+        if market == "spot":
+            o["_tpsl_type"] = stream_id
+            o["_symbol"] = symbol
+            o["_market"] = "spot_history"
+            o["_endpoint"] = SPOT_HISTORY_ENDPOINT
+        else:
+            o["_symbol"] = str(symbol).upper()
+            o["_market"] = "futures_history"
+            o["_contractType"] = stream_id.split("_")[-1]
+            o["_endpoint"] = FUTURES_HISTORY_ENDPOINT
+            o["category"] = "Future"
+
+async def collect_symbol_orders(
+    symbol: str,
+    start_ms: Optional[int],
+    end_ms: Optional[int],
+    include_spot: bool = True,
+    include_futures: bool = True,
+    stream_starts: Optional[Dict[str, int]] = None,
+    resume: Optional[Dict[str, Dict[str, Any]]] = None,
+    spool: Optional[OrderSpool] = None,
+) -> SymbolOrders:
+    """
+    Lanza spot normal, spot tpsl y cada contrato de futuros como tareas del mismo
+    event loop, bajo el mismo rate limiter y el mismo pool HTTP. El tiempo total
+    del símbolo es el de la corriente más lenta, no la suma de todas.
+
+    `stream_starts` sobreescribe start_ms por corriente (sync incremental).
+    `resume` ({corriente: {"end_ms", "windows"}}, ver SymbolOrders.pending_streams)
+    retoma solo los tramos pendientes de una invocación anterior.
+    Con `spool`, cada ventana se vuelca ahí apenas termina y `orders` queda vacío:
+    la memoria no crece con el historial del símbolo.
+    """
+    stream_starts = stream_starts or {}
+    streams: Dict[str, Awaitable[RangeResult]] = {}
+    stream_ranges: Dict[str, Tuple[int, int]] = {}
+    incomplete: Dict[str, List[Dict[str, Any]]] = {}
+    streamed: Dict[str, int] = defaultdict(int)            # corriente -> órdenes volcadas al spool
+    latest: Dict[str, Dict[str, Any]] = {}                 # corriente -> orden más reciente (high-water mark)
+
+    def sink_for(name: str) -> Optional[RunSink]:
+        if spool is None:
+            return None
+
+        def sink(orders: List[Dict[str, Any]]) -> None:
+            _tag_stream_orders(symbol, name, orders)
+            for o in orders:
+                if isinstance(o, dict) and (name not in latest or order_ctime(o) > order_ctime(latest[name])):
+                    latest[name] = o
+            streamed[name] += spool.add_run(orders)
+        return sink
+
+    def skip(name: str, lower: int, upper: int, reason: str):
+        stream_ranges[name] = (lower, upper)
+        incomplete[name] = [{"start_ms": lower, "end_ms": upper, "reason": reason}]
+
+    if resume:
+        for name, pending in resume.items():
+            windows = pending.get("windows") or []
+            if not windows:
+                continue
+            lower = min(int(w["start_ms"]) for w in windows)
+            upper = int(pending.get("end_ms") or max(int(w["end_ms"]) for w in windows))
+            streams[name] = _stream_coroutine(symbol, name, lower, upper, windows, sink_for(name))
+            stream_ranges[name] = (lower, upper)
+
+    if include_spot and not resume and should_continue_processing():
+        spot_start, spot_end = _default_spot_window(stream_starts.get("spot:normal", start_ms), end_ms)
+        tpsl_start, tpsl_end = _default_spot_window(stream_starts.get("spot:tpsl", start_ms), end_ms)
+        # Omitir spot si el símbolo tiene guion bajo
+        if "_" in str(symbol):
+            print(f"Skipping spot retrieval for underscored symbol: {symbol}")
+        elif not circuit_breaker.can_execute(symbol):
+            print(f"Circuit breaker OPEN for {symbol}, skipping spot orders")
+        elif execution_timer and execution_timer.remaining_time() < 10:
+            print(f"Less than 10s remaining, skipping spot orders to avoid timeout")
+            skip("spot:normal", spot_start, spot_end, "time constraint")
+            skip("spot:tpsl", tpsl_start, tpsl_end, "time constraint")
+        else:
+            streams["spot:normal"] = _stream_coroutine(symbol, "spot:normal", spot_start, spot_end, sink=sink_for("spot:normal"))
+            stream_ranges["spot:normal"] = (spot_start, spot_end)
+            if not execution_timer or execution_timer.remaining_time() > 15:
+                streams["spot:tpsl"] = _stream_coroutine(symbol, "spot:tpsl", tpsl_start, tpsl_end, sink=sink_for("spot:tpsl"))
+                stream_ranges["spot:tpsl"] = (tpsl_start, tpsl_end)
+            else:
+                print(f"Skipping TPSL")
+                skip("spot:tpsl", tpsl_start, tpsl_end, "time constraint")
+
+    if include_futures and not resume and should_continue_processing():
+        fut_end = end_ms if end_ms is not None else int(time.time() * 1000)
+        fut_start = start_ms if start_ms is not None else 0
+        for symbol_with_suffix in await _futures_contracts_for(symbol):
+            name = f"futures:{symbol_with_suffix}"
+            lower = stream_starts.get(name, fut_start)
+            streams[name] = _stream_coroutine(symbol, name, lower, fut_end, sink=sink_for(name))
+            stream_ranges[name] = (lower, fut_end)
+
+    stream_ends = {name: upper for name, (_, upper) in stream_ranges.items()}
+    if not streams:
+        return SymbolOrders([], incomplete, {}, stream_ends)
+
+    print(f"Scheduling {len(streams)} concurrent streams for {symbol}: {', '.join(streams)}")
+    tasks = {name: asyncio.ensure_future(coro) for name, coro in streams.items()}
+
+    # Dejar margen para almacenar resultados antes del timeout de la Lambda
+    timeout = max(1.0, execution_timer.remaining_time() - 2) if execution_timer else None
+    _, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def unfinished(name: str, reason: str) -> List[Dict[str, Any]]:
+        # Sin resultado parcial: hay que repetir todo lo que se pidió a la corriente
+        if resume and name in resume:
+            return [{**w, "reason": reason} for w in resume[name]["windows"]]
+        lower, upper = stream_ranges[name]
+        return [{"start_ms": lower, "end_ms": upper, "reason": reason}]
+
+    # Recopilar en orden de declaración para que la salida sea determinista
+    orders: List[Dict[str, Any]] = []
+    watermarks: Dict[str, Dict[str, Any]] = {}
+    for name, task in tasks.items():
+        market, stream_id = name.split(":", 1)
+        breaker_key = f"{symbol}_{stream_id}" if market == "spot" else stream_id
+
+        if task.cancelled():
+            print(f"⏰ Stream {name} cancelled due to time constraint, continuing with partial results")
+            incomplete[name] = unfinished(name, "cancelled")
+            continue
+
+        error = task.exception()
+        if error is not None:
+            if isinstance(error, TimeoutException):
+                print(f"Stream {name} timed out, continuing with partial results")
+            else:
+                print(f"Error in stream {name}: {_parse_bitget_error(str(error), stream_id if market == 'futures' else symbol)}")
+                circuit_breaker.record_failure(breaker_key, str(error))
+            incomplete[name] = unfinished(name, str(error) or type(error).__name__)
+            continue
+
+        stream_result = task.result()
+        stream_orders = stream_result.orders
+        _tag_stream_orders(symbol, name, stream_orders)
+        if stream_result.truncated:
+            incomplete[name] = stream_result.truncated
+        else:
+            # Con spool, la orden más reciente que pasó por el sink basta para el high-water mark
+            seen = stream_orders if spool is None else [latest[name]] if name in latest else []
+            watermarks[name] = stream_watermark(seen, stream_ends[name])
+        orders.extend(stream_orders)
+        circuit_breaker.record_success(breaker_key)
+        print(f"Retrieved {len(stream_orders) + streamed[name]} orders from stream {name}")
+
+    return SymbolOrders(orders, incomplete, watermarks, stream_ends)
+
+# Activity probes: pre-filtro barato antes de lanzar un worker completo por símbolo
+async def _probe_spot(symbol: str, start_ms: Optional[int], end_ms: Optional[int]) -> bool:
+    """¿Hay al menos una orden spot (normal o tpsl) en el rango? Una request limit=1 por ventana."""
+    spot_start, spot_end = _default_spot_window(start_ms, end_ms)
+    for lower, upper in plan_windows(spot_start, spot_end, ENDPOINT_WINDOWS[SPOT_HISTORY_ENDPOINT].max_window_ms):
+        for tpsl_type in ("normal", "tpsl"):
+            data = await _bitget_get(SPOT_HISTORY_ENDPOINT, {
+                "symbol": symbol,
+                "limit": 1,
+                "startTime": lower,
+                "endTime": upper,
+                "tpslType": tpsl_type,
+                "receiveWindow": 5000
+            })
+            if data.get("data"):
+                return True
+    return False
+
+async def _probe_futures(symbol: str, start_ms: Optional[int], end_ms: Optional[int]) -> bool:
+    """¿Hay al menos una orden en alguno de los contratos existentes del símbolo?"""
+    fut_end = end_ms if end_ms is not None else int(time.time() * 1000)
+    fut_start = start_ms if start_ms is not None else 0
+    for contract in await _futures_contracts_for(symbol):
+        data = await _bitget_get(FUTURES_HISTORY_ENDPOINT, {
+            "startTime": fut_start,
+            "endTime": fut_end,
+            "symbol": contract,
+            "pageSize": 1
+        })
+        if ((data.get("data") or {}).get("orderList") or []):
+            return True
+    return False
+
+async def _probe_symbol_activity(
+    symbol: str,
+    start_ms: Optional[int],
+    end_ms: Optional[int],
+    include_spot: bool,
+    include_futures: bool,
+) -> bool:
+    try:
+        if include_spot and "_" not in str(symbol) and await _probe_spot(symbol, start_ms, end_ms):
+            return True
+        if include_futures and await _probe_futures(symbol, start_ms, end_ms):
+            return True
+        return False
+    except TimeoutException:
+        raise
+    except Exception as e:
+        # Ante la duda el símbolo se procesa: un falso positivo solo cuesta un worker
+        print(f"Probe failed for {symbol}, keeping it: {_parse_bitget_error(str(e), symbol)}")
+        return True
+
+async def probe_symbols(
+    symbols: List[str],
+    start_ms: Optional[int],
+    end_ms: Optional[int],
+    include_spot: bool = True,
+    include_futures: bool = True,
+) -> Dict[str, List[str]]:
+    """
+    Prueba todos los símbolos en paralelo (el rate limiter y el pool HTTP marcan el ritmo).
+    Los que no alcanzan a probarse antes del timeout se devuelven en `unprobed`.
+    """
+    tasks = {
+        symbol: asyncio.ensure_future(_probe_symbol_activity(symbol, start_ms, end_ms, include_spot, include_futures))
+        for symbol in symbols
+    }
+    if tasks:
+        timeout = max(1.0, execution_timer.remaining_time() - 2) if execution_timer else None
+        _, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    result: Dict[str, List[str]] = {"active": [], "inactive": [], "unprobed": []}
+    for symbol, task in tasks.items():
+        if task.cancelled() or task.exception() is not None:
+            result["unprobed"].append(symbol)
+        elif task.result():
+            result["active"].append(symbol)
+        else:
+            result["inactive"].append(symbol)
+    return result
+
+def _probe_handler(evt: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    event: {"mode": "probe", "symbols": [...], "start_ms": ..., "end_ms": ...}
+    """
+    start_time = time.time()
+    symbols = [str(s) for s in evt.get("symbols") or []]
+    result = get_engine().run(
+        probe_symbols(
+            symbols,
+            _coerce_ms(evt.get("start_ms")),
+            _coerce_ms(evt.get("end_ms")),
+            include_spot=evt.get("includeSpot", True),
+            include_futures=evt.get("includeFutures", True),
+        )
+    )
+    elapsed = time.time() - start_time
+    print(f"Probed {len(symbols)} symbols in {elapsed:.1f}s: {len(result['active'])} active, "
+          f"{len(result['inactive'])} inactive, {len(result['unprobed'])} unprobed")
+    print(f"Rate limiter stats: {json.dumps(rate_limiter.stats())}")
+    return {**result, "probed": len(symbols), "execution_time_seconds": elapsed}
+
 # Early exit helper
 def should_continue_processing() -> bool:
     """
@@ -1172,8 +1433,17 @@ def handler(event, context):
     """
     Bitget Worker Lambda optimizado para máximo rendimiento
     """
+    # El spool vive en /tmp, que persiste entre invocaciones del mismo contenedor
+    spool = OrderSpool(SPOOL_DIR)
+    try:
+        return _handle(event, context, spool)
+    finally:
+        spool.close()
+
+def _handle(event, context, spool: OrderSpool):
     # INICIALIZAR TIMER DE EJECUCIÓN
     init_timer(MAX_EXECUTION_TIME)
+    rate_limiter.reset_stats()
 
     try:
         start_time = time.time()
@@ -1186,6 +1456,8 @@ def handler(event, context):
         elif isinstance(event, dict):
             evt = event
             symbol = evt.get("symbol") or evt.get("Symbol")
+            if evt.get("mode") == "probe":
+                return _probe_handler(evt)
         else:
             evt = {}
             symbol = str(event) if event is not None else None
@@ -1200,73 +1472,156 @@ def handler(event, context):
         # Flags
         include_spot = evt.get("includeSpot", True)
         include_fut = evt.get("includeFutures", True)
+        sync_mode = bool(evt.get("sync", SYNC_MODE_DEFAULT))
+
+        # Continuation: tramos pendientes de la invocación anterior para este símbolo
+        resume = evt.get("resume") or None
+        attempt = int(evt.get("attempt") or 0)
+        previous_s3_key = evt.get("previous_s3_key") if S3 else None
+        previous_count = int(evt.get("previous_count") or 0)
+        # Parte del estado del Map que le toca a este símbolo (la reparte el coordinator)
+        inline_max_bytes = INLINE_RESULTS_MAX_BYTES
+        if evt.get("inline_max_bytes") is not None:
+            inline_max_bytes = max(0, min(INLINE_RESULTS_MAX_BYTES, int(evt["inline_max_bytes"])))
+
+        # Las órdenes van al spool a medida que llegan; el sync agrega después su historial guardado
+        orders: Any = spool
+        incomplete: Dict[str, List[Dict[str, Any]]] = {}
+        pending_streams: Dict[str, Dict[str, Any]] = {}
+        previous_merged = False
+
+        # SYNC INCREMENTAL: pedir solo el delta desde el high-water mark de cada corriente
+        sync_state: Optional[SymbolSyncState] = None
+        stream_starts: Dict[str, int] = {}
+        if sync_mode:
+            if SYNC_STORE:
+                sync_state = SYNC_STORE.load(symbol)
+                stream_starts = {} if resume else sync_state.delta_starts(SYNC_OVERLAP_MS)
+                print(f"Sync mode: {len(stream_starts)} streams with high-water marks, {len(sync_state.orders)} stored orders")
+            else:
+                print("Sync mode requested but RESULTS_BUCKET not configured, running full fetch")
 
-        orders: List[Dict[str, Any]] = []
-
-        # PROCESAMIENTO CONDICIONAL BASADO EN TIEMPO
+        # PROCESAMIENTO CONCURRENTE: spot y futures comparten loop, pool HTTP y rate limiter
+        print(f"⏱️ Starting concurrent SPOT/FUTURES processing ({execution_timer.remaining_time():.1f}s remaining)")
+        try:
+            collected = get_engine().run(
+                collect_symbol_orders(
+                    symbol,
+                    start_ms,
+                    end_ms,
+                    include_spot=include_spot,
+                    include_futures=include_fut,
+                    stream_starts=stream_starts,
+                    resume=resume,
+                    spool=spool,
+                )
+            )
+            incomplete = collected.incomplete
+            pending_streams = collected.pending_streams()
+
+            if sync_state is not None:
+                # Después del delta: ante un orderId repetido gana la versión recién pedida. El
+                # historial guardado ya está en cTime DESC y se suelta apenas pasa al spool
+                fetched = len(spool)
+                stored, sync_state.orders = sync_state.orders, []
+                kept = spool.add_run(stored, presorted=True)
+                sync_state.advance(collected.watermarks)
+                SYNC_STORE.save(sync_state, orders=spool)
+                print(f"Sync mode: fetched {fetched} delta orders ({fetched - len(stored) + kept} new), "
+                      f"{len(spool)} in stored history")
+                previous_merged = True  # el historial sincronizado ya incluye lo anterior
+            elif previous_s3_key:
+                # Después de lo nuevo: ante un orderId repetido gana la versión recién pedida
+                added = spool.add_run(_iter_previous_orders(previous_s3_key),
+                                      presorted=not previous_s3_key.endswith(".json"))
+                previous_merged = True
+                print(f"Resumed {symbol} (attempt {attempt}): merged with {added} previous orders")
+        except TimeoutException:
+            print(f"Processing timed out, continuing with partial results")
+        except Exception as e:
+            print(f"Processing error: {_parse_bitget_error(str(e), symbol)}")
 
-        # SPOT: Prioridad alta si hay tiempo suficiente
-        if include_spot and should_continue_processing():
-            print(f"⏱️ Starting SPOT processing ({execution_timer.remaining_time():.1f}s remaining)")
-            try:
-                # PARALELIZACIÓN: Usar ThreadPoolExecutor para procesar spot
-                with ThreadPoolExecutor(max_workers=1) as executor:
-                    future_spot = executor.submit(spot_history_orders, symbol, start_ms=start_ms, end_ms=end_ms)
-
-                    # Timeout dinámico basado en tiempo restante
-                    timeout = min(25, execution_timer.remaining_time() - 10) if execution_timer else 25
-                    spot_hist = future_spot.result(timeout=timeout)
-
-                for o in spot_hist:
-                    if isinstance(o, dict):
-                        o["_symbol"] = symbol
-                        o["_market"] = "spot_history"
-                        o["_endpoint"] = "/api/v2/spot/trade/history-orders"
-                        orders.append(o)
-                print(f"SPOT completed: {len(spot_hist)} orders")
-            except TimeoutException:
-                print(f"SPOT processing timed out, continuing with partial results")
-            except Exception as e:
-                print(f"SPOT error: {_parse_bitget_error(str(e), symbol)}")
-
-        # FUTURES: Solo si hay tiempo suficiente restante
-        if include_fut and should_continue_processing():
-            print(f"Starting FUTURES processing ({execution_timer.remaining_time():.1f}s remaining)")
-            try:
-                # PARALELIZACIÓN: Usar ThreadPoolExecutor para procesar futures
-                with ThreadPoolExecutor(max_workers=1) as executor:
-                    future_futures = executor.submit(
-                        futures_get_orders_for_symbol,
-                        symbol=symbol,
-                        start_ms=start_ms,
-                        end_ms=end_ms
-                    )
-
-                    # Timeout dinámico basado en tiempo restante
-                    timeout = min(30, execution_timer.remaining_time() - 5) if execution_timer else 30
-                    fut_orders = future_futures.result(timeout=timeout)
-
-                orders.extend(fut_orders)
-                print(f"FUTURES completed: {len(fut_orders)} orders")
-            except TimeoutException:
-                print(f"FUTURES processing timed out, continuing with partial results")
-            except Exception as e:
-                print(f"FUTURES error: {_parse_bitget_error(str(e), symbol)}")
+        # Invocación retomada que falló antes de fusionar con lo ya guardado: el resultado
+        # sigue siendo el archivo anterior y la continuación reintenta los mismos tramos
+        kept_previous = bool(previous_s3_key and not previous_merged)
+        if kept_previous:
+            print(f"Resumed {symbol} (attempt {attempt}) failed before merging, keeping {previous_s3_key}")
+            spool.close()
+            orders = []
+            pending_streams = dict(resume or {})
 
         total_orders = len(orders)
         elapsed_time = time.time() - start_time
         print(f"Processing completed in {elapsed_time:.1f}s: {total_orders} total orders")
+        print(f"Rate limiter stats: {json.dumps(rate_limiter.stats())}")
+        if incomplete:
+            print(f"⚠️ Incomplete time ranges: {json.dumps(incomplete)}")
+
+        can_resume = bool(pending_streams and S3 and attempt < MAX_RESUME_INVOCATIONS)
+
+        def with_progress(response: Dict[str, Any], s3_key: Optional[str] = None) -> Dict[str, Any]:
+            """Adjunta los tramos incompletos y, si se puede retomar, el continuation token."""
+            if incomplete:
+                response["incomplete_streams"] = incomplete
+            if can_resume:
+                response["continuation"] = {
+                    "symbol": symbol,
+                    "sync": sync_mode,
+                    "includeSpot": include_spot,
+                    "includeFutures": include_fut,
+                    "resume": pending_streams,
+                    "attempt": attempt + 1,
+                    "previous_s3_key": s3_key,
+                    "previous_count": response.get("count", 0),
+                    "inline_max_bytes": inline_max_bytes,
+                }
+            return response
+
+        if kept_previous:
+            response = {
+                "symbol": symbol,
+                "count": previous_count,
+                "s3_key": previous_s3_key,
+                "s3_uri": f"s3://{RESULTS_BUCKET}/{previous_s3_key}",
+                "public_url": f"https://{RESULTS_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{previous_s3_key}",
+                "error": None,
+                "data_location": "s3",
+                "execution_time_seconds": elapsed_time,
+                "lambda_optimized": True
+            }
+            return with_progress(response, previous_s3_key)
 
         # ALMACENAMIENTO Y RESPUESTA
+        # Si entra en la respuesta, se evita el put (y el get y delete del aggregator). Con una
+        # continuación pendiente va a S3: la siguiente invocación retoma desde ese archivo
+        inline = None
+        fits_inline = not isinstance(orders, OrderSpool) or orders.bytes <= INLINE_SPOOL_RATIO * inline_max_bytes
+        if total_orders > 0 and OPTIMIZER_AVAILABLE and not can_resume and inline_max_bytes > 0 and fits_inline:
+            inline = pack_orders_inline(list(orders), inline_max_bytes, compress=INLINE_RESULTS_COMPRESS)
+        if inline is not None:
+            print(f"Returning {total_orders} orders inline")
+            response = {
+                "symbol": symbol,
+                "count": total_orders,
+                **inline,
+                "error": None,
+                "data_location": "inline",
+                "execution_time_seconds": elapsed_time,
+                "lambda_optimized": True
+            }
+            if previous_merged:
+                _delete_previous_orders(previous_s3_key, None)
+            return with_progress(response)
+
         if RESULTS_BUCKET and total_orders > 0:
             try:
                 print(f"Storing {total_orders} orders in S3...")
                 s3_metadata = _store_orders_in_s3(symbol, orders)
 
                 if OPTIMIZER_AVAILABLE:
-                    return optimize_orders_response(symbol, orders, s3_metadata)
+                    response = optimize_orders_response(symbol, orders, s3_metadata)
                 else:
-                    return {
+                    response = {
                         "symbol": symbol,
                         "count": total_orders,
                         "s3_key": s3_metadata["s3_key"],
@@ -1277,6 +1632,9 @@ def handler(event, context):
                         "execution_time_seconds": elapsed_time,
                         "lambda_optimized": True
                     }
+                if previous_merged:
+                    _delete_previous_orders(previous_s3_key, s3_metadata["s3_key"])
+                return with_progress(response, s3_metadata["s3_key"])
             except Exception as s3_error:
                 error_msg = f"S3 storage failed: {str(s3_error)}"
                 print(f"CRITICAL: {error_msg}")
@@ -1291,7 +1649,7 @@ def handler(event, context):
                 }
 
         elif total_orders == 0:
-            return {
+            response = {
                 "symbol": symbol,
                 "orders": [],
                 "count": 0,
@@ -1300,6 +1658,7 @@ def handler(event, context):
                 "execution_time_seconds": elapsed_time,
                 "lambda_optimized": True
             }
+            return with_progress(response, previous_s3_key)
         else:
             return {
                 "symbol": symbol,
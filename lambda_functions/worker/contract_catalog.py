@@ -0,0 +1,120 @@
+"""
+Catálogo de contratos de futuros v1 de Bitget.
+
+Antes cada símbolo base se expandía a {symbol}_UMCBL/_DMCBL/_CMCBL y se
+consultaban los tres, aunque la mayoría no existe (error 40034 tras reintentos).
+El catálogo se arma con el endpoint público /api/mix/v1/market/contracts, se
+carga una vez por contenedor, se persiste en /tmp para los cold starts y
+expira tras `ttl_seconds`.
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+CONTRACTS_ENDPOINT = "/api/mix/v1/market/contracts"
+
+# productType -> símbolos de contrato ("BTCUSDT_UMCBL", ...)
+ContractFetcher = Callable[[str], Awaitable[List[str]]]
+
+
+class ContractCatalog:
+    def __init__(
+        self,
+        fetch_contracts: ContractFetcher,
+        product_types: Iterable[str],
+        ttl_seconds: float = 6 * 3600,
+        cache_path: Optional[str] = "/tmp/bitget-futures-contracts.json",
+        clock: Callable[[], float] = time.time,
+    ):
+        self.fetch_contracts = fetch_contracts
+        self.product_types = [p.lower() for p in product_types]
+        self.ttl_seconds = ttl_seconds
+        self.cache_path = cache_path
+        self._clock = clock
+        self._contracts: Dict[str, Set[str]] = {}
+        self._fetched_at: Dict[str, float] = {}
+        self._inflight: Optional[asyncio.Future] = None
+        self._load_disk()
+
+    def _fresh(self, product_type: str) -> bool:
+        fetched_at = self._fetched_at.get(product_type)
+        return fetched_at is not None and self._clock() - fetched_at < self.ttl_seconds
+
+    def _load_disk(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for product_type, entry in (data.get("products") or {}).items():
+                self._contracts[product_type] = {str(s).upper() for s in entry.get("contracts") or []}
+                self._fetched_at[product_type] = float(entry.get("fetched_at") or 0)
+        except Exception as e:
+            print(f"Ignoring unreadable contract catalog cache {self.cache_path}: {str(e)}")
+
+    def _save_disk(self):
+        if not self.cache_path:
+            return
+        payload = {
+            "products": {
+                product_type: {"fetched_at": self._fetched_at[product_type], "contracts": sorted(contracts)}
+                for product_type, contracts in self._contracts.items()
+            }
+        }
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            print(f"Could not persist contract catalog to {self.cache_path}: {str(e)}")
+
+    async def refresh(self, force: bool = False):
+        """Recarga en paralelo los productTypes vencidos; si uno falla se conserva la versión anterior."""
+        # Varias corrientes pueden pedir el catálogo a la vez: una sola recarga en vuelo
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._refresh(force))
+        await asyncio.shield(self._inflight)
+
+    async def _refresh(self, force: bool):
+        stale = [p for p in self.product_types if force or not self._fresh(p)]
+        if not stale:
+            return
+        results = await asyncio.gather(*(self.fetch_contracts(p) for p in stale), return_exceptions=True)
+
+        refreshed = False
+        for product_type, contracts in zip(stale, results):
+            if isinstance(contracts, BaseException) or not contracts:
+                # Un catálogo vacío descartaría todos los contratos: mejor conservar el anterior
+                print(f"Contract catalog refresh failed for {product_type}: {str(contracts) or 'empty list'}")
+                continue
+            self._contracts[product_type] = {str(s).upper() for s in contracts}
+            self._fetched_at[product_type] = self._clock()
+            refreshed = True
+        if refreshed:
+            self._save_disk()
+
+    def exists(self, contract: str) -> Optional[bool]:
+        """True/False según el catálogo; None si no se conoce el productType (hay que consultarlo)."""
+        product_type = contract.rsplit("_", 1)[-1].lower()
+        contracts = self._contracts.get(product_type)
+        if contracts is None:
+            return None
+        return contract.upper() in contracts
+
+    async def filter_existing(self, contracts: Iterable[str]) -> List[str]:
+        await self.refresh()
+        return [c for c in contracts if self.exists(c) is not False]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            product_type: {
+                "contracts": len(self._contracts.get(product_type) or ()),
+                "age_seconds": round(self._clock() - self._fetched_at[product_type], 1)
+                if product_type in self._fetched_at else None,
+            }
+            for product_type in self.product_types
+        }
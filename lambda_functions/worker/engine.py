@@ -0,0 +1,123 @@
+"""
+Motor asíncrono del worker.
+
+Mantiene un único event loop y un único httpx.AsyncClient por contenedor de
+Lambda, de modo que el pool de conexiones (TLS incluido) se reutiliza entre
+invocaciones "warm". Todas las corrientes de un símbolo (spot normal, spot
+tpsl y cada contrato de futuros) se ejecutan como tareas sobre este loop.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+T = TypeVar("T")
+
+# Mismos códigos que reintentaba el Retry de urllib3 en la versión síncrona
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# Hook invocado antes de reintentar un 429: recibe (path, retry_after_segundos)
+ThrottleHook = Callable[[str, float], Awaitable[None]]
+
+
+def _retry_after_seconds(resp: httpx.Response, default: float) -> float:
+    try:
+        return max(0.0, float(resp.headers.get("Retry-After", default)))
+    except (TypeError, ValueError):
+        return default
+
+
+class AsyncEngine:
+    """
+    Event loop persistente + cliente HTTP compartido con límite de requests en vuelo.
+    """
+    def __init__(
+        self,
+        timeout: float,
+        retries: int,
+        backoff_factor: float = 0.3,
+        max_inflight: int = 8,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        on_throttle: Optional[ThrottleHook] = None,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_inflight = max(1, max_inflight)
+        self._transport = transport
+        self.on_throttle = on_throttle
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Optional[asyncio.Semaphore] = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+            # El cliente y el semáforo quedan ligados al loop anterior
+            self._client = None
+            self._inflight = None
+        return self._loop
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            # Sin reintentos en el transporte: los de conexión van por el loop de `get`, con backoff
+            transport = self._transport or httpx.AsyncHTTPTransport(retries=0)
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                transport=transport,
+                limits=httpx.Limits(
+                    max_connections=self.max_inflight,
+                    max_keepalive_connections=self.max_inflight,
+                ),
+            )
+        return self._client
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._inflight is None:
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+        return self._inflight
+
+    def run(self, coro: Awaitable[T]) -> T:
+        """Ejecuta una corrutina en el loop persistente (llamada síncrona desde el handler)."""
+        return self.loop.run_until_complete(coro)
+
+    async def get(self, url: str, headers: Dict[str, str]) -> httpx.Response:
+        """
+        GET con reintentos y backoff exponencial para 5xx y errores de transporte.
+        Los 429 se devuelven al rate limiter vía `on_throttle` (si existe), que es
+        quien decide cuándo se puede volver a salir.
+        """
+        client = self._get_client()
+        attempt = 0
+        while True:
+            try:
+                async with self._get_semaphore():
+                    resp = await client.get(url, headers=headers)
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                await asyncio.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+                continue
+
+            if resp.status_code in RETRY_STATUSES and attempt < self.retries:
+                attempt += 1
+                backoff = self.backoff_factor * (2 ** (attempt - 1))
+                if resp.status_code == 429 and self.on_throttle is not None:
+                    await self.on_throttle(resp.request.url.path, _retry_after_seconds(resp, backoff))
+                else:
+                    await asyncio.sleep(backoff)
+                continue
+            return resp
+
+    def close(self) -> None:
+        """Cierra el cliente y el loop (solo necesario fuera de Lambda, p.ej. en tests)."""
+        if self._loop is None or self._loop.is_closed():
+            return
+        if self._client is not None and not self._client.is_closed:
+            self._loop.run_until_complete(self._client.aclose())
+        self._loop.close()
+        self._client = None
+        self._inflight = None
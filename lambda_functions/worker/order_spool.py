@@ -0,0 +1,107 @@
+"""
+Spool de órdenes del worker: las corridas se vuelcan a /tmp a medida que llegan.
+
+Cada ventana paginada (PageRun de range_planner) entra al spool apenas termina,
+se ordena por cTime DESC (cabe en memoria: está acotada por el presupuesto de
+páginas) y se escribe como NDJSON en un archivo temporal. Al final, iterar el
+spool hace una fusión k-way de los archivos y entrega la corrida completa del
+símbolo en cTime DESC, que es lo que espera S3NdjsonWriter. En memoria quedan
+solo el conjunto de (market, orderId) vistos y una línea por corrida durante la fusión.
+
+Deduplicación por (market, orderId), como KWayMerge y sync_state: una orden spot y una
+de futuros con el mismo orderId son distintas. Gana la primera aparición y las órdenes
+sin orderId no se deduplican.
+"""
+
+import heapq
+import json
+import os
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from result_writer import order_ctime
+
+
+class OrderSpool:
+    """
+    Uso:
+        with OrderSpool() as spool:
+            spool.add_run(orders)        # desde el sink de cada corriente
+            len(spool)                   # órdenes únicas
+            for order in spool: ...      # cTime DESC (se puede recorrer más de una vez)
+    """
+
+    def __init__(self, directory: Optional[str] = None, key: str = "orderId"):
+        self.directory = directory
+        self.key = key
+        self.bytes = 0                   # NDJSON sin comprimir volcado a disco
+        self._seen = set()
+        self._paths: List[str] = []
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add_run(self, orders: Iterable[Any], presorted: bool = False) -> int:
+        """
+        Vuelca una corrida descartando los (market, orderId) ya vistos; retorna cuántas órdenes agregó.
+        Una corrida `presorted` (ya en cTime DESC, p. ej. el archivo de una invocación
+        anterior) se escribe a medida que se lee, sin cargarla en memoria.
+        """
+        def unseen() -> Iterator[Dict[str, Any]]:
+            for order in orders:
+                if not isinstance(order, dict):
+                    continue
+                oid = order.get(self.key)
+                if oid is not None:
+                    identity = (order.get("_market"), oid)
+                    if identity in self._seen:
+                        continue
+                    self._seen.add(identity)
+                yield order
+
+        run: Iterable[Dict[str, Any]] = unseen()
+        if not presorted:
+            run = sorted(run, key=order_ctime, reverse=True)
+            if not run:
+                return 0
+        fd, path = tempfile.mkstemp(prefix="orders-", suffix=".ndjson", dir=self.directory)
+        added = 0
+        with os.fdopen(fd, "wb") as f:
+            for order in run:
+                line = json.dumps(order, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                f.write(line)
+                self.bytes += len(line)
+                added += 1
+        if not added:
+            os.remove(path)
+            return 0
+        self._paths.append(path)
+        self._count += added
+        return added
+
+    def _read(self, path: str) -> Iterator[Dict[str, Any]]:
+        with open(path, "rb") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return heapq.merge(*(self._read(path) for path in self._paths), key=order_ctime, reverse=True)
+
+    def close(self):
+        for path in self._paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._paths = []
+        self._seen = set()
+        self._count = 0
+        self.bytes = 0
+
+    def __enter__(self) -> "OrderSpool":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -0,0 +1,176 @@
+"""
+Planificador de rangos de tiempo para la paginación del worker.
+
+Conoce de antemano la ventana máxima de cada endpoint, divide [start_ms, end_ms]
+en sub-ventanas que se piden en paralelo y, si una sub-ventana agota su
+presupuesto de páginas, bisecta lo que falta por traer y lo pide también en
+paralelo. Los resultados se fusionan deduplicando por orderId y cualquier tramo
+que no se pudo completar queda registrado (nunca se trunca en silencio) junto con
+el cursor de la API, para que otra invocación pueda retomarlo exactamente.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+Window = Tuple[int, int]
+
+
+@dataclass(frozen=True)
+class EndpointWindow:
+    max_window_ms: Optional[int]   # None = el endpoint no impone ventana máxima
+    min_window_ms: int = 60_000    # no bisecar por debajo de este tamaño
+
+
+@dataclass
+class PageRun:
+    """Resultado de paginar UNA ventana con un presupuesto de páginas."""
+    orders: List[Dict[str, Any]]
+    exhausted: bool = False               # se cortó con datos pendientes
+    resume_end_ms: Optional[int] = None   # límite superior de lo que falta ([start, resume_end])
+    error: Optional[str] = None
+    cursor: Optional[Dict[str, Any]] = None   # idLessThan / lastEndId para retomar la paginación
+
+
+@dataclass
+class RangeResult:
+    orders: List[Dict[str, Any]]
+    windows_fetched: int = 0
+    truncated: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def complete(self) -> bool:
+        return not self.truncated
+
+
+# (start_ms, end_ms, page_budget, cursor) -> PageRun
+PageFetcher = Callable[[int, int, int, Optional[Dict[str, Any]]], Awaitable[PageRun]]
+# Recibe las órdenes de cada ventana apenas termina (ver fetch_range)
+RunSink = Callable[[List[Dict[str, Any]]], None]
+
+
+def plan_windows(start_ms: int, end_ms: int, max_window_ms: Optional[int], splits: int = 1) -> List[Window]:
+    """
+    Divide [start_ms, end_ms] en ventanas contiguas (más reciente primero), ninguna
+    mayor que `max_window_ms`, y como mínimo `splits` ventanas.
+    """
+    if end_ms < start_ms:
+        return []
+    total = end_ms - start_ms + 1
+    count = max(1, splits)
+    if max_window_ms:
+        count = max(count, -(-total // max_window_ms))
+    size = -(-total // count)
+
+    windows: List[Window] = []
+    upper = end_ms
+    while upper >= start_ms:
+        lower = max(start_ms, upper - size + 1)
+        windows.append((lower, upper))
+        upper = lower - 1
+    return windows
+
+
+def bisect_window(start_ms: int, end_ms: int) -> List[Window]:
+    """Parte la ventana en dos mitades (más reciente primero)."""
+    mid = start_ms + (end_ms - start_ms) // 2
+    return [(mid + 1, end_ms), (start_ms, mid)]
+
+
+def _ctime(order: Dict[str, Any]) -> int:
+    try:
+        return int(order.get("cTime") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def merge_dedupe(runs: Iterable[List[Dict[str, Any]]], key: str = "orderId") -> List[Dict[str, Any]]:
+    """Fusiona listas de órdenes, se queda con la primera aparición de cada orderId y ordena por cTime DESC."""
+    seen = set()
+    merged: List[Dict[str, Any]] = []
+    for orders in runs:
+        for order in orders:
+            oid = order.get(key)
+            if oid is not None:
+                if oid in seen:
+                    continue
+                seen.add(oid)
+            merged.append(order)
+    merged.sort(key=_ctime, reverse=True)
+    return merged
+
+
+async def fetch_range(
+    fetch_pages: PageFetcher,
+    start_ms: int,
+    end_ms: int,
+    window: EndpointWindow,
+    page_budget: int,
+    max_depth: int = 4,
+    splits: int = 1,
+    can_split: Callable[[], bool] = lambda: True,
+    resume: Optional[List[Dict[str, Any]]] = None,
+    sink: Optional[RunSink] = None,
+) -> RangeResult:
+    """
+    Pide todas las ventanas del plan en paralelo y bisecta adaptativamente las que
+    agotan su presupuesto de páginas. Con `resume` (los `truncated` de una
+    ejecución anterior) solo se piden esos tramos, continuando desde su cursor.
+
+    Con `sink`, las órdenes de cada ventana se le entregan apenas termina y no se
+    acumulan: `orders` queda vacío y la deduplicación corre por cuenta del sink.
+    """
+    result = RangeResult(orders=[])
+    runs: List[List[Dict[str, Any]]] = []
+
+    async def fetch_window(lower: int, upper: int, depth: int, cursor: Optional[Dict[str, Any]] = None) -> None:
+        run = await fetch_pages(lower, upper, page_budget, cursor)
+        result.windows_fetched += 1
+        if sink is not None:
+            sink(run.orders)
+        else:
+            runs.append(run.orders)
+        if not run.exhausted:
+            return
+
+        pending_upper = run.resume_end_ms if run.resume_end_ms is not None else upper
+        if pending_upper < lower:
+            return
+
+        splittable = (
+            run.error is None
+            and depth < max_depth
+            and pending_upper - lower + 1 >= 2 * window.min_window_ms
+            and can_split()
+        )
+        if not splittable:
+            pending = {
+                "start_ms": lower,
+                "end_ms": pending_upper,
+                "reason": run.error or "page budget exhausted",
+            }
+            if run.cursor:
+                pending["cursor"] = run.cursor
+            result.truncated.append(pending)
+            return
+
+        await asyncio.gather(*(
+            fetch_window(sub_lower, sub_upper, depth + 1)
+            for sub_lower, sub_upper in bisect_window(lower, pending_upper)
+        ))
+
+    if resume is not None:
+        planned = [(int(w["start_ms"]), int(w["end_ms"]), w.get("cursor")) for w in resume]
+    else:
+        planned = [(lower, upper, None) for lower, upper in plan_windows(start_ms, end_ms, window.max_window_ms, splits)]
+
+    await asyncio.gather(*(
+        fetch_window(lower, upper, 0, cursor)
+        for lower, upper, cursor in planned
+    ))
+
+    result.orders = merge_dedupe(runs)
+    result.truncated.sort(key=lambda t: t["end_ms"], reverse=True)
+    return result
@@ -0,0 +1,164 @@
+"""
+Rate limiter token-bucket por endpoint de Bitget.
+
+Cada endpoint tiene su propio bucket (tasa en tokens/s y ráfaga máxima) y cada
+request consume `weight` tokens. La adquisición es O(1): se reserva el costo
+dejando el saldo negativo si hace falta y se devuelve cuánto hay que esperar,
+así las esperas se encolan en orden sin listas de timestamps ni sleeps bajo lock.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from threading import Lock
+from typing import Callable, Dict, Optional
+
+
+@dataclass
+class EndpointLimit:
+    rate: float          # tokens repuestos por segundo
+    burst: float         # capacidad máxima del bucket
+    weight: float = 1.0  # tokens consumidos por request
+
+
+class TokenBucket:
+    """
+    Bucket con reserva: `reserve` descuenta el peso y devuelve la espera necesaria.
+    """
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self.lock = Lock()
+
+        # Métricas
+        self.acquired = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def reserve(self, weight: float = 1.0) -> float:
+        """Reserva `weight` tokens y retorna los segundos a esperar antes de usar la reserva."""
+        with self.lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= weight
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+            self.acquired += 1
+            if wait > 0:
+                self.waited += 1
+                self.wait_seconds += wait
+            return wait
+
+    def penalize(self, seconds: float) -> None:
+        """Tras un 429: vacía el bucket para que nadie más salga durante `seconds`."""
+        with self.lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens = min(self._tokens, -seconds * self.rate)
+            self.throttled += 1
+
+    @property
+    def tokens(self) -> float:
+        with self.lock:
+            self._refill(self._clock())
+            return self._tokens
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "tokens": round(self.tokens, 3),
+            "rate": self.rate,
+            "burst": self.burst,
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "throttled": self.throttled,
+        }
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.acquired = 0
+            self.waited = 0
+            self.wait_seconds = 0.0
+            self.throttled = 0
+
+
+class EndpointRateLimiter:
+    """
+    Un TokenBucket por endpoint configurado; los paths desconocidos caen en un
+    bucket por tipo de API ('spot' / 'futures') con los límites por defecto.
+    """
+    def __init__(
+        self,
+        endpoint_limits: Dict[str, EndpointLimit],
+        default_limits: Dict[str, EndpointLimit],
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.endpoint_limits = dict(endpoint_limits)
+        self.default_limits = dict(default_limits)
+        self._clock = clock
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def api_type(path: str) -> str:
+        return 'spot' if '/spot/' in path else 'futures'
+
+    def _limit_for(self, path: str) -> EndpointLimit:
+        limit = self.endpoint_limits.get(path)
+        if limit is None:
+            limit = self.default_limits.get(self.api_type(path)) or EndpointLimit(rate=8, burst=8)
+        return limit
+
+    def _bucket_key(self, path: str) -> str:
+        return path if path in self.endpoint_limits else self.api_type(path)
+
+    def bucket(self, path: str) -> TokenBucket:
+        key = self._bucket_key(path)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    limit = self._limit_for(path)
+                    bucket = TokenBucket(limit.rate, limit.burst, clock=self._clock)
+                    self._buckets[key] = bucket
+        return bucket
+
+    def reserve(self, path: str, weight: Optional[float] = None) -> float:
+        if weight is None:
+            weight = self._limit_for(path).weight
+        return self.bucket(path).reserve(weight)
+
+    def acquire(self, path: str, weight: Optional[float] = None) -> float:
+        """Waiter síncrono: bloquea el hilo el tiempo necesario. Retorna la espera aplicada."""
+        wait = self.reserve(path, weight)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, path: str, weight: Optional[float] = None) -> float:
+        """Waiter para el event loop: cede el control mientras espera."""
+        wait = self.reserve(path, weight)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def penalize(self, path: str, seconds: float) -> None:
+        self.bucket(path).penalize(seconds)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {key: bucket.stats() for key, bucket in list(self._buckets.items())}
+
+    def reset_stats(self) -> None:
+        for bucket in list(self._buckets.values()):
+            bucket.reset_stats()
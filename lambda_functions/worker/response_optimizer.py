@@ -1,11 +1,102 @@
+import base64
 import json
 import sys
+import zlib
 from typing import Dict, List, Any, Optional
 
+from result_writer import INLINE_ORDERS_FIELD, order_ctime
+
 MAX_RESPONSE_SIZE = 180 * 1024  # Reducido a 180KB para máxima seguridad
 
 ESTIMATED_ORDER_SIZE = 500
 
+
+def _b64_size(n: int) -> int:
+    return 4 * ((n + 2) // 3)
+
+
+class InlinePacker:
+    """
+    Empaqueta órdenes para devolverlas dentro de la respuesta mientras quepan en `max_bytes`.
+
+    Uso:
+        packer = InlinePacker(4096, compress=True)
+        for order in orders:
+            if not packer.add(order):
+                break                      # no cabe: ir a S3
+        fields = packer.finish()           # {"orders_gz": "..."} / {"orders": [...]} o None
+
+    Cada orden se serializa una sola vez y el tamaño se lleva exacto: sin comprimir,
+    la lista ocupa lo mismo que `json.dumps(orders)` (el formato con que el runtime
+    serializa la respuesta); comprimido, el NDJSON pasa por un gzip incremental y lo
+    ya emitido es una cota inferior que corta temprano; el tamaño exacto del base64 se
+    conoce al cerrar el stream.
+    """
+    def __init__(self, max_bytes: int, compress: bool = True):
+        self.max_bytes = max(0, int(max_bytes))
+        self.count = 0
+        self.size = 0
+        self.overflow = False
+        self._orders: List[Dict[str, Any]] = []
+        self._gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        self._chunks: List[bytes] = []
+        if self._gzip is None:
+            self.size = 2  # "[]"
+
+    def add(self, order: Dict[str, Any]) -> bool:
+        """Agrega una orden; False si ya no entra (el packer queda descartado)."""
+        if self.overflow:
+            return False
+        if self._gzip is None:
+            size = self.size + len(json.dumps(order)) + (2 if self.count else 0)  # ", " entre elementos
+            if size > self.max_bytes:
+                self.overflow = True
+                return False
+            self._orders.append(order)
+        else:
+            line = json.dumps(order, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+            chunk = self._gzip.compress(line)
+            if chunk:
+                self._chunks.append(chunk)
+                size = self.size + len(chunk)
+                if _b64_size(size) > self.max_bytes:
+                    self.overflow = True
+                    return False
+            else:
+                size = self.size
+        self.size = size
+        self.count += 1
+        return True
+
+    def finish(self) -> Optional[Dict[str, Any]]:
+        """Campos de órdenes para la respuesta, o None si no entraron."""
+        if self.overflow:
+            return None
+        if self._gzip is None:
+            return {"orders": self._orders}
+        self._chunks.append(self._gzip.flush())
+        data = b"".join(self._chunks)
+        self.size = len(data)
+        if _b64_size(self.size) > self.max_bytes:
+            self.overflow = True
+            return None
+        self.size = _b64_size(self.size)
+        return {INLINE_ORDERS_FIELD: base64.b64encode(data).decode("ascii")}
+
+
+def pack_orders_inline(orders: List[Dict[str, Any]], max_bytes: int, compress: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Órdenes (ordenadas por cTime DESC, como las corridas en S3) listas para la respuesta
+    si caben en `max_bytes`; None si hay que guardarlas en S3.
+    """
+    if max_bytes <= 0:
+        return None
+    packer = InlinePacker(max_bytes, compress=compress)
+    for order in sorted(orders, key=order_ctime, reverse=True):
+        if not packer.add(order):
+            return None
+    return packer.finish()
+
 def estimate_response_size(data: Any) -> int:
     """
     Estima el tamaño en bytes de un objeto al serializarlo a JSON.
@@ -20,7 +111,9 @@ def estimate_response_size(data: Any) -> int:
 def optimize_orders_response(
     symbol: str, 
     orders: List[Dict[str, Any]], 
-    s3_metadata: Optional[Dict[str, str]] = None
+    s3_metadata: Optional[Dict[str, str]] = None,
+    max_bytes: int = MAX_RESPONSE_SIZE,
+    compress: bool = True
 ) -> Dict[str, Any]:
     """
     Optimiza la respuesta del worker para GARANTIZAR que no se supere 256KB.
@@ -29,6 +122,8 @@ def optimize_orders_response(
         symbol: Símbolo procesado
         orders: Lista de órdenes
         s3_metadata: Metadatos de S3 si se guardó ahí
+        max_bytes: Espacio para las órdenes inline (sin S3)
+        compress: Órdenes inline como NDJSON gzip en base64 (`orders_gz`)
     
     Returns:
         Respuesta optimizada que NUNCA supera el límite
@@ -47,32 +142,17 @@ def optimize_orders_response(
         }
         return response
     
-    # Calcular número máximo de órdenes que caben SEGURAMENTE
-    base_response_size = estimate_response_size({
+    response = {
         "symbol": symbol,
         "count": total_orders,
-        "truncated": True,
-        "error": "truncated",
+        "error": None,
         "data_location": "inline"
-    })
-    
-    available_space = MAX_RESPONSE_SIZE - base_response_size
-    max_safe_orders = max(1, available_space // ESTIMATED_ORDER_SIZE)
-    
-    max_safe_orders = min(max_safe_orders, 20)
-    
-    if total_orders <= max_safe_orders:
-        response = {
-            "symbol": symbol,
-            "orders": orders,
-            "count": total_orders,
-            "error": None,
-            "data_location": "inline"
-        }
-        
-        # Verificación final de seguridad
-        if estimate_response_size(response) < MAX_RESPONSE_SIZE:
-            return response
+    }
+    available_space = min(max_bytes, MAX_RESPONSE_SIZE - estimate_response_size(response))
+    inline = pack_orders_inline(orders, available_space, compress=compress)
+    if inline is not None:
+        response.update(inline)
+        return response
     
     return {
         "symbol": symbol,
@@ -0,0 +1,264 @@
+"""
+Presupuesto de rate limit compartido entre todas las invocaciones del worker.
+
+Cada worker tiene su propio EndpointRateLimiter, pero todos usan la misma API
+key; sin coordinación la tasa real es N veces la deseada. Aquí los workers
+arriendan tokens de un bucket común usando GCRA: por cada key solo se guarda el
+TAT (theoretical arrival time), de modo que cada arriendo es una única
+lectura-modificación-escritura atómica en el backend.
+
+Backends:
+  - SQLiteBudgetBackend: archivo local con el lock de SQLite (tests / local).
+  - DynamoDBBudgetBackend: escrituras condicionales en una tabla (producción).
+"""
+
+import asyncio
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from rate_limiter import EndpointRateLimiter
+
+# (tat_anterior | None) -> (tat_nuevo, resultado)
+TatUpdate = Callable[[Optional[float]], Tuple[float, float]]
+
+
+def _gcra_reserve(cost_s: float, burst_s: float, now: float) -> TatUpdate:
+    """Reserva `cost_s` segundos de emisión; devuelve la espera hasta que la reserva es conforme."""
+    def update(tat: Optional[float]) -> Tuple[float, float]:
+        start = max(tat if tat is not None else now, now)
+        new_tat = start + cost_s
+        wait = max(0.0, new_tat - burst_s - now)
+        return new_tat, wait
+    return update
+
+
+def _push_tat(until: float) -> TatUpdate:
+    def update(tat: Optional[float]) -> Tuple[float, float]:
+        return max(tat if tat is not None else until, until), 0.0
+    return update
+
+
+class BudgetBackend:
+    """Almacenamiento atómico del TAT por key."""
+
+    def update(self, key: str, fn: TatUpdate) -> float:
+        raise NotImplementedError
+
+    def reserve(self, key: str, cost_s: float, burst_s: float, now: float) -> float:
+        return self.update(key, _gcra_reserve(cost_s, burst_s, now))
+
+    def push(self, key: str, until: float) -> None:
+        """Mueve el TAT hacia adelante (nunca hacia atrás), p.ej. tras un 429."""
+        self.update(key, _push_tat(until))
+
+
+class SQLiteBudgetBackend(BudgetBackend):
+    """
+    Backend en archivo: `BEGIN IMMEDIATE` toma el lock de escritura del archivo,
+    así varios procesos en la misma máquina comparten el presupuesto.
+    """
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_budget (budget_key TEXT PRIMARY KEY, tat REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def update(self, key: str, fn: TatUpdate) -> float:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tat FROM rate_budget WHERE budget_key = ?", (key,)).fetchone()
+            new_tat, result = fn(row[0] if row else None)
+            conn.execute(
+                "INSERT INTO rate_budget (budget_key, tat) VALUES (?, ?) "
+                "ON CONFLICT(budget_key) DO UPDATE SET tat = excluded.tat",
+                (key, new_tat),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+
+class DynamoDBBudgetBackend(BudgetBackend):
+    """
+    Backend DynamoDB: lectura consistente + PutItem condicionado al TAT leído
+    (concurrencia optimista). Los items expiran solos vía TTL en `expires_at`.
+    """
+    def __init__(self, table_name: str, client=None, max_attempts: int = 10, ttl_seconds: int = 3600):
+        if client is None:
+            import boto3
+            client = boto3.client("dynamodb")
+        self.table_name = table_name
+        self.client = client
+        self.max_attempts = max_attempts
+        self.ttl_seconds = ttl_seconds
+
+    def update(self, key: str, fn: TatUpdate) -> float:
+        for attempt in range(self.max_attempts):
+            item = self.client.get_item(
+                TableName=self.table_name,
+                Key={"budget_key": {"S": key}},
+                ConsistentRead=True,
+            ).get("Item")
+            old_raw = item["tat"]["N"] if item else None
+            new_tat, result = fn(float(old_raw) if old_raw is not None else None)
+
+            put_kwargs = {
+                "TableName": self.table_name,
+                "Item": {
+                    "budget_key": {"S": key},
+                    "tat": {"N": repr(new_tat)},
+                    "expires_at": {"N": str(int(new_tat) + self.ttl_seconds)},
+                },
+            }
+            if old_raw is None:
+                put_kwargs["ConditionExpression"] = "attribute_not_exists(budget_key)"
+            else:
+                put_kwargs["ConditionExpression"] = "tat = :old"
+                put_kwargs["ExpressionAttributeValues"] = {":old": {"N": old_raw}}
+
+            try:
+                self.client.put_item(**put_kwargs)
+                return result
+            except self.client.exceptions.ConditionalCheckFailedException:
+                # Otro worker escribió primero: releer y reintentar con jitter
+                time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+
+        raise RuntimeError(f"Shared rate budget contention on {key} after {self.max_attempts} attempts")
+
+
+class SharedRateLimiter:
+    """
+    Misma interfaz que EndpointRateLimiter: cada request pasa por el bucket local
+    y además por el presupuesto compartido. Para no ir al backend en cada request
+    se arriendan `lease_size` tokens a la vez y se gastan localmente.
+    """
+    def __init__(
+        self,
+        local: EndpointRateLimiter,
+        backend: BudgetBackend,
+        namespace: str,
+        lease_size: float = 1.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.local = local
+        self.backend = backend
+        self.namespace = namespace
+        self.lease_size = max(1.0, lease_size)
+        self._clock = clock
+        # key -> [tokens arrendados sin usar, instante desde el que son válidos]
+        self._leases: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+        self.backend_calls = 0
+        self.shared_wait_seconds = 0.0
+
+    def api_type(self, path: str) -> str:
+        return self.local.api_type(path)
+
+    def _shared_key(self, path: str) -> str:
+        return f"{self.namespace}:{self.local._bucket_key(path)}"
+
+    def _reserve_shared(self, path: str, weight: float) -> float:
+        key = self._shared_key(path)
+        now = self._clock()
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease and lease[0] >= weight:
+                lease[0] -= weight
+                return max(0.0, lease[1] - now)
+
+        limit = self.local._limit_for(path)
+        amount = min(max(weight, self.lease_size), max(weight, limit.burst))
+        wait = self.backend.reserve(key, amount / limit.rate, limit.burst / limit.rate, now)
+
+        with self._lock:
+            self._leases[key] = [amount - weight, now + wait]
+            self.backend_calls += 1
+            self.shared_wait_seconds += wait
+        return wait
+
+    def reserve(self, path: str, weight: Optional[float] = None) -> float:
+        if weight is None:
+            weight = self.local._limit_for(path).weight
+        local_wait = self.local.reserve(path, weight)
+        return max(local_wait, self._reserve_shared(path, weight))
+
+    def acquire(self, path: str, weight: Optional[float] = None) -> float:
+        wait = self.reserve(path, weight)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, path: str, weight: Optional[float] = None) -> float:
+        if weight is None:
+            weight = self.local._limit_for(path).weight
+        local_wait = self.local.reserve(path, weight)
+        # El backend hace I/O (SQLite / DynamoDB): fuera del event loop
+        shared_wait = await asyncio.to_thread(self._reserve_shared, path, weight)
+        wait = max(local_wait, shared_wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def penalize(self, path: str, seconds: float) -> None:
+        """Un 429 frena a toda la flota, no solo a este worker."""
+        self.local.penalize(path, seconds)
+        limit = self.local._limit_for(path)
+        key = self._shared_key(path)
+        with self._lock:
+            self._leases.pop(key, None)
+        self.backend.push(key, self._clock() + seconds + limit.burst / limit.rate)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        stats = self.local.stats()
+        stats["shared"] = {
+            "namespace": self.namespace,
+            "backend": type(self.backend).__name__,
+            "backend_calls": self.backend_calls,
+            "wait_seconds": round(self.shared_wait_seconds, 3),
+        }
+        return stats
+
+    def reset_stats(self) -> None:
+        self.local.reset_stats()
+        self.backend_calls = 0
+        self.shared_wait_seconds = 0.0
+
+
+def budget_backend_from_env() -> Optional[BudgetBackend]:
+    """
+    SHARED_RATE_BACKEND = "" (desactivado) | "sqlite" | "dynamodb"
+    """
+    kind = os.environ.get("SHARED_RATE_BACKEND", "").strip().lower()
+    if not kind:
+        return None
+    if kind == "sqlite":
+        return SQLiteBudgetBackend(os.environ.get("SHARED_RATE_SQLITE_PATH", "/tmp/bitget-rate-budget.sqlite"))
+    if kind == "dynamodb":
+        table = os.environ.get("SHARED_RATE_TABLE")
+        if not table:
+            raise RuntimeError("SHARED_RATE_BACKEND=dynamodb requires SHARED_RATE_TABLE")
+        return DynamoDBBudgetBackend(table)
+    raise RuntimeError(f"Unknown SHARED_RATE_BACKEND: {kind}")
+
+
+def budget_namespace(api_key: str) -> str:
+    """Namespace por API key (hash, nunca la key en claro): los límites de Bitget son por UID/key."""
+    return "bitget:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
@@ -0,0 +1,140 @@
+"""
+Estado de sincronización incremental por símbolo.
+
+Para cada (símbolo, corriente) — "spot:normal", "spot:tpsl", "futures:BTCUSDT_UMCBL" —
+se guarda un high-water mark con el último cTime/orderId visto y hasta dónde se
+sincronizó sin huecos. Las ejecuciones siguientes piden solo el delta desde ese
+punto y lo fusionan con el historial guardado del símbolo.
+
+El estado vive en S3 como un JSON por símbolo: {prefix}{SYMBOL}.json
+"""
+
+import json
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+def _ctime(order: Dict[str, Any]) -> int:
+    try:
+        return int(order.get("cTime") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _order_key(order: Dict[str, Any]) -> Tuple[str, str]:
+    return (str(order.get("_market") or ""), str(order.get("orderId") or ""))
+
+
+def stream_watermark(orders: List[Dict[str, Any]], synced_to_ms: int) -> Dict[str, Any]:
+    """High-water mark de una corriente que terminó completa hasta `synced_to_ms`."""
+    latest = max(orders, key=_ctime, default=None)
+    return {
+        "cTime": _ctime(latest) if latest else None,
+        "orderId": latest.get("orderId") if latest else None,
+        "synced_to_ms": synced_to_ms,
+    }
+
+
+@dataclass
+class SymbolSyncState:
+    symbol: str
+    watermarks: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    orders: List[Dict[str, Any]] = field(default_factory=list)
+    updated_at: Optional[str] = None
+
+    def delta_starts(self, overlap_ms: int) -> Dict[str, int]:
+        """
+        Inicio del delta por corriente. Se retrocede `overlap_ms` para cubrir
+        órdenes que la API indexa con retraso; los duplicados se descartan al fusionar.
+        """
+        starts = {}
+        for stream, mark in self.watermarks.items():
+            synced_to = mark.get("synced_to_ms")
+            if synced_to is not None:
+                starts[stream] = max(0, int(synced_to) - overlap_ms)
+        return starts
+
+    def merge(self, new_orders: List[Dict[str, Any]]) -> int:
+        """Fusiona órdenes nuevas (la versión nueva gana) y retorna cuántas no existían."""
+        by_key = {_order_key(o): o for o in self.orders}
+        added = 0
+        for order in new_orders:
+            key = _order_key(order)
+            if key not in by_key:
+                added += 1
+            by_key[key] = order
+        self.orders = sorted(by_key.values(), key=_ctime, reverse=True)
+        return added
+
+    def advance(self, watermarks: Dict[str, Dict[str, Any]]) -> None:
+        """Solo avanza las corrientes que se completaron; nunca retrocede un mark."""
+        for stream, mark in watermarks.items():
+            previous = self.watermarks.get(stream) or {}
+            if mark.get("cTime") is None or (previous.get("cTime") or 0) > mark["cTime"]:
+                mark = {**mark, "cTime": previous.get("cTime"), "orderId": previous.get("orderId")}
+            mark["synced_to_ms"] = max(mark["synced_to_ms"], previous.get("synced_to_ms") or 0)
+            self.watermarks[stream] = mark
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "symbol": self.symbol,
+            "watermarks": self.watermarks,
+            "orders": self.orders,
+            "count": len(self.orders),
+            "updated_at": self.updated_at,
+        }
+
+
+class SyncStore:
+    """Lectura/escritura del estado de sincronización en S3."""
+
+    def __init__(self, s3, bucket: str, prefix: str = "sync-state/"):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/") + "/"
+
+    def _key(self, symbol: str) -> str:
+        return f"{self.prefix}{str(symbol).upper()}.json"
+
+    def load(self, symbol: str) -> SymbolSyncState:
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=self._key(symbol))
+        except self.s3.exceptions.NoSuchKey:
+            return SymbolSyncState(symbol=symbol)
+        data = json.loads(obj["Body"].read())
+        return SymbolSyncState(
+            symbol=symbol,
+            watermarks=data.get("watermarks") or {},
+            orders=data.get("orders") or [],
+            updated_at=data.get("updated_at"),
+        )
+
+    def save(self, state: SymbolSyncState, orders: Optional[Iterable[Dict[str, Any]]] = None) -> str:
+        """
+        Guarda el estado. Con `orders` (p. ej. el OrderSpool del worker, en cTime DESC) el
+        historial se escribe a medida que se recorre, sin armar la lista en memoria.
+        """
+        state.updated_at = datetime.now(timezone.utc).isoformat()
+        key = self._key(state.symbol)
+        if orders is None:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=json.dumps(state.to_json(), ensure_ascii=False).encode("utf-8"),
+                ContentType="application/json; charset=utf-8",
+            )
+            return key
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as f:
+            header = {"symbol": state.symbol, "watermarks": state.watermarks, "updated_at": state.updated_at}
+            f.write(json.dumps(header, ensure_ascii=False)[:-1].encode("utf-8") + b', "orders": [')
+            count = 0
+            for order in orders:
+                f.write((b", " if count else b"") + json.dumps(order, ensure_ascii=False).encode("utf-8"))
+                count += 1
+            f.write(f'], "count": {count}}}'.encode("utf-8"))
+            f.seek(0)
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=f,
+                               ContentType="application/json; charset=utf-8")
+        return key
@@ -0,0 +1,73 @@
+"""
+Arma los paquetes de despliegue de las Lambdas de lambda_functions/.
+
+Las Lambdas usan imports planos: los módulos compartidos de lambda_functions/common
+(result_writer, columnar, order_stats) tienen que ir junto al handler. Este script
+copia cada Lambda con esos módulos a build/lambdas/<nombre>/; con --deps instala
+además el requirements.txt de la Lambda (p. ej. httpx para el worker, numpy para el aggregator) y, con --zip,
+genera build/lambdas/<nombre>.zip listo para `aws lambda update-function-code`.
+infra/bitget_stack.py usa stage_lambda para los assets de CDK.
+
+Uso:
+    python scripts/package_lambdas.py                       # todas
+    python scripts/package_lambdas.py worker --deps --zip   # solo el worker, con dependencias y zip
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDAS_DIR = os.path.join(ROOT, "lambda_functions")
+COMMON_DIR = os.path.join(LAMBDAS_DIR, "common")
+BUILD_DIR = os.path.join(ROOT, "build", "lambdas")
+LAMBDAS = ("coordinator", "worker", "aggregator")
+
+_IGNORE = shutil.ignore_patterns("__pycache__", "*.pyc", "tests")
+
+
+def stage_lambda(name: str, build_dir: str = BUILD_DIR, install: bool = False) -> str:
+    """
+    Copia lambda_functions/<name> más lambda_functions/common a build_dir/<name>; retorna ese
+    directorio. Con `install`, instala ahí el requirements.txt de la Lambda si lo tiene.
+    """
+    source = os.path.join(LAMBDAS_DIR, name)
+    if not os.path.isdir(source):
+        raise ValueError(f"No existe la Lambda {name} en {LAMBDAS_DIR}")
+    target = os.path.join(build_dir, name)
+    shutil.rmtree(target, ignore_errors=True)
+    shutil.copytree(source, target, ignore=_IGNORE)
+    for entry in sorted(os.listdir(COMMON_DIR)):
+        if entry.endswith(".py"):
+            if os.path.exists(os.path.join(target, entry)):
+                raise RuntimeError(f"{name}/{entry} choca con lambda_functions/common/{entry}")
+            shutil.copy2(os.path.join(COMMON_DIR, entry), target)
+    requirements = os.path.join(target, "requirements.txt")
+    if install and os.path.exists(requirements):
+        subprocess.run(
+            [sys.executable, "-m", "pip", "install", "--quiet", "-r", requirements, "-t", target],
+            check=True,
+        )
+    return target
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Empaqueta las Lambdas con los módulos compartidos")
+    parser.add_argument("names", nargs="*", default=list(LAMBDAS), help="Lambdas a empaquetar")
+    parser.add_argument("--deps", action="store_true", help="Instalar el requirements.txt de cada Lambda")
+    parser.add_argument("--zip", action="store_true", help="Generar también build/lambdas/<nombre>.zip")
+    args = parser.parse_args(argv)
+
+    for name in args.names:
+        target = stage_lambda(name, install=args.deps)
+        print(f"{name}: {target}")
+        if args.zip:
+            archive = shutil.make_archive(target, "zip", target)
+            print(f"{name}: {archive}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
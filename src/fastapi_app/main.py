@@ -2,10 +2,12 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Body, Query, Path
 from dotenv import load_dotenv
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List
 import os
 import json
 
+from lambda_functions.common.result_writer import is_manifest_key, select_partitions
+
 load_dotenv()
 
 app = FastAPI(
@@ -87,8 +89,17 @@ def get_status(execution_arn: str = Path(..., description="Step Functions execut
 
 
 @app.get("/download")
-def download(key: str = Query(..., description="S3 object key to download")):
-    """Return a presigned URL to download the final JSON from S3.
+def download(
+    key: str = Query(..., description="S3 object key to download"),
+    symbol: Optional[List[str]] = Query(None, description="Partitioned results only: symbols to include"),
+    start_ms: Optional[int] = Query(None, description="Partitioned results only: range start (ms)"),
+    end_ms: Optional[int] = Query(None, description="Partitioned results only: range end (ms)"),
+):
+    """Return a presigned URL to download the final result from S3.
+
+    If `key` is a partitioned result's `manifest.json`, return one presigned URL per
+    partition (symbol/day) matching the optional filters, so clients can fetch only
+    what they need, in parallel.
 
     Requires `RESULTS_BUCKET` env var to be set.
     """
@@ -99,11 +110,22 @@ def download(key: str = Query(..., description="S3 object key to download")):
     try:
         import boto3
         s3 = boto3.client("s3")
-        url = s3.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": bucket, "Key": key},
-            ExpiresIn=600,
-        )
-        return {"presigned_url": url}
+
+        def presign(object_key: str) -> str:
+            return s3.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": bucket, "Key": object_key},
+                ExpiresIn=600,
+            )
+
+        if is_manifest_key(key):
+            manifest = json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+            partitions = select_partitions(manifest, symbol, start_ms, end_ms)
+            return {
+                "manifest_url": presign(key),
+                "total_partitions": len(manifest.get("partitions") or []),
+                "partitions": [{**p, "presigned_url": presign(p["key"])} for p in partitions],
+            }
+        return {"presigned_url": presign(key)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,46 @@
+import io
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "lambda_functions" / "common"))
+
+import columnar  # noqa: E402
+from columnar import decode_orders, encode_orders, read_columns  # noqa: E402
+
+
+def _orders(n):
+    return [
+        {
+            "orderId": str(i),
+            "symbol": "BTCUSDT" if i % 3 else "ETHUSDT",
+            "side": "buy" if i % 2 else "sell",
+            "status": "filled",
+            "_market": "spot" if i % 4 else "futures",
+            "price": f"{i * 1.5:.2f}",
+            "cTime": str(1_700_000_000_000 + i),
+            "uTime": str(1_700_000_000_500 + i),
+            **({"feeDetail": {"BGB": {"totalFee": "-0.1"}}} if i % 5 == 0 else {}),
+        }
+        for i in range(n)
+    ]
+
+
+def test_bcol_roundtrip_with_row_groups(monkeypatch):
+    monkeypatch.setattr(columnar, "ROW_GROUP_SIZE", 7)
+    orders = _orders(30) + [{"orderId": "x", "cTime": "not-a-number", "extra": None}]
+
+    body = encode_orders(orders, "bcol")
+
+    assert decode_orders(io.BytesIO(body), "k.bcol.gz") == [{k: v for k, v in o.items() if v is not None} for o in orders]
+
+
+def test_read_columns_projects_typed_values():
+    orders = _orders(10)
+    body = encode_orders(orders, "bcol")
+
+    cols = read_columns(io.BytesIO(body), "k.bcol.gz", ["cTime", "symbol", "missing"])
+
+    assert cols["cTime"] == [1_700_000_000_000 + i for i in range(10)]
+    assert cols["symbol"] == [o["symbol"] for o in orders]
+    assert cols["missing"] == [None] * 10
+    assert len(body) < len(str(orders).encode())
@@ -16,3 +16,69 @@ def test_handler_missing_state_machine():
     os.environ.pop("STATE_MACHINE_ARN", None)
     response = handler({"symbols": ["BTCUSDT"]}, None)
     assert response["statusCode"] == 500
+
+
+def _load_lambda_coordinator(monkeypatch):
+    import importlib.util
+    from pathlib import Path
+
+    monkeypatch.setenv("STATE_MACHINE_ARN", "arn:aws:states:us-east-1:000000000000:stateMachine:test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.delenv("WORKER_FUNCTION_NAME", raising=False)
+    path = Path(__file__).resolve().parents[1] / "lambda_functions" / "coordinator" / "app.py"
+    spec = importlib.util.spec_from_file_location("coordinator_app", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_map_output_with_full_inline_payloads_stays_under_state_limit(monkeypatch):
+    import random
+    from pathlib import Path
+
+    lambdas = Path(__file__).resolve().parents[1] / "lambda_functions"
+    monkeypatch.syspath_prepend(str(lambdas / "common"))
+    monkeypatch.syspath_prepend(str(lambdas / "worker"))
+    from response_optimizer import pack_orders_inline
+
+    coordinator = _load_lambda_coordinator(monkeypatch)
+    inputs = []
+
+    class FakeStepFunctions:
+        def start_execution(self, stateMachineArn, input):
+            inputs.append(json.loads(input))
+            return {"executionArn": "arn:exec"}
+
+    monkeypatch.setattr(coordinator, "sf", FakeStepFunctions())
+    rng = random.Random(7)
+
+    def worker_response(item, worker_max_bytes=2048):
+        """Respuesta del worker con tantas órdenes (poco comprimibles) como entran en su presupuesto."""
+        budget = min(worker_max_bytes, item["inline_max_bytes"])
+        envelope = {"symbol": item["symbol"], "error": None, "execution_time_seconds": 12.345, "lambda_optimized": True}
+        # Ninguna orden comprimida baja de 10 bytes: búsqueda binaria del prefijo más largo que entra
+        orders = [{"orderId": "%018d" % rng.getrandbits(59), "symbol": item["symbol"], "cTime": str(rng.getrandbits(40)),
+                   "price": str(rng.random()), "size": str(rng.random())} for _ in range(budget // 10)]
+        low, high, best = 1, len(orders), None
+        while low <= high:
+            mid = (low + high) // 2
+            inline = pack_orders_inline(orders[:mid], budget)
+            if inline is not None:
+                low, best = mid + 1, {**envelope, "count": mid, **inline, "data_location": "inline"}
+            else:
+                high = mid - 1
+        if best is not None:
+            return best
+        key = f"per-symbol/{item['symbol']}/20260101T000000Z-{'f' * 32}.ndjson.gz"
+        return {**envelope, "count": 5000, "s3_key": key, "s3_uri": f"s3://bitget-results-bucket/{key}",
+                "public_url": f"https://bitget-results-bucket.s3.us-east-1.amazonaws.com/{key}", "data_location": "s3"}
+
+    for symbol_count in (10, 55, 100, 250):
+        response = coordinator.handler({"symbols": [f"SYM{i}USDT" for i in range(symbol_count)], "prefilter": False}, None)
+        assert response["statusCode"] == 202
+        map_output = [worker_response(item) for item in inputs[-1]["symbols"]]
+        size = len(json.dumps(map_output).encode("utf-8"))
+        assert size < coordinator.STATE_MAX_BYTES, (symbol_count, size)
+
+    assert inputs[0]["symbols"][0]["inline_max_bytes"] > 2048    # pocos símbolos: manda el límite del worker
+    assert inputs[-1]["symbols"][0]["inline_max_bytes"] == 0     # muchos: solo punteros a S3
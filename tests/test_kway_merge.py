@@ -0,0 +1,256 @@
+import base64
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import sys
+import threading
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1] / "lambda_functions"
+sys.path.insert(0, str(ROOT / "common"))
+sys.path.insert(0, str(ROOT / "aggregator"))
+
+from kway_merge import KWayMerge  # noqa: E402
+from order_stats import rollup_rows, summarize_orders  # noqa: E402
+from result_writer import S3NdjsonWriter, build_sidecar, iter_orders, sidecar_key  # noqa: E402
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        self.objects[Key] = (Body, Metadata or {})
+
+    def get_object(self, Bucket, Key):
+        body, metadata = self.objects[Key]
+        return {"Body": io.BytesIO(body), "Metadata": metadata}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, **kwargs):
+        self.uploads = {"parts": {}, "metadata": Metadata or {}}
+        return {"UploadId": "u1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads["parts"][PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource, CopySourceRange):
+        start, end = map(int, CopySourceRange.split("=")[1].split("-"))
+        self.uploads["parts"][PartNumber] = self.objects[CopySource["Key"]][0][start:end + 1]
+        self.copied = getattr(self, "copied", 0) + 1
+        return {"CopyPartResult": {"ETag": f"etag-{PartNumber}"}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        body = b"".join(self.uploads["parts"][p["PartNumber"]] for p in MultipartUpload["Parts"])
+        self.objects[Key] = (body, self.uploads["metadata"])
+
+
+def _run(market, times):
+    return [{"orderId": f"{market}-{t}", "_market": market, "cTime": str(t)} for t in sorted(times, reverse=True)]
+
+
+def test_merge_is_global_desc_and_drops_duplicates():
+    spot = _run("spot", [1, 5, 9])
+    futures = _run("futures", [2, 5, 8])
+    merged = KWayMerge([iter(spot), iter(futures), iter(_run("spot", [5]))])
+
+    out = list(merged)
+
+    assert [int(o["cTime"]) for o in out] == [9, 8, 5, 5, 2, 1]
+    assert merged.duplicates == 1
+
+
+def _load_aggregator(monkeypatch, **env):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("RESULTS_BUCKET", "bucket")
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    spec = importlib.util.spec_from_file_location("aggregator_app", ROOT / "aggregator" / "app.py")
+    aggregator = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(aggregator)
+    return aggregator
+
+
+def test_handler_streams_merged_json_document(monkeypatch):
+    aggregator = _load_aggregator(monkeypatch, MERGE_STREAM_MIN_ORDERS="2")
+    s3 = FakeS3()
+    monkeypatch.setattr(aggregator, "S3", s3)
+
+    for symbol, times in (("BTCUSDT", [10, 30, 50]), ("ETHUSDT", [20, 40])):
+        with S3NdjsonWriter(s3, "bucket", f"per-symbol/{symbol}/x.ndjson.gz",
+                            metadata={"sort-order": "ctime-desc"}) as writer:
+            writer.write_many(_run(symbol, times))
+    legacy = {"symbol": "XRPUSDT", "orders": _run("XRPUSDT", [35, 5])}  # inline y sin ordenar
+    legacy["orders"].reverse()
+
+    summary = aggregator.handler([
+        {"symbol": "BTCUSDT", "count": 3, "s3_key": "per-symbol/BTCUSDT/x.ndjson.gz"},
+        {"symbol": "ETHUSDT", "count": 2, "s3_key": "per-symbol/ETHUSDT/x.ndjson.gz"},
+        legacy,
+    ], None)
+
+    body, _ = s3.objects[summary["s3_uri"].split("bucket/", 1)[1]]
+    document = json.loads(body)
+    assert [int(o["cTime"]) for o in document["orders"]] == [50, 40, 35, 30, 20, 10, 5]
+    assert document["total_orders"] == summary["total_orders"] == 7
+    assert summary["symbols_with_data"] == 3
+    assert summary["order_stats"]["count"] == 7 and summary["order_stats"]["max_ctime"] == 50
+    rollups = json.loads(gzip.decompress(s3.objects[summary["rollups_s3_uri"].split("bucket/", 1)[1]][0]))
+    assert rollups["symbols"] == ["BTCUSDT", "ETHUSDT", "XRPUSDT"] and sum(rollups["daily"]["count"]) == 7
+    assert "per-symbol/BTCUSDT/x.ndjson.gz" not in s3.objects
+
+
+def test_prefetch_reads_files_concurrently(monkeypatch):
+    aggregator = _load_aggregator(monkeypatch, PREFETCH_CONCURRENCY="4")
+    s3 = FakeS3()
+    barrier = threading.Barrier(4, timeout=5)  # solo se libera con 4 lecturas en vuelo a la vez
+    get_object = s3.get_object
+
+    def slow_get_object(Bucket, Key):
+        barrier.wait()
+        return get_object(Bucket, Key)
+
+    s3.get_object = slow_get_object
+    monkeypatch.setattr(aggregator, "S3", s3)
+    for i in range(8):
+        s3.put_object("bucket", f"k{i}.json", json.dumps({"orders": _run("spot", [i])}).encode())
+
+    done = list(aggregator._prefetch_runs([(i, f"k{i}.json", 1) for i in range(8)]))
+
+    assert sorted(run_id for run_id, _, _ in done) == list(range(8))
+    assert all(error is None and len(run) == 1 and sidecar is None for _, (run, sidecar), error in done)
+
+
+def test_tree_reduce_matches_single_level(monkeypatch):
+    aggregator = _load_aggregator(monkeypatch)
+    s3 = FakeS3()
+    monkeypatch.setattr(aggregator, "S3", s3)
+    items = []
+    for n in range(7):
+        key = f"per-symbol/S{n}/x.ndjson.gz"
+        with S3NdjsonWriter(s3, "bucket", key, metadata={"sort-order": "ctime-desc"}) as writer:
+            writer.write_many(_run(f"S{n}", [n, n + 10, n + 20] if n != 3 else []))
+        items.append({"symbol": f"S{n}", "count": 3, "s3_key": key})
+
+    summary = aggregator.tree_reduce(items, fan_in=2)
+
+    document = json.loads(s3.objects[summary["s3_uri"].split("bucket/", 1)[1]][0])
+    times = [int(o["cTime"]) for o in document["orders"]]
+    assert times == sorted(times, reverse=True) and len(times) == 18
+    assert summary["reduce_levels"] == 3
+    assert (summary["symbols_processed"], summary["symbols_with_data"]) == (7, 6)
+    assert summary["error_summary"] == {"api_error": 1}  # S3 sin órdenes
+    assert not [k for k in s3.objects if k.startswith("partials/")]
+
+
+def test_reduce_loop_of_the_state_machine_keeps_each_item_once(monkeypatch):
+    """Recorre PlanReduce -> ReduceLevel -> ... -> Aggregate de init.json con sus rutas JSON."""
+    aggregator = _load_aggregator(monkeypatch)
+    s3 = FakeS3()
+    monkeypatch.setattr(aggregator, "S3", s3)
+    monkeypatch.setattr(aggregator, "REDUCE_FAN_IN", 2)
+    states = json.loads((ROOT.parent / "step_functions" / "init.json").read_text(encoding="utf-8"))["States"]
+    items = []
+    for n in range(5):
+        key = f"per-symbol/S{n}/x.ndjson.gz"
+        with S3NdjsonWriter(s3, "bucket", key, metadata={"sort-order": "ctime-desc"}) as writer:
+            writer.write_many(_run(f"S{n}", [n, n + 10]))
+        items.append({"symbol": f"S{n}", "count": 2, "s3_key": key})
+
+    def path(data, expr):
+        for part in expr.split(".")[1:]:
+            data = data[part]
+        return data
+
+    def put(data, expr, value):
+        parts = expr.split(".")[1:]
+        for part in parts[:-1]:
+            data = data[part]
+        data[parts[-1]] = value
+
+    data, name, visited = {"perSymbolResults": items}, "PlanReduce", []
+    while name != "Aggregate":
+        visited.append(name)
+        state = states[name]
+        if name == "PlanReduce":
+            put(data, state["ResultPath"], aggregator.handler({"mode": "plan", "items": path(data, state["Parameters"]["items.$"])}, None))
+        elif name == "ReduceLevel":
+            slices = path(data, state["ItemsPath"])
+            put(data, state["ResultPath"], [aggregator.handler({"mode": "partial", "items": s}, None) for s in slices])
+        dumped = json.dumps(data)
+        assert all(dumped.count(key) <= 1 for key in [i["s3_key"] for i in items] + list(s3.objects))
+        if state["Type"] == "Choice":
+            name = state["Choices"][0]["Next"] if path(data, state["Choices"][0]["Variable"]) is False else state["Default"]
+        else:
+            name = state["Next"]
+
+    summary = aggregator.handler(path(data, states["Aggregate"]["InputPath"]), None)
+
+    assert visited == ["PlanReduce", "NeedsReduce", "ReduceLevel"] * 2 + ["PlanReduce", "NeedsReduce"]
+    assert summary["total_orders"] == 10 and summary["reduce_levels"] == 3
+
+
+def test_compose_mode_copies_sources_and_writes_manifest(monkeypatch):
+    aggregator = _load_aggregator(monkeypatch, AGGREGATE_MODE="compose")
+    monkeypatch.setattr(sys.modules["s3_compose"], "MIN_PART_SIZE", 1000)
+    s3 = FakeS3()
+    monkeypatch.setattr(aggregator, "S3", s3)
+    items = []
+    for symbol, n in (("ETHUSDT", 40), ("ADAUSDT", 2), ("BTCUSDT", 60)):
+        key = f"per-symbol/{symbol}/x.ndjson.gz"
+        orders = [{**o, "tag": hashlib.sha256(o["orderId"].encode()).hexdigest()} for o in _run(symbol, range(n))]
+        with S3NdjsonWriter(s3, "bucket", key) as writer:
+            writer.write_many(orders)
+        s3.put_object("bucket", sidecar_key(key), json.dumps(build_sidecar(symbol, key, summarize_orders(orders), writer.stats)).encode())
+        items.append({"symbol": symbol, "count": n, "s3_key": key})
+    inline = "".join(json.dumps(o) + "\n" for o in _run("DOTUSDT", [3, 2, 1])).encode()
+    items.append({"symbol": "DOTUSDT", "count": 3, "orders_gz": base64.b64encode(gzip.compress(inline)).decode()})
+
+    summary = aggregator.handler(items, None)
+
+    final_key = summary["s3_uri"].split("bucket/", 1)[1]
+    body = s3.objects[final_key][0]
+    assert summary["aggregation_mode"] == "compose" and summary["total_orders"] == 105
+    assert summary["order_stats"]["markets"] == {"ETHUSDT": 40, "ADAUSDT": 2, "BTCUSDT": 60, "DOTUSDT": 3}
+    assert len(list(iter_orders(io.BytesIO(body), final_key))) == 105
+    assert s3.copied >= 1 and summary["compose"]["bytes_downloaded"] > 0
+    manifest = json.loads(s3.objects[final_key + ".manifest.json"][0])
+    assert [e["symbol"] for e in manifest["entries"]] == ["ADAUSDT", "BTCUSDT", "DOTUSDT", "ETHUSDT"]
+    btc = manifest["entries"][1]
+    lines = gzip.decompress(body[btc["offset"]:btc["offset"] + btc["length"]]).splitlines()
+    assert len(lines) == 60 and json.loads(lines[0])["_market"] == "BTCUSDT"
+
+
+def test_process_mode_matches_single_process(monkeypatch):
+    outputs = []
+    for processes in ("0", "2"):
+        aggregator = _load_aggregator(monkeypatch, AGGREGATE_PROCESSES=processes, RESULTS_FORMAT="ndjson",
+                                      ENCODE_CHUNK_MB="1")
+        monkeypatch.setattr(aggregator, "_init_process", lambda: None)  # los hijos heredan el FakeS3 por fork
+        s3 = FakeS3()
+        monkeypatch.setattr(aggregator, "S3", s3)
+        items = []
+        for n, symbol in enumerate(("BTCUSDT", "ETHUSDT", "XRPUSDT")):
+            key = f"per-symbol/{symbol}/x.ndjson.gz"
+            orders = _run("spot", range(n, 3000, 3)) + ([{"orderId": "spot-0", "_market": "spot", "cTime": "0"}] if n else [])
+            orders.sort(key=lambda o: int(o["cTime"]), reverse=True)
+            with S3NdjsonWriter(s3, "bucket", key, metadata={"sort-order": "ctime-desc"}) as writer:
+                writer.write_many(orders)
+            items.append({"symbol": symbol, "count": len(orders), "s3_key": key})
+        items.append({"symbol": "ADAUSDT", "orders": _run("ADAUSDT", [7, 1])})
+
+        summary = aggregator.handler(items, None)
+
+        final_key = summary["s3_uri"].split("bucket/", 1)[1]
+        rollups = json.loads(gzip.decompress(s3.objects[summary["rollups_s3_uri"].split("bucket/", 1)[1]][0]))
+        hourly = sorted(rollup_rows(rollups, "hourly"), key=lambda r: (r["symbol"], r["start_ms"]))
+        outputs.append((gzip.decompress(s3.objects[final_key][0]), summary["total_orders"],
+                        summary["duplicates_dropped"], summary["order_stats"], hourly))
+
+    assert outputs[0] == outputs[1]
+    assert outputs[1][1:3] == (3002, 2)
@@ -0,0 +1,214 @@
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app.core.config import config  # noqa: E402
+
+config.DATABASE_URL = config.DATABASE_URL or "sqlite://"
+
+import pytest  # noqa: E402
+from sqlalchemy import create_engine, func, select  # noqa: E402
+from sqlalchemy.dialects import mysql  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.models.database import Base, Order, ingest_order_rows, order_insert_statement  # noqa: E402
+from app.services import database_service  # noqa: E402
+
+
+@pytest.fixture
+def db_service(tmp_path, monkeypatch):
+    """DatabaseService sobre un sqlite en archivo: una conexión por sesión, así que sirve desde varios hilos."""
+    # Con StaticPool el close() de un hilo deshace la transacción de otro
+    engine = create_engine(f"sqlite:///{tmp_path / 'orders.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(database_service, "get_db_session", sessionmaker(bind=engine))
+    service = database_service.DatabaseService.__new__(database_service.DatabaseService)
+    service.db_available = True
+    return service
+
+
+def _rows(execution_arn, ids):
+    return [{"execution_arn": execution_arn, "symbol": "BTCUSDT", "order_id": str(i), "price": "1", "c_time": i} for i in ids]
+
+
+def test_chunked_ingest_skips_duplicates_and_invalid_rows():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    stats = ingest_order_rows(session, _rows("arn", range(10)) + _rows("arn", [3, 4]) + [{"order_id": None}], chunk_size=4)
+    again = ingest_order_rows(session, _rows("arn", range(5, 12)), chunk_size=100)
+
+    assert (stats["rows"], stats["duplicates"], stats["skipped"], stats["chunks"]) == (10, 2, 1, 3)
+    assert (again["rows"], again["duplicates"], again["chunks"]) == (2, 5, 1)
+    assert session.scalar(select(func.count()).select_from(Order)) == 12
+
+
+def test_mysql_statement_upserts_on_duplicate_key():
+    sql = str(order_insert_statement("mysql").compile(dialect=mysql.dialect()))
+
+    assert "ON DUPLICATE KEY UPDATE" in sql and "price = VALUES(price)" in sql
+    assert "order_id = VALUES" not in sql
+
+
+def test_save_execution_data_streams_document_and_takes_summary_from_it(db_service):
+    import io
+    import json
+
+    from app.models.database import ExecutionResult
+    from app.services.ingest_stream import open_orders
+
+    orders = [{"orderId": str(i), "symbol": "ETHUSDT", "cTime": str(i)} for i in range(2500)]
+    body = io.BytesIO(json.dumps({"orders": orders, "total_orders": 2500, "symbols_processed": 3}).encode())
+
+    result = db_service.save_execution_data({"status": "SUCCEEDED", "executionArn": "arn-1", "result": {}},
+                                            orders=open_orders(body, "results/x.json"))
+
+    session = database_service.get_db_session()
+    record = session.scalars(select(ExecutionResult)).one()
+    assert result["success"] and result["orders_saved"] == 2500
+    assert (record.total_orders, record.total_symbols) == (2500, 3)
+    assert session.scalar(select(func.count()).select_from(Order)) == 2500
+
+
+def test_sharded_ingest_retries_only_failed_shards(db_service, monkeypatch):
+    import gzip
+    import io
+    import json
+
+    from app.models.database import IngestShard
+
+    objects, fail = {}, {"SOLUSDT"}
+    for symbol in ("BTCUSDT", "ETHUSDT", "SOLUSDT"):
+        for day in ("2024-01-01", "2024-01-02"):
+            lines = "".join(json.dumps({"orderId": f"{symbol}-{day}-{i}", "symbol": symbol, "cTime": str(i)}) + "\n"
+                            for i in range(300))
+            objects[f"r/symbol={symbol}/date={day}/part-00000.ndjson.gz"] = gzip.compress(lines.encode())
+    manifest = {"partitions": [{"symbol": k.split("=")[1].split("/")[0], "key": k} for k in objects]}
+    objects["r/manifest.json"] = json.dumps(manifest).encode()
+
+    class FakeS3:
+        def get_object(self, Bucket, Key, **kwargs):
+            if fail and Key.startswith("r/symbol=SOLUSDT/"):
+                raise IOError("connection reset")
+            return {"Body": io.BytesIO(objects[Key])}
+
+    monkeypatch.setattr(database_service.boto3, "client", lambda *a, **k: FakeS3())
+    monkeypatch.setattr(config, "INGEST_SHARD_RETRIES", 0)
+    data = {"status": "SUCCEEDED", "executionArn": "arn-2", "result": {"s3_uri": "s3://b/r/manifest.json", "total_orders": 1800}}
+
+    first = db_service.save_execution_data(data)
+    fail.clear()
+    second = db_service.save_execution_data(data)
+
+    session = database_service.get_db_session()
+    assert not first["success"] and "SOLUSDT" in first["error"]
+    assert second["success"] and second["orders_saved"] == 1800
+    assert (second["ingest"]["shards_loaded"], second["ingest"]["rows_loaded"]) == (1, 600)
+    assert session.scalar(select(func.count()).select_from(Order)) == 1800
+    assert {s.shard: s.attempts for s in session.scalars(select(IngestShard))} == {"BTCUSDT": 1, "ETHUSDT": 1, "SOLUSDT": 2}
+
+
+def test_terminal_status_is_ingested_once_and_then_served_from_database(db_service, monkeypatch):
+    import json
+    import threading
+
+    from app.services.orders_service import OrdersService
+
+    saves = []
+    save_execution_data = db_service.save_execution_data
+    monkeypatch.setattr(db_service, "save_execution_data", lambda data: saves.append(data) or save_execution_data(data))
+
+    class FakeStepFunctions:
+        calls = 0
+
+        def describe_execution(self, executionArn):
+            if executionArn == "arn-running":
+                return {"status": "RUNNING"}
+            self.calls += 1
+            output = {"orders": [{"orderId": "1", "symbol": "BTCUSDT", "cTime": "1"}], "total_orders": 1}
+            return {"status": "SUCCEEDED", "output": json.dumps(output)}
+
+    service = OrdersService.__new__(OrdersService)
+    service.sf_client = FakeStepFunctions()
+    service.db_service = db_service
+    service._status_locks = {}
+    service._status_locks_guard = threading.Lock()
+    service.ingest_jobs = None  # ingesta dentro del request
+
+    threads = [threading.Thread(target=service.get_execution_status, args=("arn-t",)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    again = service.get_execution_status("arn-t")
+    running = service.get_execution_status("arn-running")
+
+    assert service.sf_client.calls == 1 and len(saves) == 1
+    assert again["served_from"] == "database" and again["status"] == "SUCCEEDED" and again["ingested_at"]
+    assert again["result"]["database_save"]["success"] is True
+    assert running["status"] == "RUNNING" and service._status_locks == {}  # sin locks huérfanos por ARN
+
+
+def test_background_runner_polls_with_backoff_retries_and_resumes(db_service):
+    import time
+
+    from app.services.ingest_jobs import IngestJobRunner
+
+    calls = []
+
+    def ingest(execution_arn):
+        calls.append(execution_arn)
+        if execution_arn == "arn-broken":
+            raise RuntimeError("S3 no disponible")
+        if calls.count(execution_arn) < 3:
+            return {"status": "RUNNING"}
+        return {"status": "SUCCEEDED", "ingested_at": "2026-01-01T00:00:00", "result": {"database_save": {"orders_saved": 7}}}
+
+    def wait_for(execution_arn, status):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            progress = db_service.get_ingest_progress(execution_arn)
+            if progress and progress["status"] == status:
+                return progress
+            time.sleep(0.01)
+        raise AssertionError(db_service.get_ingest_progress(execution_arn))
+
+    runner = IngestJobRunner(ingest, db_service, workers=2, max_attempts=2, base_delay=0.01, max_delay=0.05).start()
+    assert runner.watch("arn-ok") and not runner.watch("arn-ok")
+    runner.submit("arn-broken")
+
+    done = wait_for("arn-ok", "done")
+    failed = wait_for("arn-broken", "failed")
+    runner.stop()
+
+    assert (done["polls"], done["orders_saved"], done["execution_status"]) == (2, 7, "SUCCEEDED")
+    assert (failed["attempts"], failed["error"]) == (2, "S3 no disponible")
+    assert calls.count("arn-ok") == 3 and calls.count("arn-broken") == 2
+
+    db_service.save_ingest_job("arn-restart", status="running")  # el proceso murió a mitad de la ingesta
+    calls.extend(["arn-restart", "arn-restart"])
+    runner = IngestJobRunner(ingest, db_service, max_attempts=2, base_delay=0.01).start()
+    assert wait_for("arn-restart", "done")["finished_at"]
+
+    # Un cliente que sigue consultando no reabre el trabajo fallido; la notificación de fin sí
+    assert not runner.watch("arn-broken", finished=True)
+    assert db_service.get_ingest_job("arn-broken")["attempts"] == 2
+    assert runner.submit("arn-broken")
+    assert wait_for("arn-broken", "failed")["attempts"] == 2 and calls.count("arn-broken") == 4
+    runner.stop()
+
+
+def test_ingest_job_is_claimed_by_a_single_process(db_service):
+    from datetime import timedelta
+
+    from app.models.database import get_bogota_now
+
+    stale_before = get_bogota_now() - timedelta(hours=1)
+
+    db_service.save_ingest_job("arn", status="waiting")
+    assert db_service.claim_ingest_job("arn", stale_before)
+    assert not db_service.claim_ingest_job("arn", stale_before)  # ya está running en otro proceso
+    assert db_service.claim_ingest_job("arn", get_bogota_now() + timedelta(seconds=1))  # running abandonado
+    db_service.save_ingest_job("arn", status="failed")
+    assert not db_service.claim_ingest_job("arn", stale_before)
@@ -0,0 +1,84 @@
+import json
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "lambda_functions" / "common"))
+
+import order_stats  # noqa: E402
+from order_stats import RollupBuilder, merge_summaries, rollup_rows, summarize_orders  # noqa: E402
+
+
+def test_summaries_cover_notional_and_fees_and_merge():
+    spot = summarize_orders([
+        {"side": "buy", "_market": "spot_history", "quoteVolume": "100.5", "cTime": "2000",
+         "feeDetail": json.dumps({"BGB": {"totalFee": "-0.01"}})},
+        {"side": "sell", "_market": "spot_history", "priceAvg": "2", "baseVolume": "3", "cTime": "1000"},
+    ])
+    futures = summarize_orders([
+        {"side": "open_long", "_market": "futures", "filledAmount": "50", "fee": "-0.03", "marginCoin": "USDT",
+         "cTime": "3000"},
+    ])
+
+    total = merge_summaries([spot, futures, None])
+
+    assert spot["sides"] == {"buy": {"count": 1, "notional": 100.5}, "sell": {"count": 1, "notional": 6.0}}
+    assert (total["count"], total["min_ctime"], total["max_ctime"]) == (3, 1000, 3000)
+    assert total["markets"] == {"spot_history": 2, "futures": 1}
+    assert total["fees"] == {"BGB": -0.01, "USDT": -0.03}
+
+
+def test_rollups_group_by_symbol_and_bucket(monkeypatch):
+    monkeypatch.setattr(order_stats, "numpy", None)  # mismo resultado que el camino vectorizado
+    hour, day = 3_600_000, 86_400_000
+    builder = RollupBuilder()
+    orders = [
+        {"symbol": "BTCUSDT", "side": "buy", "baseVolume": "1", "quoteVolume": "100", "cTime": str(day + 10),
+         "fee": "-0.1", "marginCoin": "USDT"},
+        {"symbol": "BTCUSDT", "side": "sell", "baseVolume": "2", "quoteVolume": "220", "cTime": str(day + 20),
+         "feeDetail": {"BTC": {"totalFee": "-0.001"}}},
+        {"symbol": "BTCUSDT", "side": "close_short", "baseVolume": "1", "quoteVolume": "90", "cTime": str(day + hour),
+         "fee": "-0.2", "marginCoin": "USDT"},
+        {"symbol": "ETHUSDT", "side": "sell", "priceAvg": "10", "baseVolume": "3", "cTime": str(2 * day)},
+        {"symbol": "ETHUSDT", "cTime": "bad"},
+    ]
+    assert list(builder.feed(orders)) == orders
+
+    doc = json.loads(json.dumps(builder.build()))
+    hourly = rollup_rows(doc, "hourly", symbol="BTCUSDT")
+    daily = rollup_rows(doc, "daily")
+
+    assert [(r["start_ms"], r["count"], r["buy_count"], r["sell_count"]) for r in hourly] == [(day, 2, 1, 1), (day + hour, 1, 1, 0)]
+    assert hourly[0]["fees"] == {"USDT": -0.1, "BTC": -0.001}
+    assert daily[0] == {"symbol": "BTCUSDT", "start_ms": day, "count": 3, "base_volume": 4.0, "quote_volume": 410.0,
+                        "buy_count": 2, "sell_count": 1, "buy_quote": 190.0, "sell_quote": 220.0,
+                        "fees": {"USDT": -0.3, "BTC": -0.001}}
+    assert [(r["symbol"], r["quote_volume"]) for r in daily[1:]] == [("ETHUSDT", 30.0)]
+    assert rollup_rows(doc, "daily", start_ms=2 * day) == daily[1:]
+
+
+def test_numpy_and_python_group_by_build_the_same_rollups(monkeypatch):
+    numpy = pytest.importorskip("numpy")
+    rng = random.Random(11)
+    coins = ["USDT", "BTC", "BGB"]
+    orders = []
+    for _ in range(2000):
+        order = {"symbol": rng.choice(["BTCUSDT", "ETHUSDT", "SOLUSDT"]), "side": rng.choice(["buy", "sell", "open_long"]),
+                 "baseVolume": str(round(rng.random() * 5, 6)), "quoteVolume": str(round(rng.random() * 1000, 4)),
+                 "cTime": str(rng.randrange(0, 10 * 86_400_000))}
+        if rng.random() < 0.5:
+            order.update({"fee": str(-round(rng.random(), 6)), "marginCoin": rng.choice(coins)})
+        orders.append(order)
+    orders.append({"symbol": "ETHUSDT", "cTime": "bad"})
+
+    def build():
+        builder = RollupBuilder()
+        list(builder.feed(orders))
+        return json.loads(json.dumps(builder.build()))
+
+    monkeypatch.setattr(order_stats, "numpy", numpy)
+    vectorized = build()
+    monkeypatch.setattr(order_stats, "numpy", None)
+    assert build() == vectorized
@@ -0,0 +1,71 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "lambda_functions" / "worker"))
+
+from range_planner import DAY_MS, EndpointWindow, PageRun, fetch_range, plan_windows  # noqa: E402
+
+
+def test_plan_windows_respects_max_window():
+    windows = plan_windows(0, 90 * DAY_MS - 1, max_window_ms=30 * DAY_MS)
+
+    assert len(windows) == 3
+    assert windows[0][1] == 90 * DAY_MS - 1
+    assert windows[-1][0] == 0
+    assert all(upper - lower + 1 <= 30 * DAY_MS for lower, upper in windows)
+
+
+def test_dense_window_is_bisected_and_deduped():
+    # 1 orden por minuto durante 1 día; cada llamada trae como máximo 100 órdenes por página
+    orders = [{"orderId": str(t), "cTime": str(t)} for t in range(0, DAY_MS, 60_000)]
+    calls = []
+
+    async def fetch_pages(lower, upper, budget, cursor):
+        calls.append((lower, upper))
+        in_window = [o for o in orders if lower <= int(o["cTime"]) <= upper]
+        in_window.sort(key=lambda o: int(o["cTime"]), reverse=True)
+        page = in_window[:budget * 100]
+        if len(page) < len(in_window):
+            return PageRun(page, exhausted=True, resume_end_ms=int(page[-1]["cTime"]) - 1)
+        return PageRun(page)
+
+    result = asyncio.run(fetch_range(fetch_pages, 0, DAY_MS - 1, EndpointWindow(max_window_ms=None), page_budget=2))
+
+    assert result.complete
+    assert len(result.orders) == len(orders)
+    assert len(calls) > 1
+    assert [o["cTime"] for o in result.orders] == sorted((o["cTime"] for o in orders), key=int, reverse=True)
+
+
+def test_unsplittable_remainder_is_reported():
+    async def fetch_pages(lower, upper, budget, cursor):
+        return PageRun([{"orderId": str(upper), "cTime": str(upper)}], exhausted=True, resume_end_ms=upper - 1)
+
+    result = asyncio.run(fetch_range(
+        fetch_pages, 0, DAY_MS - 1, EndpointWindow(max_window_ms=None), page_budget=1, can_split=lambda: False
+    ))
+
+    assert not result.complete
+    assert result.truncated == [{"start_ms": 0, "end_ms": DAY_MS - 2, "reason": "page budget exhausted"}]
+
+
+def test_truncated_window_resumes_from_cursor():
+    calls = []
+
+    async def fetch_pages(lower, upper, budget, cursor):
+        calls.append(cursor)
+        if cursor is None:
+            return PageRun([{"orderId": "2", "cTime": "2000"}], exhausted=True, resume_end_ms=1999,
+                           error="time constraint", cursor={"idLessThan": "2"})
+        return PageRun([{"orderId": "1", "cTime": "1000"}])
+
+    window = EndpointWindow(max_window_ms=None)
+    first = asyncio.run(fetch_range(fetch_pages, 0, 5000, window, page_budget=1))
+    assert first.truncated == [{"start_ms": 0, "end_ms": 1999, "reason": "time constraint", "cursor": {"idLessThan": "2"}}]
+
+    # Otra invocación retoma solo el tramo pendiente, con su cursor
+    second = asyncio.run(fetch_range(fetch_pages, 0, 5000, window, page_budget=1, resume=first.truncated))
+    assert second.complete
+    assert [o["orderId"] for o in second.orders] == ["1"]
+    assert calls == [None, {"idLessThan": "2"}]
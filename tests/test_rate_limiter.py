@@ -0,0 +1,70 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "lambda_functions" / "worker"))
+
+from rate_limiter import EndpointLimit, EndpointRateLimiter, TokenBucket  # noqa: E402
+from shared_budget import SharedRateLimiter, SQLiteBudgetBackend  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_reserves_full_wait_beyond_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, burst=10, clock=clock)
+
+    waits = [bucket.reserve() for _ in range(15)]
+
+    assert waits[:10] == [0.0] * 10
+    # Sin tope de 500 ms: la 15ª request espera exactamente 0.5 s de reposición
+    assert abs(waits[-1] - 0.5) < 1e-9
+    assert bucket.stats()["waited"] == 5
+
+
+def test_endpoint_weights_and_penalty():
+    clock = FakeClock()
+    limiter = EndpointRateLimiter(
+        endpoint_limits={"/api/mix/v1/order/history": EndpointLimit(rate=4, burst=4, weight=2)},
+        default_limits={"spot": EndpointLimit(rate=10, burst=10)},
+        clock=clock,
+    )
+
+    assert limiter.reserve("/api/mix/v1/order/history") == 0.0
+    assert limiter.reserve("/api/mix/v1/order/history") == 0.0
+    # El bucket (peso 2) está vacío; un endpoint spot desconocido no se ve afectado
+    assert limiter.reserve("/api/mix/v1/order/history") == 0.5
+    assert limiter.reserve("/api/v2/spot/other") == 0.0
+
+    limiter.penalize("/api/v2/spot/other", 1.0)
+    assert abs(limiter.reserve("/api/v2/spot/other") - 1.1) < 1e-9
+    assert limiter.stats()["spot"]["throttled"] == 1
+
+
+def test_shared_budget_caps_aggregate_rate_across_workers(tmp_path):
+    clock = FakeClock()
+    backend = SQLiteBudgetBackend(str(tmp_path / "budget.sqlite"))
+
+    def worker():
+        local = EndpointRateLimiter(
+            endpoint_limits={},
+            default_limits={"futures": EndpointLimit(rate=10, burst=10)},
+            clock=clock,
+        )
+        return SharedRateLimiter(local, backend, namespace="test", lease_size=1, clock=clock)
+
+    workers = [worker(), worker()]
+    waits = [w.reserve("/api/mix/v1/order/history") for _ in range(8) for w in workers]
+
+    # Cada worker por sí solo estaría dentro de su ráfaga local (8 < 10),
+    # pero juntos consumen 16 tokens de un presupuesto común de 10
+    assert waits[:10] == [0.0] * 10
+    assert abs(waits[-1] - 0.6) < 1e-9
+
+    workers[0].penalize("/api/mix/v1/order/history", 2.0)
+    assert workers[1].reserve("/api/mix/v1/order/history") > 2.0
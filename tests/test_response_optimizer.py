@@ -0,0 +1,43 @@
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1] / "lambda_functions"
+sys.path.insert(0, str(ROOT / "common"))
+sys.path.insert(0, str(ROOT / "worker"))
+
+from response_optimizer import InlinePacker, optimize_orders_response, pack_orders_inline  # noqa: E402
+from result_writer import inline_orders  # noqa: E402
+
+
+def _orders(n):
+    return [{"orderId": str(i), "symbol": "BTCUSDT", "cTime": str(1000 + i), "side": "buy", "note": "ñ"} for i in range(n)]
+
+
+def test_plain_size_matches_serialized_response():
+    packer = InlinePacker(10_000, compress=False)
+    for order in _orders(5):
+        assert packer.add(order)
+
+    fields = packer.finish()
+
+    assert packer.size == len(json.dumps(fields["orders"]).encode("utf-8"))
+
+
+def test_compressed_roundtrip_and_exact_limit():
+    orders = _orders(40)
+    fields = pack_orders_inline(orders, 10_000)
+    size = len(fields["orders_gz"])
+
+    assert inline_orders(fields) == sorted(orders, key=lambda o: int(o["cTime"]), reverse=True)
+    assert pack_orders_inline(orders, size) is not None
+    assert pack_orders_inline(orders, size - 1) is None
+    assert pack_orders_inline(orders, 0) is None
+
+
+def test_optimize_without_s3_packs_inline_or_truncates():
+    inline = optimize_orders_response("BTCUSDT", _orders(200))
+    truncated = optimize_orders_response("BTCUSDT", _orders(200), max_bytes=100)
+
+    assert inline["data_location"] == "inline" and len(inline_orders(inline)) == 200
+    assert truncated["data_location"] == "none" and truncated["truncated"]
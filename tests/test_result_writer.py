@@ -0,0 +1,98 @@
+import io
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "lambda_functions" / "common"))
+
+import result_writer  # noqa: E402
+from result_writer import PartitionedWriter, S3NdjsonWriter, iter_orders, select_partitions  # noqa: E402
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.uploads["u1"] = {}
+        return {"UploadId": "u1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+
+
+def test_multipart_gzip_ndjson_roundtrip(monkeypatch):
+    monkeypatch.setattr(result_writer, "MIN_PART_SIZE", 1)
+    s3 = FakeS3()
+    orders = [{"orderId": str(i), "symbol": "BTCUSDT", "price": f"{i * 1.37:.4f}", "cTime": str(i)} for i in range(20000)]
+
+    with S3NdjsonWriter(s3, "bucket", "per-symbol/BTCUSDT/x.ndjson.gz", part_size=4096) as writer:
+        writer.write_many(orders)
+
+    assert writer.stats["parts"] > 1
+    assert writer.stats["bytes"] < writer.stats["raw_bytes"]
+    body = io.BytesIO(s3.objects["per-symbol/BTCUSDT/x.ndjson.gz"])
+    assert list(iter_orders(body, "per-symbol/BTCUSDT/x.ndjson.gz")) == orders
+
+
+def test_small_result_uses_single_put():
+    s3 = FakeS3()
+    with S3NdjsonWriter(s3, "bucket", "k.ndjson.gz") as writer:
+        writer.write({"orderId": "1"})
+
+    assert s3.uploads == {}
+    assert list(iter_orders(io.BytesIO(s3.objects["k.ndjson.gz"]), "k.ndjson.gz")) == [{"orderId": "1"}]
+
+
+def test_partitioned_writer_splits_by_symbol_and_day():
+    s3 = FakeS3()
+    day = 86_400_000
+    orders = [
+        {"orderId": "1", "symbol": "BTCUSDT", "cTime": str(2 * day + 5)},
+        {"orderId": "2", "symbol": "ETHUSDT", "cTime": str(2 * day + 1)},
+        {"orderId": "3", "symbol": "BTCUSDT", "cTime": str(day + 9)},
+        {"orderId": "4", "symbol": "BTCUSDT", "cTime": str(day + 3)},
+        {"orderId": "5", "symbol": "BTCUSDT", "cTime": str(2 * day)},  # día repetido: parte nueva
+    ]
+
+    with PartitionedWriter(s3, "bucket", "results/run") as writer:
+        writer.write_many(orders)
+    manifest = writer.manifest()
+
+    assert [(p["symbol"], p["date"], p["count"]) for p in manifest["partitions"]] == [
+        ("BTCUSDT", "1970-01-02", 2), ("BTCUSDT", "1970-01-03", 1), ("BTCUSDT", "1970-01-03", 1), ("ETHUSDT", "1970-01-03", 1),
+    ]
+    btc = manifest["partitions"][0]
+    assert (btc["min_ctime"], btc["max_ctime"]) == (day + 3, day + 9)
+    assert btc["key"] == "results/run/symbol=BTCUSDT/date=1970-01-02/part-00000.ndjson.gz"
+    assert [o["orderId"] for o in iter_orders(io.BytesIO(s3.objects[btc["key"]]), btc["key"])] == ["3", "4"]
+    assert select_partitions(manifest, ["BTCUSDT"], start_ms=day, end_ms=2 * day - 1) == [btc]
+
+
+def test_futures_orders_are_partitioned_and_selected_by_base_symbol():
+    s3 = FakeS3()
+    day = 86_400_000
+    orders = [
+        {"orderId": "1", "symbol": "BTCUSDT_UMCBL", "_symbol": "BTCUSDT", "cTime": str(day + 9)},
+        {"orderId": "2", "symbol": "BTCUSDT", "_symbol": "BTCUSDT", "cTime": str(day + 5)},
+        {"orderId": "3", "symbol": "ETHUSD_DMCBL", "cTime": str(day + 1)},  # sin _symbol: se quita el sufijo
+    ]
+
+    with PartitionedWriter(s3, "bucket", "results/run") as writer:
+        writer.write_many(orders)
+    manifest = writer.manifest()
+
+    assert [(p["symbol"], p["count"]) for p in manifest["partitions"]] == [("BTCUSDT", 2), ("ETHUSD", 1)]
+    assert [p["symbol"] for p in select_partitions(manifest, ["BTCUSDT"])] == ["BTCUSDT"]
+    assert [p["symbol"] for p in select_partitions(manifest, ["ETHUSD_DMCBL"])] == ["ETHUSD"]
+    # Manifests anteriores particionados por contrato
+    legacy = {"partitions": [{"symbol": "BTCUSDT_UMCBL", "key": "k", "min_ctime": 1, "max_ctime": 2}]}
+    assert select_partitions(legacy, ["BTCUSDT"]) == legacy["partitions"]
@@ -0,0 +1,81 @@
+import gzip
+import io
+import json
+
+from app.services.results_query_service import ResultsQueryService
+from lambda_functions.common.result_writer import PartitionedWriter
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.gets = []
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.gets.append(Key)
+        body = self.objects[Key]
+        if Range:
+            start, end = map(int, Range[len("bytes="):].split("-"))
+            body = body[start:end + 1]
+        return {"Body": io.BytesIO(body)}
+
+
+def test_query_prunes_partitions_and_caches_them(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    s3 = FakeS3()
+    day = 86_400_000
+    orders = [
+        {"orderId": str(i), "symbol": symbol, "side": "buy" if i % 2 else "sell", "cTime": str(ctime)}
+        for i, (symbol, ctime) in enumerate(sorted(
+            [(s, d * day + h) for s in ("BTCUSDT", "ETHUSDT", "XRPUSDT") for d in (1, 2, 3) for h in (100, 200, 300)],
+            key=lambda x: -x[1]))
+    ]
+    with PartitionedWriter(s3, "bucket", "results/run") as writer:
+        writer.write_many(orders)
+    s3.put_object("bucket", writer.manifest_key, json.dumps(writer.manifest()).encode())
+
+    service = ResultsQueryService()
+    service.s3_client = s3
+    uri = f"s3://bucket/{writer.manifest_key}"
+
+    first = service.query(uri, ["BTCUSDT", "ETHUSDT"], start_ms=2 * day, end_ms=3 * day - 1, limit=4)
+    second = service.query(uri, ["BTCUSDT", "ETHUSDT"], start_ms=2 * day, end_ms=3 * day - 1, side="sell")
+
+    assert (first["partitions_total"], first["partitions_scanned"]) == (9, 2)
+    assert [int(o["cTime"]) for o in first["orders"]] == [2 * day + 300] * 2 + [2 * day + 200] * 2
+    assert first["pagination"]["has_more"] is True
+    assert {o["side"] for o in second["orders"]} == {"sell"} and len(second["orders"]) == 3
+    assert len([k for k in s3.gets if k != writer.manifest_key]) == 2  # la segunda consulta sale del cache
+
+
+def test_query_on_composed_result_merges_symbols_by_byte_range(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    s3 = FakeS3()
+    # Resultado compuesto: ordenado por símbolo y en cTime DESC solo dentro de cada uno
+    runs = {"BTCUSDT": [300, 200, 100], "ETHUSDT": [250, 150, 50], "XRPUSDT": [90, 80]}
+    body, entries = b"", []
+    for symbol, ctimes in runs.items():
+        member = gzip.compress(b"".join(
+            json.dumps({"orderId": f"{symbol}-{c}", "symbol": symbol, "cTime": str(c)}).encode() + b"\n" for c in ctimes
+        ))
+        entries.append({"symbol": symbol, "count": len(ctimes), "offset": len(body), "length": len(member),
+                        "max_ctime": ctimes[0], "min_ctime": ctimes[-1]})
+        body += member
+    s3.put_object("bucket", "results/run.ndjson.gz", body)
+    s3.put_object("bucket", "results/run.ndjson.gz.manifest.json",
+                  json.dumps({"s3_key": "results/run.ndjson.gz", "codec": "gzip", "entries": entries}).encode())
+
+    service = ResultsQueryService()
+    service.s3_client = s3
+    uri = "s3://bucket/results/run.ndjson.gz"
+
+    composed = service.query(uri, start_ms=120, manifest_uri=uri + ".manifest.json")
+    plain = service.query(uri, start_ms=120)
+
+    assert [int(o["cTime"]) for o in composed["orders"]] == [300, 250, 200, 150]
+    assert (composed["layout"], composed["partitions_total"], composed["partitions_scanned"]) == ("composed", 3, 2)
+    # Sin manifest no se corta en el primer cTime fuera de rango: ETHUSDT viene después de BTCUSDT 100
+    assert sorted(int(o["cTime"]) for o in plain["orders"]) == [150, 200, 250, 300]
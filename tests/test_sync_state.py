@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "lambda_functions" / "worker"))
+
+from sync_state import SymbolSyncState, stream_watermark  # noqa: E402
+
+
+def test_delta_merge_and_watermarks():
+    state = SymbolSyncState(symbol="BTCUSDT")
+    first = [
+        {"orderId": "1", "cTime": "1000", "_market": "spot_history", "status": "live"},
+        {"orderId": "2", "cTime": "2000", "_market": "spot_history"},
+    ]
+    state.merge(first)
+    state.advance({"spot:normal": stream_watermark(first, synced_to_ms=5000)})
+
+    assert state.delta_starts(overlap_ms=1000) == {"spot:normal": 4000}
+
+    # El delta repite una orden (actualizada) y trae una nueva
+    delta = [
+        {"orderId": "1", "cTime": "1000", "_market": "spot_history", "status": "filled"},
+        {"orderId": "3", "cTime": "6000", "_market": "spot_history"},
+    ]
+    assert state.merge(delta) == 1
+    assert [o["orderId"] for o in state.orders] == ["3", "2", "1"]
+    assert state.orders[-1]["status"] == "filled"
+
+    # Una corriente sin órdenes nuevas avanza synced_to_ms pero conserva el último cTime/orderId
+    state.advance({"spot:normal": stream_watermark([], synced_to_ms=9000)})
+    assert state.watermarks["spot:normal"] == {"cTime": 2000, "orderId": "2", "synced_to_ms": 9000}
@@ -0,0 +1,271 @@
+import asyncio
+import importlib.util
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+WORKER_DIR = Path(__file__).resolve().parents[1] / "lambda_functions" / "worker"
+
+
+def _load_worker():
+    os.environ.setdefault("BITGET_API_KEY", "test-key")
+    os.environ.setdefault("BITGET_API_SECRET", "test-secret")
+    os.environ.setdefault("BITGET_API_PASSPHRASE", "test-passphrase")
+    os.environ.setdefault("CONTRACT_CATALOG_PATH", "")
+    if str(WORKER_DIR) not in sys.path:
+        sys.path.insert(0, str(WORKER_DIR))
+    spec = importlib.util.spec_from_file_location("worker_app", WORKER_DIR / "app.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_streams_run_concurrently_on_shared_engine():
+    worker = _load_worker()
+    from engine import AsyncEngine
+
+    contract_requests = []
+
+    async def handle(request):
+        await asyncio.sleep(0.2)
+        if request.url.path.endswith("/market/contracts"):
+            product_type = request.url.params["productType"].upper()
+            contract_requests.append(product_type)
+            symbols = ["BTCUSDT_" + product_type] + (["ETHUSDT_UMCBL"] if product_type == "UMCBL" else [])
+            return httpx.Response(200, json={"code": "00000", "data": [{"symbol": s} for s in symbols]})
+        if "/spot/" in request.url.path:
+            return httpx.Response(200, json={"code": "00000", "data": [
+                {"orderId": "1", "cTime": str(int(time.time() * 1000) - 1000)}
+            ]})
+        return httpx.Response(200, json={"code": "00000", "data": {"orderList": [{"orderId": "9"}], "nextFlag": False}})
+
+    engine = AsyncEngine(timeout=5, retries=0, transport=httpx.MockTransport(handle))
+    worker._engine = engine
+    worker.init_timer(30)
+    try:
+        # Contenedor "warm": el catálogo de contratos ya está cargado
+        engine.run(worker.contract_catalog.refresh())
+
+        started = time.time()
+        collected = engine.run(worker.collect_symbol_orders("BTCUSDT", None, None))
+        elapsed = time.time() - started
+        client = engine._client
+
+        # Segunda invocación "warm": mismo cliente HTTP y catálogo en caché;
+        # ETHUSDT solo existe como UMCBL, los otros contratos no se consultan
+        eth = engine.run(worker.collect_symbol_orders("ETHUSDT", None, None))
+        assert engine._client is client
+        assert sorted(contract_requests) == ["CMCBL", "DMCBL", "UMCBL"]
+        assert {o["_contractType"] for o in eth.orders if o["_market"] == "futures_history"} == {"UMCBL"}
+    finally:
+        engine.close()
+
+    # spot normal + spot tpsl + 3 contratos de futuros
+    orders = collected.orders
+    assert len(orders) == 5
+    assert collected.incomplete == {}
+    assert set(collected.watermarks) == {"spot:normal", "spot:tpsl", "futures:BTCUSDT_UMCBL",
+                                         "futures:BTCUSDT_DMCBL", "futures:BTCUSDT_CMCBL"}
+    assert {o["_market"] for o in orders} == {"spot_history", "futures_history"}
+    # Las 5 corrientes corren en paralelo: ~1 request de latencia, no 5
+    assert elapsed < 0.6
+
+
+def test_probe_keeps_only_symbols_with_activity():
+    worker = _load_worker()
+    from engine import AsyncEngine
+
+    async def handle(request):
+        params = request.url.params
+        if request.url.path.endswith("/market/contracts"):
+            return httpx.Response(200, json={"code": "00000", "data": [{"symbol": "BTCUSDT_UMCBL"}]})
+        if "/spot/" in request.url.path:
+            data = [{"orderId": "1"}] if params["symbol"] == "ETHUSDT" else []
+            return httpx.Response(200, json={"code": "00000", "data": data})
+        order_list = [{"orderId": "9"}] if params["symbol"] == "BTCUSDT_UMCBL" else None
+        return httpx.Response(200, json={"code": "00000", "data": {"orderList": order_list}})
+
+    worker._engine = AsyncEngine(timeout=5, retries=0, transport=httpx.MockTransport(handle))
+    worker.init_timer(30)
+    try:
+        result = worker.handler({"mode": "probe", "symbols": ["BTCUSDT", "ETHUSDT", "XRPUSDT"]}, None)
+    finally:
+        worker._engine.close()
+
+    assert result["active"] == ["BTCUSDT", "ETHUSDT"]
+    assert result["inactive"] == ["XRPUSDT"]
+    assert result["unprobed"] == []
+
+
+def test_connect_errors_are_retried_only_by_the_engine_loop(monkeypatch):
+    _load_worker()
+    from engine import AsyncEngine
+
+    attempts = []
+
+    class FailingTransport(httpx.AsyncBaseTransport):
+        def __init__(self, retries=0, **kwargs):
+            self.retries = retries
+
+        async def handle_async_request(self, request):
+            attempts.append(self.retries)
+            raise httpx.ConnectError("connection refused", request=request)
+
+    monkeypatch.setattr(httpx, "AsyncHTTPTransport", FailingTransport)
+    engine = AsyncEngine(timeout=5, retries=2, backoff_factor=0)
+    try:
+        engine.run(engine.get("https://api.bitget.com/x", {}))
+        raise AssertionError("se esperaba ConnectError")
+    except httpx.ConnectError:
+        pass
+    finally:
+        engine.close()
+
+    assert attempts == [0, 0, 0]  # retries + 1 intentos, ninguno extra en el transporte
+
+
+def test_resumed_invocation_that_fails_keeps_previous_file_and_continuation(monkeypatch):
+    worker = _load_worker()
+    from engine import AsyncEngine
+
+    async def failing_collect(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(worker, "collect_symbol_orders", failing_collect)
+    monkeypatch.setattr(worker, "S3", object())
+    monkeypatch.setattr(worker, "RESULTS_BUCKET", "bucket")
+    worker._engine = AsyncEngine(timeout=5, retries=0, transport=httpx.MockTransport(lambda r: httpx.Response(500)))
+    worker.init_timer(30)
+    resume = {"spot:normal": {"start_ms": 0, "end_ms": 1000}}
+    try:
+        result = worker.handler({"symbol": "BTCUSDT", "resume": resume, "attempt": 1,
+                                 "previous_s3_key": "per-symbol/BTCUSDT/x.ndjson.gz", "previous_count": 12}, None)
+    finally:
+        worker._engine.close()
+
+    assert (result["s3_key"], result["count"], result["data_location"]) == ("per-symbol/BTCUSDT/x.ndjson.gz", 12, "s3")
+    assert result["continuation"]["resume"] == resume and result["continuation"]["attempt"] == 2
+    assert result["continuation"]["previous_s3_key"] == "per-symbol/BTCUSDT/x.ndjson.gz"
+
+
+def test_pages_are_spooled_and_merged_with_the_previous_file(monkeypatch, tmp_path):
+    import gzip
+    import json
+
+    from tests.test_kway_merge import FakeS3
+
+    worker = _load_worker()
+    from engine import AsyncEngine
+    from result_writer import S3NdjsonWriter
+
+    now = int(time.time() * 1000)
+    spooled = []
+
+    async def handle(request):
+        if "/spot/" in request.url.path:
+            return httpx.Response(200, json={"code": "00000", "data": [
+                {"orderId": "2", "cTime": str(now - 2000)}, {"orderId": "1", "cTime": str(now - 5000)},
+            ]})
+        return httpx.Response(500)
+
+    s3 = FakeS3()
+    with S3NdjsonWriter(s3, "bucket", "per-symbol/BTCUSDT/prev.ndjson.gz") as writer:
+        writer.write_many([{"orderId": "3", "cTime": str(now - 3000), "_market": "spot_history"},
+                           {"orderId": "1", "cTime": str(now - 9000), "_market": "spot_history"}])
+    original_add_run = worker.OrderSpool.add_run
+    monkeypatch.setattr(worker.OrderSpool, "add_run",
+                        lambda self, orders, presorted=False: spooled.append(presorted) or original_add_run(self, orders, presorted))
+    monkeypatch.setattr(worker, "S3", s3)
+    monkeypatch.setattr(worker, "RESULTS_BUCKET", "bucket")
+    monkeypatch.setattr(worker, "INLINE_RESULTS_MAX_BYTES", 0)
+    monkeypatch.setattr(worker, "SPOOL_DIR", str(tmp_path))
+    worker._engine = AsyncEngine(timeout=5, retries=0, transport=httpx.MockTransport(handle))
+    worker.init_timer(30)
+    resume = {"spot:normal": {"end_ms": now, "windows": [{"start_ms": now - 60_000, "end_ms": now}]}}
+    try:
+        result = worker.handler({"symbol": "BTCUSDT", "resume": resume, "attempt": 1,
+                                 "previous_s3_key": "per-symbol/BTCUSDT/prev.ndjson.gz"}, None)
+    finally:
+        worker._engine.close()
+
+    body = gzip.decompress(s3.objects[result["s3_key"]][0])
+    stored = [json.loads(line) for line in body.splitlines()]
+    assert [o["orderId"] for o in stored] == ["2", "3", "1"]  # cTime DESC, el orderId 1 nuevo gana
+    assert stored[2]["cTime"] == str(now - 5000) and stored[0]["_market"] == "spot_history"
+    assert result["count"] == 3 and spooled == [False, True]
+    assert "per-symbol/BTCUSDT/prev.ndjson.gz" not in s3.objects
+    assert list(tmp_path.iterdir()) == []  # el spool se borra al terminar
+
+
+def test_spool_keeps_spot_and_futures_orders_with_the_same_id(tmp_path):
+    _load_worker()
+    from order_spool import OrderSpool
+
+    with OrderSpool(str(tmp_path)) as spool:
+        spool.add_run([{"orderId": "7", "cTime": "3000", "_market": "spot_history"},
+                       {"orderId": "8", "cTime": "1000", "_market": "spot_history"}])
+        added = spool.add_run([{"orderId": "7", "cTime": "2000", "_market": "futures_history"},
+                               {"orderId": "8", "cTime": "1000", "_market": "spot_history"}])
+
+        assert added == 1 and len(spool) == 3
+        assert [(o["_market"], o["orderId"]) for o in spool] == [
+            ("spot_history", "7"), ("futures_history", "7"), ("spot_history", "8"),
+        ]
+
+
+def test_sync_mode_streams_the_stored_history_through_the_spool(monkeypatch, tmp_path):
+    import json
+
+    from tests.test_kway_merge import FakeS3
+
+    worker = _load_worker()
+    from engine import AsyncEngine
+    from sync_state import SyncStore
+
+    class ReadingS3(FakeS3):
+        class exceptions:
+            NoSuchKey = KeyError
+
+        def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+            super().put_object(Bucket, Key, Body if isinstance(Body, bytes) else Body.read(), Metadata)
+
+    now = int(time.time() * 1000)
+    spooled = []
+
+    async def handle(request):
+        if request.url.path.endswith("/spot/trade/history-orders"):
+            return httpx.Response(200, json={"code": "00000", "data": [
+                {"orderId": "2", "cTime": str(now - 2000), "status": "filled"},
+            ]})
+        return httpx.Response(500)
+
+    s3 = ReadingS3()
+    stored = [{"orderId": "3", "cTime": str(now - 3000), "_market": "spot_history"},
+              {"orderId": "2", "cTime": str(now - 4000), "_market": "spot_history", "status": "live"}]
+    s3.put_object("bucket", "sync-state/BTCUSDT.json", json.dumps({
+        "symbol": "BTCUSDT", "orders": stored,
+        "watermarks": {"spot:normal": {"cTime": now - 3000, "orderId": "3", "synced_to_ms": now - 60_000}},
+    }).encode("utf-8"))
+    original_add_run = worker.OrderSpool.add_run
+    monkeypatch.setattr(worker.OrderSpool, "add_run",
+                        lambda self, orders, presorted=False: spooled.append(presorted) or original_add_run(self, orders, presorted))
+    monkeypatch.setattr(worker, "S3", s3)
+    monkeypatch.setattr(worker, "SYNC_STORE", SyncStore(s3, "bucket"))
+    monkeypatch.setattr(worker, "RESULTS_BUCKET", "bucket")
+    monkeypatch.setattr(worker, "SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(worker, "INLINE_RESULTS_COMPRESS", False)
+    worker._engine = AsyncEngine(timeout=5, retries=0, transport=httpx.MockTransport(handle))
+    worker.init_timer(30)
+    try:
+        result = worker.handler({"symbol": "BTCUSDT", "sync": True, "includeFutures": False}, None)
+    finally:
+        worker._engine.close()
+
+    state = json.loads(s3.objects["sync-state/BTCUSDT.json"][0])
+    assert [(o["orderId"], o.get("status")) for o in state["orders"]] == [("2", "filled"), ("3", None)]
+    assert state["count"] == 2 and state["watermarks"]["spot:normal"]["synced_to_ms"] > now - 60_000
+    assert spooled[-1] is True and spooled.count(True) == 1  # el historial entra al spool ya ordenado
+    assert result["count"] == 2 and [o["orderId"] for o in result["orders"]] == ["2", "3"]